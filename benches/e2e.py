@@ -0,0 +1,184 @@
+# End-to-end benchmark of `clone`, `sort` and `profile-slots` against the
+# local mock RPC. Each command runs in its own process, and reports its wall
+# time, the requests and bytes it pulled per second, and its peak RSS.
+#
+#     python -m benches.e2e --programs 2000 --concurrency 8
+#
+# `--output` appends one JSON line per command, to track results over time.
+
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import requests
+
+from benches.mock_rpc import dataset_options, serve
+
+COMMANDS = ["clone", "sort", "profile-slots"]
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def run_command(args, cwd):
+    """
+    Runs `python -m cloner` with `args`, and returns its wall time and peak
+    RSS in bytes.
+    """
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "cloner", *args],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    stderr = process.stderr.read()
+    (_, status, usage) = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    # Reaped above, so `Popen` must not wait for it again.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise click.ClickException(
+            f"`{' '.join(args)}` failed:\n{stderr.decode(errors='replace')}"
+        )
+    # `ru_maxrss` is in KiB on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (elapsed, usage.ru_maxrss * scale)
+
+@click.command()
+@dataset_options
+@click.option(
+    "--concurrency",
+    type=int,
+    default=1,
+    help="Concurrency passed to every command.",
+)
+@click.option(
+    "--command",
+    "commands",
+    type=click.Choice(COMMANDS),
+    multiple=True,
+    default=COMMANDS,
+    help="Commands to run, in order. `sort` needs `clone` first.",
+)
+@click.option(
+    "--arg",
+    "extra_args",
+    type=str,
+    multiple=True,
+    help="Extra argument for one command, as COMMAND=ARG, such as "
+    "clone=--single-pass.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to append results to, as JSON lines.",
+)
+def main(
+    programs,
+    elf_size,
+    elf_size_sigma,
+    latency,
+    rate_limit,
+    max_rps,
+    error_rate,
+    slot_lag,
+    compress,
+    seed,
+    concurrency,
+    commands,
+    extra_args,
+    output,
+):
+    command_args = {command: [] for command in COMMANDS}
+    for extra_arg in extra_args:
+        (command, _, arg) = extra_arg.partition("=")
+        if command not in command_args:
+            raise click.BadParameter(
+                f"Unknown command in {extra_arg}",
+                param_hint="--arg",
+            )
+        command_args[command].append(arg)
+
+    # The server runs in its own process, which keeps the commands forked
+    # from this one from inheriting its memory, and from competing with it
+    # for the GIL.
+    context = multiprocessing.get_context("spawn")
+    (conn, child_conn) = context.Pipe()
+    server = context.Process(
+        target=serve,
+        args=(
+            child_conn,
+            (programs, elf_size, elf_size_sigma, 0.05, 0.15, seed),
+            (
+                latency,
+                rate_limit,
+                compress,
+                error_rate,
+                slot_lag,
+                max_rps,
+            ),
+        ),
+        daemon=True,
+    )
+    server.start()
+    (url, elf_bytes) = conn.recv()
+    print(
+        f"Mock RPC with {programs} programs "
+        f"({elf_bytes / 1e6:.1f} MB of ELFs), "
+        f"{latency * 1000:.0f}ms latency, {rate_limit:.0%} rate limited"
+    )
+    print(
+        f"{'command':<14} {'wall (s)':>9} {'requests':>9} {'req/s':>8} "
+        f"{'MB/s':>8} {'429s':>6} {'peak RSS (MB)':>14}"
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for command in commands:
+            args = [
+                command,
+                "bench",
+                "--url", url,
+                "--concurrency", str(concurrency),
+                *command_args[command],
+            ]
+            before = requests.get(f"{url}/stats").json()
+            (elapsed, peak_rss) = run_command(args, cwd)
+            after = requests.get(f"{url}/stats").json()
+            stats = {k: after[k] - before[k] for k in after}
+            result = {
+                "command": command,
+                "programs": programs,
+                "elf_size": elf_size,
+                "latency": latency,
+                "rate_limit": rate_limit,
+                "concurrency": concurrency,
+                "args": command_args[command],
+                "wall_seconds": elapsed,
+                "requests_per_second": stats["requests"] / elapsed,
+                "bytes_per_second": stats["bytes_out"] / elapsed,
+                "peak_rss_bytes": peak_rss,
+                **stats,
+            }
+            results.append(result)
+            print(
+                f"{command:<14} {elapsed:9.2f} {stats['requests']:9} "
+                f"{result['requests_per_second']:8.1f} "
+                f"{result['bytes_per_second'] / 1e6:8.1f} "
+                f"{stats['rate_limited']:6} {peak_rss / 1e6:14.1f}"
+            )
+    server.terminate()
+    if output is not None:
+        with open(output, "a") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
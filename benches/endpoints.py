@@ -0,0 +1,255 @@
+# Checks load balancing and failover across several `--url`s against local
+# mock RPCs serving the same synthetic programs. `clone` and `sort` run once
+# against a single healthy mock, then against a pool of a healthy mock, one
+# answering HTTP 500 to a share of requests, a rate-limited one, one lagging
+# behind the others, and a URL nothing listens on. Fails unless both runs
+# leave the same ELFs and tables, and the dead URL was left out for a
+# cooldown.
+#
+#     python -m benches.endpoints --programs 1000 --concurrency 4
+
+from hashlib import sha256
+import multiprocessing
+import os
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import requests
+
+from benches.mock_rpc import serve
+
+COMMANDS = ["clone", "sort"]
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def start_server(context, dataset_args, server_args):
+    """
+    Serves a mock RPC from its own process, and returns the process and the
+    server URL.
+    """
+    (conn, child_conn) = context.Pipe()
+    process = context.Process(
+        target=serve,
+        args=(child_conn, dataset_args, server_args),
+        daemon=True,
+    )
+    process.start()
+    (url, elf_bytes) = conn.recv()
+    return (process, url, elf_bytes)
+
+def dead_url():
+    """
+    Returns the URL of a local port nothing listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+def run_command(args, cwd):
+    """
+    Runs `python -m cloner` with `args`, and returns its wall time and what
+    it printed to stderr.
+    """
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "cloner", *args],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise click.ClickException(
+            f"`{' '.join(args)}` failed:\n{result.stderr}"
+        )
+    return (elapsed, result.stderr)
+
+def bundle_contents(path):
+    """
+    Returns the SHA-256 of each ELF of a bundle, and the rows of each of its
+    tables, sorted, as lookups spread across endpoints finish in any order.
+    `version.txt`, which holds the date, is left out.
+    """
+    contents = {}
+    for file in sorted(path.rglob("*")):
+        name = str(file.relative_to(path))
+        if file.suffix == ".elf":
+            contents[name] = sha256(file.read_bytes()).hexdigest()
+        elif file.suffix == ".csv":
+            contents[name] = sorted(file.read_text().splitlines())
+    return contents
+
+@click.command()
+@click.option(
+    "--programs",
+    type=int,
+    default=1000,
+    help="Number of programs across all loaders.",
+)
+@click.option(
+    "--elf-size",
+    type=int,
+    default=16 << 10,
+    help="Median ELF size in bytes.",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    help="Seed of the synthetic dataset.",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=4,
+    help="Concurrency passed to every command.",
+)
+@click.option(
+    "--latency",
+    type=float,
+    default=0.0,
+    help="Seconds every mock delays every request.",
+)
+@click.option(
+    "--error-rate",
+    type=float,
+    default=0.3,
+    help="Share of requests the flaky mock answers with HTTP 500.",
+)
+@click.option(
+    "--rate-limit",
+    type=float,
+    default=0.3,
+    help="Share of requests the rate-limited mock answers with HTTP 429.",
+)
+@click.option(
+    "--rps",
+    type=float,
+    default=50.0,
+    help="Requests per second allowed to the rate-limited mock.",
+)
+@click.option(
+    "--slot-lag",
+    type=int,
+    default=50,
+    help="Slots the lagging mock is behind the others.",
+)
+def main(
+    programs,
+    elf_size,
+    seed,
+    concurrency,
+    latency,
+    error_rate,
+    rate_limit,
+    rps,
+    slot_lag,
+):
+    # Name, URL fragment, and server latency, rate limit, compression, error
+    # rate and slot lag.
+    specs = [
+        ("healthy", "weight=2", (latency, 0.0, False, 0.0, 0)),
+        ("flaky", "", (latency, 0.0, False, error_rate, 0)),
+        ("limited", f"rps={rps:g}", (latency, rate_limit, False, 0.0, 0)),
+        ("lagging", "", (latency, 0.0, False, 0.0, slot_lag)),
+    ]
+    context = multiprocessing.get_context("spawn")
+    dataset_args = (programs, elf_size, 1.0, 0.05, 0.15, seed)
+    servers = []
+    for (name, fragment, server_args) in specs:
+        (process, url, elf_bytes) = start_server(
+            context,
+            dataset_args,
+            server_args,
+        )
+        servers.append((name, process, url, fragment))
+    down = dead_url()
+    print(
+        f"{len(servers)} mock RPCs with {programs} programs "
+        f"({elf_bytes / 1e6:.1f} MB of ELFs), and a dead URL at {down}"
+    )
+
+    healthy_url = servers[0][2]
+    pool_urls = [
+        f"{url}#{fragment}" if fragment else url
+        for (_, _, url, fragment) in servers
+    ] + [down]
+    print(f"{'run':<8} {'command':<8} {'wall (s)':>9}")
+    contents = {}
+    with tempfile.TemporaryDirectory() as cwd:
+        for (bundle, urls) in (("single", [healthy_url]), ("pool", pool_urls)):
+            before = {
+                url: requests.get(f"{url}/stats").json()
+                for (_, _, url, _) in servers
+            }
+            stderr = ""
+            for command in COMMANDS:
+                args = [
+                    command,
+                    bundle,
+                    *(arg for url in urls for arg in ("--url", url)),
+                    "--concurrency", str(concurrency),
+                    "--rate-limit-buffer", "0",
+                ]
+                (elapsed, output) = run_command(args, cwd)
+                stderr += output
+                print(f"{bundle:<8} {command:<8} {elapsed:9.2f}")
+            contents[bundle] = bundle_contents(Path(cwd) / "bundles" / bundle)
+        pool_stats = {
+            url: {
+                k: v - before[url][k]
+                for (k, v) in requests.get(f"{url}/stats").json().items()
+            }
+            for (_, _, url, _) in servers
+        }
+    for (_, process, _, _) in servers:
+        process.terminate()
+
+    print("Pool requests by endpoint:")
+    print(
+        f"    {'endpoint':<8} {'requests':>9} {'429s':>6} {'500s':>6} "
+        f"{'behind':>7}"
+    )
+    for (name, _, url, _) in servers:
+        stats = pool_stats[url]
+        print(
+            f"    {name:<8} {stats['requests']:9} {stats['rate_limited']:6} "
+            f"{stats['server_errors']:6} {stats['behind']:7}"
+        )
+
+    failures = []
+    (single, pool) = (contents["single"], contents["pool"])
+    differing = sorted(
+        name for name in set(single) | set(pool)
+        if single.get(name) != pool.get(name)
+    )
+    if len(differing) > 0:
+        failures.append(
+            f"{len(differing)} files differ between the single-endpoint "
+            f"and pool runs, such as {', '.join(differing[:5])}"
+        )
+    if f"WARN: {down} is failing" not in stderr:
+        failures.append(f"The dead URL {down} was never left out")
+    for (name, _, url, _) in servers:
+        if pool_stats[url]["requests"] == 0:
+            failures.append(f"The {name} mock served no requests")
+    if slot_lag > 0 and pool_stats[servers[3][2]]["behind"] == 0:
+        failures.append("The lagging mock was never asked for a later slot")
+    if len(failures) > 0:
+        raise click.ClickException("\n".join(failures))
+    print(
+        f"Both runs left the same {len(single)} ELFs and tables, and the "
+        "dead URL was left out for a cooldown"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Startup benchmark of the CLI. Times `python -m cloner <command> --help` in a
+# fresh interpreter for each command, and measures the imports each command
+# pays for once invoked. Fails if a command loads a heavy dependency it does
+# not use, so a stray top-level import cannot quietly slow down every run.
+#
+#     python -m benches.import_time --repeat 10
+
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Module implementing each command, imported by the CLI only once the command
+# is invoked.
+COMMANDS = {
+    "clone": "cloner.clone",
+    "sort": "cloner.sort",
+    "profile-slots": "cloner.profile",
+    "chart-profiled-slots": "cloner.chart",
+    "analyze-profiles": "cloner.analytics",
+    "verify": "cloner.verify",
+    "pack": "cloner.pack",
+    "unpack": "cloner.pack",
+    "extract": "cloner.pack",
+}
+
+# Slow-loading dependencies, and the commands allowed to import them up front.
+# matplotlib and pandas are only loaded to draw charts and read CSV profiles,
+# and `pyarrow` to read or write Parquet.
+HEAVY_MODULES = {
+    "matplotlib": [],
+    "numpy": ["analyze-profiles"],
+    "pandas": [],
+    "pyarrow": [],
+}
+
+def import_times(args):
+    """
+    Runs Python with `-X importtime` and `args`, and returns its wall time
+    and, for every module imported, its cumulative import time in seconds
+    and whether it was imported at the top level.
+    """
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise click.ClickException(
+            f"`python {' '.join(args)}` failed:\n{result.stderr}"
+        )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        (_, cumulative, name) = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module importing them.
+        modules[name.strip()] = (
+            int(cumulative) / 1e6,
+            len(name) - len(name.lstrip()) == 1,
+        )
+    return (elapsed, modules)
+
+def total_import_time(modules) -> float:
+    return sum(seconds for (seconds, top) in modules.values() if top)
+
+def median_runs(args, repeat):
+    """
+    Runs `import_times(args)` `repeat` times, and returns the median wall and
+    import times and the modules imported.
+    """
+    runs = [import_times(args) for _ in range(repeat)]
+    return (
+        statistics.median(elapsed for (elapsed, _) in runs),
+        statistics.median(total_import_time(m) for (_, m) in runs),
+        set(runs[0][1]),
+    )
+
+@click.command()
+@click.option(
+    "--repeat",
+    type=int,
+    default=5,
+    help="Runs of each command, of which the median is reported.",
+)
+def main(repeat):
+    violations = []
+    print(
+        f"{'command':<22} {'--help (ms)':>12} {'imports (ms)':>13} "
+        f"{'invoked imports (ms)':>21}"
+    )
+    for command in ["", *COMMANDS]:
+        (wall, imports, modules) = median_runs(
+            ["-m", "cloner", *([command] if command else []), "--help"],
+            repeat,
+        )
+        # `--help` loads neither a command's module nor anything heavy.
+        for name in [*COMMANDS.values(), *HEAVY_MODULES]:
+            if name in modules:
+                violations.append(
+                    f"`{command or 'cloner'} --help` imports {name}"
+                )
+        invoked = "-"
+        if command:
+            # Invoking the command imports its module on top of the CLI.
+            (_, invoked_imports, modules) = median_runs(
+                ["-c", f"import cloner.__main__, {COMMANDS[command]}"],
+                repeat,
+            )
+            invoked = f"{invoked_imports * 1000:.0f}"
+            for (name, allowed) in HEAVY_MODULES.items():
+                if name in modules and command not in allowed:
+                    violations.append(f"`{command}` imports {name}")
+        print(
+            f"{command or '(group)':<22} {wall * 1000:12.0f} "
+            f"{imports * 1000:13.0f} {invoked:>21}"
+        )
+    if len(violations) > 0:
+        raise click.ClickException(
+            "Slow imports on startup:\n" + "\n".join(violations)
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Memory and lookup benchmark for program key collections, comparing a list
+# of `(base58 key, slot)` tuples with a KeyTable.
+#
+#     python -m benches.key_table --programs 1000000
+
+import os
+import random
+import time
+import tracemalloc
+
+import click
+
+from cloner.keys import KeyTable, key_str
+
+def measured(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    (size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, size, elapsed)
+
+@click.command()
+@click.option(
+    "--programs",
+    type=int,
+    default=1000000,
+    help="Number of programs to hold.",
+)
+@click.option(
+    "--lookups",
+    type=int,
+    default=100000,
+    help="Number of keys to look up.",
+)
+def main(programs, lookups):
+    raw = [os.urandom(32) for _ in range(programs)]
+
+    (pairs, pairs_size, pairs_time) = measured(lambda: [
+        (key_str(k), i) for (i, k) in enumerate(raw)
+    ])
+    (table, _, table_time) = measured(
+        lambda: KeyTable.from_items((k, i) for (i, k) in enumerate(raw))
+    )
+    del raw
+    wanted = [k for (k, _) in random.sample(pairs, min(lookups, programs))]
+
+    start = time.perf_counter()
+    slots = dict(pairs)
+    found = [slots[k] for k in wanted]
+    dict_time = time.perf_counter() - start
+    del slots
+    start = time.perf_counter()
+    assert [table.slots[table.find(k)] for k in wanted] == found
+    find_time = time.perf_counter() - start
+
+    print(f"{'':>12} {'bytes/key':>10} {'build (s)':>10} {'lookup (s)':>11}")
+    print(
+        f"{'tuples':>12} {pairs_size / programs:10.1f} "
+        f"{pairs_time:10.3f} {dict_time:11.3f}"
+    )
+    print(
+        f"{'KeyTable':>12} {table.nbytes() / programs:10.1f} "
+        f"{table_time:10.3f} {find_time:11.3f}"
+    )
+
+if __name__ == "__main__":
+    main()
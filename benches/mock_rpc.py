@@ -0,0 +1,539 @@
+# Local stand-in for a Solana RPC node, serving a synthetic set of Loader V1,
+# V2 and V3 programs. Used by the end-to-end benchmarks, and can be run on its
+# own to try commands without a live RPC:
+#
+#     python -m benches.mock_rpc --programs 1000 --port 8899
+
+from base64 import b64encode
+import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import json
+import math
+import random
+import threading
+import time
+
+import click
+from base58 import b58decode
+from solders.pubkey import Pubkey
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from cloner.filters import BPF_LOADER_2_PUBKEY, BPF_LOADER_3_PUBKEY, \
+    BPF_LOADER_PUBKEY, ELF_MAGIC
+
+# JSON-RPC error code of reads pinned to a slot the node has not reached.
+MIN_CONTEXT_SLOT_NOT_REACHED = -32016
+
+# ELF bodies are windows into one shared block of random bytes, so a large
+# dataset costs no more memory than a small one.
+POOL_SIZE = 8 << 20
+
+class MockAccount:
+    """
+    Account whose data is a fixed header followed by `elf_size` bytes of ELF,
+    built only for the range a request reads.
+    """
+    def __init__(self, owner, header, elf_size=0, pool_offset=0):
+        self.owner = owner
+        self.header = header
+        self.elf_size = elf_size
+        self.pool_offset = pool_offset
+
+    def __len__(self):
+        return len(self.header) + self.elf_size
+
+    def read(self, pool, start=0, length=None):
+        end = len(self) if length is None else min(len(self), start + length)
+        data = bytearray()
+        if start < len(self.header):
+            data += self.header[start:end]
+        # The ELF is `ELF_MAGIC` followed by pool bytes.
+        elf_start = max(start - len(self.header), 0)
+        elf_end = end - len(self.header)
+        if elf_start < min(elf_end, len(ELF_MAGIC)):
+            data += ELF_MAGIC[elf_start:min(elf_end, len(ELF_MAGIC))]
+        pool_start = max(elf_start, len(ELF_MAGIC))
+        if pool_start < elf_end:
+            offset = self.pool_offset + pool_start
+            data += pool[offset:offset + elf_end - pool_start]
+        return bytes(data)
+
+class MockDataset:
+    """
+    Synthetic programs, with log-normally distributed ELF sizes around
+    `elf_size` bytes. The same `seed` always produces the same dataset.
+    """
+    def __init__(
+        self,
+        programs=1000,
+        elf_size=64 << 10,
+        elf_size_sigma=1.0,
+        v1_share=0.05,
+        v2_share=0.15,
+        seed=0,
+    ):
+        rng = random.Random(seed)
+        self.pool = rng.randbytes(POOL_SIZE) * 2
+        self.slot = 300_000_000
+        self.accounts = {}
+        self.by_owner = {}
+        self.last_slots = {}
+        for i in range(programs):
+            size = int(rng.lognormvariate(math.log(elf_size), elf_size_sigma))
+            size = min(max(size, 1 << 10), POOL_SIZE)
+            pool_offset = rng.randrange(POOL_SIZE)
+            program_id = Pubkey(rng.randbytes(32))
+            draw = rng.random()
+            if draw < v1_share:
+                self._add(program_id, MockAccount(
+                    BPF_LOADER_PUBKEY, b"", size, pool_offset,
+                ))
+            elif draw < v1_share + v2_share:
+                self._add(program_id, MockAccount(
+                    BPF_LOADER_2_PUBKEY, b"", size, pool_offset,
+                ))
+            else:
+                (data_id, _) = Pubkey.find_program_address(
+                    [bytes(program_id)],
+                    Pubkey.from_string(BPF_LOADER_3_PUBKEY),
+                )
+                self._add(program_id, MockAccount(
+                    BPF_LOADER_3_PUBKEY,
+                    b"\x02\x00\x00\x00" + bytes(data_id),
+                ))
+                deploy_slot = rng.randrange(self.slot)
+                # One in ten programs is immutable, with no authority.
+                authority = b"\x01" + rng.randbytes(32) \
+                    if rng.random() >= 0.1 else bytes(33)
+                self._add(data_id, MockAccount(
+                    BPF_LOADER_3_PUBKEY,
+                    b"\x03\x00\x00\x00"
+                    + deploy_slot.to_bytes(8, "little")
+                    + authority,
+                    size,
+                    pool_offset,
+                ))
+            # One in five programs has never been invoked.
+            if rng.random() >= 0.2:
+                self.last_slots[str(program_id)] = rng.randrange(self.slot)
+
+    def _add(self, pubkey, account):
+        self.accounts[str(pubkey)] = account
+        self.by_owner.setdefault(account.owner, []).append(str(pubkey))
+
+    def elf_bytes(self) -> int:
+        return sum(a.elf_size for a in self.accounts.values())
+
+class MockRPCServer(ThreadingHTTPServer):
+    """
+    JSON-RPC server over a `MockDataset`.
+
+    Every request is delayed by `latency` seconds, and answered with HTTP 429
+    with probability `rate_limit`, or past `max_rps` requests in a second if
+    set, or else with HTTP 500 with probability
+    `error_rate`. The server answers as a node `slot_lag` slots behind the
+    dataset, rejecting reads pinned to a later slot. Responses are compressed
+    if the client accepts it and `compress` is set. Request and byte counts
+    are kept in `stats`, and served as JSON at `GET /stats`.
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        dataset,
+        latency=0.0,
+        rate_limit=0.0,
+        compress=False,
+        error_rate=0.0,
+        slot_lag=0,
+        max_rps=0.0,
+    ):
+        super().__init__(address, MockRPCHandler)
+        if slot_lag > 0:
+            # Shares the programs, but not the slot.
+            dataset = copy.copy(dataset)
+            dataset.slot -= slot_lag
+        self.dataset = dataset
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        # Start and request count of the current one-second window.
+        self.window = (0.0, 0)
+        self.compress = compress
+        self.stats = {
+            "requests": 0,
+            "calls": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "behind": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+        self.lock = threading.Lock()
+        self.rng = random.Random(1)
+
+    @property
+    def url(self):
+        (host, port) = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **counts):
+        with self.lock:
+            for (name, count) in counts.items():
+                self.stats[name] += count
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def start(self) -> threading.Thread:
+        """
+        Serves from a background thread, until `shutdown` is called.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def handle_call(self, call):
+        call_id = call.get("id") if isinstance(call, dict) else None
+        try:
+            method = call["method"]
+            params = call.get("params", [])
+            handler = METHODS.get(method)
+            if handler is None:
+                return _error(call_id, -32601, "Method not found")
+            result = handler(self.dataset, *params)
+        except RPCCallError as e:
+            if e.code == MIN_CONTEXT_SLOT_NOT_REACHED:
+                self.count(behind=1)
+            return _error(call_id, e.code, e.message)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            return _error(call_id, -32602, f"Invalid params: {e}")
+        return {"jsonrpc": "2.0", "result": result, "id": call_id}
+
+class MockRPCHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, as RPC nodes do.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        data = json.dumps(self.server.snapshot()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.count(requests=1, bytes_in=len(body))
+        if server.latency > 0:
+            time.sleep(server.latency)
+        with server.lock:
+            limited = server.rng.random() < server.rate_limit
+            if server.max_rps > 0:
+                now = time.monotonic()
+                (start, count) = server.window
+                if now - start >= 1.0:
+                    (start, count) = (now, 0)
+                server.window = (start, count + 1)
+                limited = limited or count >= server.max_rps
+            failed = not limited and server.rng.random() < server.error_rate
+        if limited:
+            server.count(rate_limited=1)
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if failed:
+            server.count(server_errors=1)
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send(_error(None, -32700, "Parse error"))
+        if isinstance(payload, list):
+            server.count(calls=len(payload))
+            return self._send([server.handle_call(c) for c in payload])
+        server.count(calls=1)
+        self._send(server.handle_call(payload))
+
+    def _send(self, obj):
+        data = json.dumps(obj).encode("utf-8")
+        accept = self.headers.get("Accept-Encoding", "")
+        encoding = None
+        if self.server.compress and zstandard and "zstd" in accept:
+            data = zstandard.ZstdCompressor().compress(data)
+            encoding = "zstd"
+        elif self.server.compress and "gzip" in accept:
+            data = gzip.compress(data, compresslevel=1)
+            encoding = "gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(bytes_out=len(data))
+
+class RPCCallError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
+def _error(call_id, code, message):
+    return {
+        "jsonrpc": "2.0",
+        "error": {"code": code, "message": message},
+        "id": call_id,
+    }
+
+def _check_context_slot(dataset, config):
+    if config.get("minContextSlot", 0) > dataset.slot:
+        raise RPCCallError(
+            MIN_CONTEXT_SLOT_NOT_REACHED,
+            "Minimum context slot has not been reached",
+        )
+
+def _encode(dataset, account, config):
+    data_slice = config.get("dataSlice")
+    if data_slice is not None:
+        data = account.read(
+            dataset.pool,
+            data_slice["offset"],
+            data_slice["length"],
+        )
+    else:
+        data = account.read(dataset.pool)
+    encoding = config.get("encoding", "base64")
+    if encoding == "base64+zstd":
+        if zstandard is None:
+            raise RPCCallError(-32602, "Unsupported encoding: base64+zstd")
+        data = zstandard.ZstdCompressor().compress(data)
+    elif encoding != "base64":
+        raise RPCCallError(-32602, f"Unsupported encoding: {encoding}")
+    return {
+        "data": [b64encode(data).decode("ascii"), encoding],
+        "executable": account.owner != BPF_LOADER_3_PUBKEY
+            or account.header[:1] == b"\x02",
+        "lamports": 1_000_000_000,
+        "owner": account.owner,
+        "rentEpoch": 18446744073709551615,
+        "space": len(account),
+    }
+
+def _matches(dataset, account, filters):
+    for f in filters:
+        if "dataSize" in f:
+            if len(account) != f["dataSize"]:
+                return False
+            continue
+        memcmp = f["memcmp"]
+        expected = b58decode(memcmp["bytes"])
+        actual = account.read(dataset.pool, memcmp["offset"], len(expected))
+        if actual != expected:
+            return False
+    return True
+
+def get_version(dataset):
+    return {"solana-core": "1.18.26", "feature-set": 3241752014}
+
+def get_slot(dataset, config=None):
+    return dataset.slot
+
+def get_program_accounts(dataset, program_id, config=None):
+    config = config or {}
+    _check_context_slot(dataset, config)
+    filters = config.get("filters", [])
+    accounts = [
+        {"pubkey": k, "account": _encode(dataset, dataset.accounts[k], config)}
+        for k in dataset.by_owner.get(program_id, [])
+        if _matches(dataset, dataset.accounts[k], filters)
+    ]
+    if config.get("withContext"):
+        return {"context": {"slot": dataset.slot}, "value": accounts}
+    return accounts
+
+def get_multiple_accounts(dataset, pubkeys, config=None):
+    config = config or {}
+    _check_context_slot(dataset, config)
+    if len(pubkeys) > 100:
+        raise RPCCallError(-32602, "Too many inputs provided; max 100")
+    return {
+        "context": {"slot": dataset.slot},
+        "value": [
+            _encode(dataset, dataset.accounts[k], config)
+            if k in dataset.accounts else None
+            for k in pubkeys
+        ],
+    }
+
+def get_signatures_for_address(dataset, address, config=None):
+    config = config or {}
+    _check_context_slot(dataset, config)
+    slot = dataset.last_slots.get(address)
+    if slot is None or config.get("limit", 1000) < 1:
+        return []
+    if config.get("until") == f"{address}{slot}"[:88]:
+        # No activity since.
+        return []
+    return [{
+        "blockTime": None,
+        "confirmationStatus": "finalized",
+        "err": None,
+        "memo": None,
+        "signature": f"{address}{slot}"[:88],
+        "slot": slot,
+    }]
+
+METHODS = {
+    "getVersion": get_version,
+    "getSlot": get_slot,
+    "getProgramAccounts": get_program_accounts,
+    "getMultipleAccounts": get_multiple_accounts,
+    "getSignaturesForAddress": get_signatures_for_address,
+}
+
+def serve(conn, dataset_args, server_args):
+    """
+    Builds a dataset and serves it on a free port, sending the server URL and
+    the total ELF size back through `conn`. Meant to run in its own process,
+    so the dataset and responses do not weigh on the caller's memory.
+    """
+    dataset = MockDataset(*dataset_args)
+    server = MockRPCServer(("127.0.0.1", 0), dataset, *server_args)
+    conn.send((server.url, dataset.elf_bytes()))
+    conn.close()
+    server.serve_forever()
+
+def dataset_options(fn):
+    """
+    Click options for the dataset and server behavior, shared with the
+    benchmarks.
+    """
+    options = [
+        click.option(
+            "--programs",
+            type=int,
+            default=1000,
+            help="Number of programs across all loaders.",
+        ),
+        click.option(
+            "--elf-size",
+            type=int,
+            default=64 << 10,
+            help="Median ELF size in bytes.",
+        ),
+        click.option(
+            "--elf-size-sigma",
+            type=float,
+            default=1.0,
+            help="Spread of the log-normal ELF size distribution.",
+        ),
+        click.option(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds to delay every request.",
+        ),
+        click.option(
+            "--rate-limit",
+            type=float,
+            default=0.0,
+            help="Share of requests answered with HTTP 429.",
+        ),
+        click.option(
+            "--max-rps",
+            type=float,
+            default=0.0,
+            help="Requests per second answered before HTTP 429, or 0 for no "
+            "limit.",
+        ),
+        click.option(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Share of other requests answered with HTTP 500.",
+        ),
+        click.option(
+            "--slot-lag",
+            type=int,
+            default=0,
+            help="Slots the node is behind, rejecting reads pinned later.",
+        ),
+        click.option(
+            "--compress",
+            is_flag=True,
+            default=False,
+            help="Compress responses with zstd or gzip when accepted.",
+        ),
+        click.option(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the synthetic dataset.",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+@click.command()
+@dataset_options
+@click.option("--host", type=str, default="127.0.0.1")
+@click.option("--port", type=int, default=8899)
+def main(
+    programs,
+    elf_size,
+    elf_size_sigma,
+    latency,
+    rate_limit,
+    max_rps,
+    error_rate,
+    slot_lag,
+    compress,
+    seed,
+    host,
+    port,
+):
+    dataset = MockDataset(programs, elf_size, elf_size_sigma, seed=seed)
+    server = MockRPCServer(
+        (host, port),
+        dataset,
+        latency,
+        rate_limit,
+        compress,
+        error_rate,
+        slot_lag,
+        max_rps,
+    )
+    print(
+        f"Serving {programs} programs ({dataset.elf_bytes() / 1e6:.1f} MB of "
+        f"ELFs) at {server.url}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
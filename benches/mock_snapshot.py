@@ -0,0 +1,153 @@
+# Writes the synthetic programs of the mock RPC as the account storage files
+# of a local snapshot, to try `clone --snapshot` and `profile-slots
+# --snapshot` offline, and to check that they match a clone from the mock RPC
+# serving the same dataset:
+#
+#     python -m benches.mock_snapshot /tmp/snapshot --programs 1000
+
+from pathlib import Path
+import random
+
+import click
+from solders.pubkey import Pubkey
+
+from cloner.filters import BPF_LOADER_3_PUBKEY
+from cloner.snapshot import ACCOUNT_HEADER, ALIGNMENT
+
+from .mock_rpc import MockDataset
+
+def storage_entry(pubkey, owner, data, lamports=1, executable=False):
+    """
+    Returns an account as written to an AppendVec storage file, padded to
+    the next entry.
+    """
+    entry = ACCOUNT_HEADER.pack(
+        0,
+        len(data),
+        bytes(pubkey),
+        lamports,
+        0,
+        bytes(owner),
+        executable,
+        bytes(32),
+    ) + data
+    return entry + bytes(-len(entry) % ALIGNMENT)
+
+def write_snapshot(dataset, path, files=64, noise=1.0, seed=0):
+    """
+    Writes `dataset` as `files` storage files under `path/accounts`, one per
+    slot up to the dataset's slot, with a `version` file.
+
+    Accounts are spread over the files among `noise` times as many accounts
+    of other programs. Some also have an older version in an earlier file,
+    and some closed Loader V3 programs are left behind, closed in a later
+    file. Each file is followed by zeroed space, as storage files are
+    allocated ahead of their accounts.
+    """
+    rng = random.Random(seed)
+    accounts_path = Path(path) / "accounts"
+    accounts_path.mkdir(parents=True, exist_ok=True)
+    contents = [bytearray() for _ in range(files)]
+    loader_3 = Pubkey.from_string(BPF_LOADER_3_PUBKEY)
+
+    for (pubkey, account) in dataset.accounts.items():
+        data = account.read(dataset.pool)
+        owner = Pubkey.from_string(account.owner)
+        i = rng.randrange(files)
+        if i > 0 and rng.random() < 0.1:
+            # An older version, since replaced.
+            stale = bytes(reversed(data))
+            contents[rng.randrange(i)] += storage_entry(
+                Pubkey.from_string(pubkey),
+                owner,
+                stale,
+            )
+        contents[i] += storage_entry(
+            Pubkey.from_string(pubkey),
+            owner,
+            data,
+            rng.randrange(1, 1 << 40),
+            # Program accounts are executable, and Program Data ones not.
+            account.owner != BPF_LOADER_3_PUBKEY
+            or data[:4] == b"\x02\x00\x00\x00",
+        )
+
+    for _ in range(int(noise * len(dataset.accounts))):
+        contents[rng.randrange(files)] += storage_entry(
+            Pubkey(rng.randbytes(32)),
+            Pubkey(rng.randbytes(32)),
+            rng.randbytes(rng.randrange(256)),
+        )
+
+    for _ in range(max(1, len(dataset.accounts) // 100)):
+        # A closed program, with a zero-lamport version in a later file.
+        i = rng.randrange(files - 1)
+        pubkey = Pubkey(rng.randbytes(32))
+        contents[i] += storage_entry(
+            pubkey,
+            loader_3,
+            b"\x02\x00\x00\x00" + rng.randbytes(32),
+        )
+        contents[rng.randrange(i + 1, files)] += storage_entry(
+            pubkey,
+            Pubkey.default(),
+            b"",
+            lamports=0,
+        )
+
+    first_slot = dataset.slot - files + 1
+    for (i, content) in enumerate(contents):
+        with open(accounts_path / f"{first_slot + i}.{i}", "wb") as file:
+            file.write(content)
+            file.write(bytes(rng.randrange(1, 4096)))
+    with open(Path(path) / "version", "w") as file:
+        file.write("1.2.0\n")
+
+@click.command()
+@click.argument("path", type=click.Path(file_okay=False))
+@click.option(
+    "--programs",
+    type=int,
+    default=1000,
+    help="Number of programs across all loaders.",
+)
+@click.option(
+    "--elf-size",
+    type=int,
+    default=64 << 10,
+    help="Median ELF size in bytes.",
+)
+@click.option(
+    "--elf-size-sigma",
+    type=float,
+    default=1.0,
+    help="Spread of the log-normal ELF size distribution.",
+)
+@click.option(
+    "--files",
+    type=int,
+    default=64,
+    help="Number of storage files.",
+)
+@click.option(
+    "--noise",
+    type=float,
+    default=1.0,
+    help="Accounts of other programs per loader account.",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    help="Seed of the synthetic dataset, as for the mock RPC.",
+)
+def main(path, programs, elf_size, elf_size_sigma, files, noise, seed):
+    dataset = MockDataset(programs, elf_size, elf_size_sigma, seed=seed)
+    write_snapshot(dataset, path, files, noise, seed)
+    print(
+        f"Wrote {programs} programs ({dataset.elf_bytes() / 1e6:.1f} MB of "
+        f"ELFs) to {files} storage files in {path}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Benchmark of packed bundles against a file per program. Writes synthetic
+# ELFs both ways into a temporary directory, then times random single-ELF
+# reads from each.
+#
+#     python -m benches.pack --programs 20000
+
+import os
+from pathlib import Path
+import random
+import tempfile
+import time
+
+import click
+from base58 import b58encode
+
+from cloner.pack import PackReader, PackWriter
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+@click.command()
+@click.option(
+    "--programs",
+    type=int,
+    default=20000,
+    help="Number of ELFs to write.",
+)
+@click.option(
+    "--elf-size",
+    type=int,
+    default=16 << 10,
+    help="Mean ELF size in bytes.",
+)
+@click.option(
+    "--reads",
+    type=int,
+    default=10000,
+    help="Number of random ELFs to read back.",
+)
+@click.option(
+    "--zstd-level",
+    type=int,
+    default=0,
+    help="zstd level to pack at, or 0 for uncompressed.",
+)
+def main(programs, elf_size, reads, zstd_level):
+    rng = random.Random(0)
+    # Half random bytes and half zeros, roughly as compressible as sBPF.
+    pool = os.urandom(4 * elf_size) + bytes(4 * elf_size)
+    elfs = []
+    for _ in range(programs):
+        size = max(1024, int(rng.expovariate(1 / elf_size)))
+        start = rng.randrange(len(pool) - size) if size < len(pool) else 0
+        elfs.append((
+            b58encode(os.urandom(32)).decode("utf-8"),
+            pool[start:start + size],
+        ))
+    wanted = [k for (k, _) in rng.sample(elfs, min(reads, programs))]
+    total = sum(len(data) for (_, data) in elfs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files_dir = Path(tmp) / "files"
+        pack_dir = Path(tmp) / "pack"
+        files_dir.mkdir()
+        pack_dir.mkdir()
+
+        def write_files():
+            for (k, data) in elfs:
+                with open(files_dir / f"{k}.elf", "wb") as file:
+                    file.write(data)
+
+        def write_pack():
+            with PackWriter(pack_dir, zstd_level) as writer:
+                for (k, data) in elfs:
+                    writer.add(k, 3, data)
+
+        def read_files():
+            for k in wanted:
+                with open(files_dir / f"{k}.elf", "rb") as file:
+                    file.read()
+
+        def read_pack():
+            with PackReader(pack_dir) as reader:
+                for k in wanted:
+                    reader.get(k)
+
+        files_write = timed(write_files)
+        pack_write = timed(write_pack)
+        files_read = timed(read_files)
+        pack_read = timed(read_pack)
+        pack_size = sum(f.stat().st_size for f in pack_dir.iterdir())
+
+    print(f"{programs} ELFs, {total / 1e6:.1f} MB")
+    print(f"{'':>8} {'files':>6} {'MB':>8} {'write (s)':>10} {'read (s)':>10}")
+    print(
+        f"{'files':>8} {programs:>6} {total / 1e6:8.1f} "
+        f"{files_write:10.3f} {files_read:10.3f}"
+    )
+    print(
+        f"{'pack':>8} {2:>6} {pack_size / 1e6:8.1f} "
+        f"{pack_write:10.3f} {pack_read:10.3f}"
+    )
+
+if __name__ == "__main__":
+    main()
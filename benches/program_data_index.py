@@ -0,0 +1,77 @@
+# Micro-benchmark for joining Loader V3 data fetched by Program Data key back
+# to program keys, comparing the old nested-loop join with ProgramDataIndex.
+#
+#     python -m benches.program_data_index --programs 40000
+
+import os
+import time
+
+import click
+from base58 import b58encode
+
+from cloner.util import ProgramDataIndex
+
+def random_key():
+    return b58encode(os.urandom(32)).decode("utf-8")
+
+def nested_join(keys_with_data_keys, data_keys_with_slots):
+    return [
+        (k, s)
+        for (k, kdk) in keys_with_data_keys
+        for (ddk, s) in data_keys_with_slots
+        if kdk == ddk
+    ]
+
+def index_join(keys_with_data_keys, data_keys_with_slots):
+    return list(
+        ProgramDataIndex(keys_with_data_keys).join(data_keys_with_slots)
+        .items()
+    )
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start, result)
+
+@click.command()
+@click.option(
+    "--programs",
+    type=int,
+    default=40000,
+    help="Number of Loader V3 programs, roughly mainnet scale by default.",
+)
+@click.option(
+    "--max-nested-programs",
+    type=int,
+    default=4000,
+    help="Largest size to run the quadratic nested-loop join at.",
+)
+def main(programs, max_nested_programs):
+    keys_with_data_keys = [
+        (random_key(), random_key()) for _ in range(programs)
+    ]
+    data_keys_with_slots = [
+        (dk, i) for (i, (_, dk)) in enumerate(reversed(keys_with_data_keys))
+    ]
+
+    sizes = sorted({1000, 2000, max_nested_programs, programs})
+    baseline = None
+    print(f"{'programs':>10} {'nested (s)':>12} {'index (s)':>12}")
+    for n in sizes:
+        if n > programs:
+            continue
+        pairs = keys_with_data_keys[:n]
+        data = [(dk, s) for (dk, s) in data_keys_with_slots if s >= programs - n]
+        (index_time, index_result) = timed(index_join, pairs, data)
+        if n <= max_nested_programs:
+            (nested_time, nested_result) = timed(nested_join, pairs, data)
+            assert nested_result == index_result
+            baseline = (n, nested_time)
+            nested = f"{nested_time:.4f}"
+        else:
+            # Extrapolated quadratically from the largest measured size.
+            nested = f"~{baseline[1] * (n / baseline[0]) ** 2:.1f}"
+        print(f"{n:>10} {nested:>12} {index_time:12.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,110 @@
 # Solana program cloner CLI
+#
+# Commands import their implementation, and with it `requests`, `solders` or
+# matplotlib, only when invoked, so `--help` and each command only pay for
+# what they use. `python -m benches.import_time` keeps an eye on this.
+
+import importlib.util
 
 import click
-from .chart import chart_profiled_slots as do_chart_profiled_slots
-from .clone import clone as do_clone
-from .profile import profile_slots as do_profile_slots
-from .sort import sort as do_sort
+from .metrics import METRICS_FORMATS
+from .table import FORMATS, parquet_supported
+
+def check_format(ctx, param, value):
+    if value == "parquet" and not parquet_supported():
+        raise click.BadParameter(
+            "Parquet output needs the optional `pyarrow` package."
+        )
+    return value
+
+def check_zstd_level(ctx, param, value):
+    # Checked without importing `zstandard`.
+    if value > 0 and importlib.util.find_spec("zstandard") is None:
+        raise click.BadParameter(
+            "Compressed packs need the optional `zstandard` package."
+        )
+    return value
+
+def check_urls(ctx, param, value):
+    from .rpc import Endpoint
+    for url in value:
+        try:
+            Endpoint.parse(url)
+        except ValueError as e:
+            raise click.BadParameter(f"{url}: {e}")
+    return list(value)
+
+url_option = click.option(
+    "--url",
+    type=str,
+    multiple=True,
+    default=["http://localhost:8899"],
+    callback=check_urls,
+    help="RPC URL to use for queries. Repeat to spread queries across "
+    "several RPCs, each optionally suffixed with `#weight=W&rps=R`.",
+)
+
+format_option = click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(FORMATS),
+    default="csv",
+    callback=check_format,
+    help="File format for key lists, slots and sort results.",
+)
+
+metrics_option = click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to write RPC and stage metrics to, every minute and when the "
+    "command ends.",
+)
+
+metrics_format_option = click.option(
+    "--metrics-format",
+    type=click.Choice(METRICS_FORMATS),
+    default="jsonl",
+    help="Metrics file format: JSON lines, with a span per finished stage, or "
+    "Prometheus text, as read by the node_exporter textfile collector.",
+)
+
+progress_bar_option = click.option(
+    "--progress-bar",
+    is_flag=True,
+    default=False,
+    help="Draw progress as a bar with throughput and ETA on stderr, instead "
+    "of printing a line every second.",
+)
+
+shard_bytes_option = click.option(
+    "--shard-bytes",
+    type=click.IntRange(0, 2),
+    default=0,
+    help="Split Loader V3 getProgramAccounts listings into 256^N shards by "
+    "the first N bytes of each account's Program Data address (or slot), run "
+    "concurrently, for nodes on which a full listing times out. 0 lists "
+    "each loader in one call.",
+)
+
+zstd_level_option = click.option(
+    "--zstd-level",
+    type=click.IntRange(0, 22),
+    default=0,
+    callback=check_zstd_level,
+    help="zstd level to compress each packed ELF at, or 0 to pack ELFs "
+    "uncompressed. Needs the optional `zstandard` package.",
+)
+
+snapshot_option = click.option(
+    "--snapshot",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Read accounts offline from the account storage files of a local "
+    "snapshot under this directory, such as an unpacked snapshot archive or "
+    "a validator's accounts directory, instead of from an RPC.",
+)
 
 @click.group()
 def cli():
@@ -12,66 +112,279 @@ def cli():
 
 @click.command()
 @click.argument("bundle_name", type=str)
-@click.option(
-    "--url",
-    type=str,
-    default="http://localhost:8899",
-    help="RPC URL to use for queries.",
-)
+@url_option
 @click.option(
     "--rate-limit-buffer",
     type=int,
     default=0,
     help="Time delay between RPC query batches to avoid rate limiting.",
 )
-def clone(bundle_name, url, rate_limit_buffer):
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of RPC query batches to keep in flight at once.",
+)
+@click.option(
+    "--requests-per-second",
+    type=float,
+    default=None,
+    help="Maximum RPC requests per second, shared by all in-flight batches.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted clone, skipping work it already finished.",
+)
+@click.option(
+    "--since",
+    type=str,
+    default=None,
+    help="Previous bundle to link unchanged programs from, instead of "
+    "downloading them again.",
+)
+@click.option(
+    "--store",
+    is_flag=True,
+    default=False,
+    help="Keep ELFs in the content-addressed store shared by all bundles, "
+    "hard-linked into this one.",
+)
+@click.option(
+    "--account-encoding",
+    type=click.Choice(["base64", "base64+zstd"]),
+    default="base64",
+    help="Account data encoding to request. base64+zstd needs the optional "
+    "`zstandard` package and falls back to base64 if the RPC rejects it.",
+)
+@click.option(
+    "--single-pass",
+    is_flag=True,
+    default=False,
+    help="Fetch each loader's accounts with their data in one "
+    "getProgramAccounts call, instead of listing keys and fetching accounts "
+    "by key. Cannot be combined with --resume or --since.",
+)
+@click.option(
+    "--pack",
+    is_flag=True,
+    default=False,
+    help="Write ELFs to a single pack file with a sorted index, instead of a "
+    "file per program. Cannot be combined with --store.",
+)
+@zstd_level_option
+@snapshot_option
+@shard_bytes_option
+@format_option
+@metrics_option
+@metrics_format_option
+@progress_bar_option
+def clone(
+    bundle_name,
+    url,
+    rate_limit_buffer,
+    concurrency,
+    requests_per_second,
+    resume,
+    since,
+    store,
+    account_encoding,
+    shard_bytes,
+    fmt,
+    single_pass,
+    metrics_path,
+    metrics_format,
+    progress_bar,
+    pack,
+    zstd_level,
+    snapshot,
+):
     """
-    Download all Solana programs from the provided RPC URL to the provided
-    bundle name.
+    Download all Solana programs from the provided RPC URL, or a local
+    snapshot, to the provided bundle name.
     """
-    do_clone(bundle_name, url, rate_limit_buffer)
+    if single_pass and (resume or since is not None):
+        raise click.UsageError(
+            "--single-pass fetches every program at once, so it cannot be "
+            "combined with --resume or --since."
+        )
+    if pack and store:
+        raise click.UsageError(
+            "--pack keeps ELFs in the bundle's pack, so it cannot be "
+            "combined with --store."
+        )
+    from .clone import clone as do_clone
+    from .metrics import Metrics
+    with Metrics(metrics_path, metrics_format) as metrics:
+        do_clone(
+            bundle_name,
+            url,
+            rate_limit_buffer,
+            concurrency,
+            requests_per_second,
+            resume,
+            since,
+            store,
+            account_encoding,
+            fmt,
+            single_pass,
+            metrics,
+            progress_bar,
+            shard_bytes,
+            pack,
+            zstd_level,
+            snapshot,
+        )
 
 @click.command()
 @click.argument("bundle_name", type=str)
-@click.option(
-    "--url",
-    type=str,
-    default="http://localhost:8899",
-    help="RPC URL to use for queries.",
-)
+@url_option
 @click.option(
     "--rate-limit-buffer",
     type=int,
     default=0,
     help="Time delay between RPC query batches to avoid rate limiting.",
 )
-def sort(bundle_name, url, rate_limit_buffer):
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    help="Number of signature lookups to pack into each JSON-RPC batch.",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of RPC query batches to keep in flight at once.",
+)
+@click.option(
+    "--requests-per-second",
+    type=float,
+    default=None,
+    help="Maximum RPC requests per second, shared by all in-flight batches.",
+)
+@format_option
+@metrics_option
+@metrics_format_option
+@progress_bar_option
+@click.option(
+    "--full",
+    is_flag=True,
+    default=False,
+    help="Look up every program from scratch, ignoring the previous sort.",
+)
+def sort(
+    bundle_name,
+    url,
+    rate_limit_buffer,
+    batch_size,
+    concurrency,
+    requests_per_second,
+    fmt,
+    metrics_path,
+    metrics_format,
+    progress_bar,
+    full,
+):
     """
     Sort the downloaded programs by the slot they were last executed, starting
-    from the most recent slot.
+    from the most recent slot. Programs sorted before are only checked for
+    activity since.
     """
-    do_sort(bundle_name, url, rate_limit_buffer)
+    from .metrics import Metrics
+    from .sort import sort as do_sort
+    with Metrics(metrics_path, metrics_format) as metrics:
+        do_sort(
+            bundle_name,
+            url,
+            rate_limit_buffer,
+            batch_size,
+            concurrency,
+            requests_per_second,
+            fmt,
+            metrics,
+            progress_bar,
+            full,
+        )
 
 @click.command()
 @click.argument("profile_name", type=str)
-@click.option(
-    "--url",
-    type=str,
-    default="http://localhost:8899",
-    help="RPC URL to use for queries.",
-)
+@url_option
 @click.option(
     "--rate-limit-buffer",
     type=int,
     default=0,
     help="Time delay between RPC query batches to avoid rate limiting.",
 )
-def profile_slots(profile_name, url, rate_limit_buffer):
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of RPC query batches to keep in flight at once.",
+)
+@click.option(
+    "--requests-per-second",
+    type=float,
+    default=None,
+    help="Maximum RPC requests per second, shared by all in-flight batches.",
+)
+@click.option(
+    "--account-encoding",
+    type=click.Choice(["base64", "base64+zstd"]),
+    default="base64",
+    help="Account data encoding to request. base64+zstd needs the optional "
+    "`zstandard` package and falls back to base64 if the RPC rejects it.",
+)
+@click.option(
+    "--single-pass",
+    is_flag=True,
+    default=False,
+    help="Read Program Data addresses and slots with two getProgramAccounts "
+    "calls, instead of deriving addresses and fetching accounts by key.",
+)
+@snapshot_option
+@shard_bytes_option
+@format_option
+@metrics_option
+@metrics_format_option
+@progress_bar_option
+def profile_slots(
+    profile_name,
+    url,
+    rate_limit_buffer,
+    concurrency,
+    requests_per_second,
+    account_encoding,
+    shard_bytes,
+    fmt,
+    single_pass,
+    metrics_path,
+    metrics_format,
+    progress_bar,
+    snapshot,
+):
     """
     Profile all Solana Loader V3 programs based on their deployment slot, using
-    the provided RPC URL.
+    the provided RPC URL or a local snapshot.
     """
-    do_profile_slots(profile_name, url, rate_limit_buffer)
+    from .metrics import Metrics
+    from .profile import profile_slots as do_profile_slots
+    with Metrics(metrics_path, metrics_format) as metrics:
+        do_profile_slots(
+            profile_name,
+            url,
+            rate_limit_buffer,
+            concurrency,
+            requests_per_second,
+            account_encoding,
+            fmt,
+            single_pass,
+            metrics,
+            progress_bar,
+            shard_bytes,
+            snapshot,
+        )
 
 @click.command()
 @click.argument("profile_name", type=str)
@@ -79,12 +392,151 @@ def chart_profiled_slots(profile_name):
     """
     Create a scatter plot of deployment slots for each program ID.
     """
+    from .chart import chart_profiled_slots as do_chart_profiled_slots
     do_chart_profiled_slots(profile_name)
 
+@click.command()
+@click.argument("profile_names", type=str, nargs=-1, required=True)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory to write charts to. Defaults to the last profile's.",
+)
+@click.option(
+    "--bins",
+    type=int,
+    default=40,
+    help="Number of slot ranges in the histogram.",
+)
+@click.option(
+    "--top",
+    type=int,
+    default=20,
+    help="Number of most recently deployed programs to list per profile.",
+)
+@click.option(
+    "--slots-per-epoch",
+    type=int,
+    default=432000,
+    help="Epoch length to count deployments per epoch by.",
+)
+@click.option(
+    "--image-format",
+    type=click.Choice(["png", "svg", "pdf"]),
+    default="png",
+    help="Format of the charts.",
+)
+def analyze_profiles(
+    profile_names,
+    output_dir,
+    bins,
+    top,
+    slots_per_epoch,
+    image_format,
+):
+    """
+    Chart the deployment slot histogram, CDF and deployments per epoch of one
+    or more profiles, list their most recent deployments, and compare each
+    profile with the next for new, closed and redeployed programs. Charts are
+    rendered without a display.
+    """
+    from .analytics import analyze_profiles as do_analyze_profiles
+    do_analyze_profiles(
+        profile_names,
+        output_dir,
+        bins,
+        top,
+        slots_per_epoch,
+        image_format,
+    )
+
+@click.command()
+@click.argument("bundle_name", type=str)
+@click.option(
+    "--trim/--no-trim",
+    default=True,
+    help="Trim zero padding past the end of each ELF, such as the unused "
+    "space of a Program Data account.",
+)
+@click.option(
+    "--processes",
+    type=int,
+    default=None,
+    help="Number of worker processes. Defaults to the number of CPUs.",
+)
+@format_option
+@progress_bar_option
+def verify(bundle_name, trim, processes, fmt, progress_bar):
+    """
+    Check every ELF in a bundle: validate its headers, find its true length,
+    trim padding, hash it and measure its sections. Results are written to
+    the bundle's `elf_index` table, and broken ELFs are dropped from its
+    checkpoint.
+    """
+    from .verify import verify as do_verify
+    do_verify(bundle_name, trim, processes, fmt, progress_bar)
+
+@click.command()
+@click.argument("bundle_name", type=str)
+@zstd_level_option
+@click.option(
+    "--remove-files",
+    is_flag=True,
+    default=False,
+    help="Remove the ELF files once they are packed.",
+)
+@progress_bar_option
+def pack(bundle_name, zstd_level, remove_files, progress_bar):
+    """
+    Pack a bundle's ELF files into a single pack file with a sorted index,
+    adding to its pack if it already has one.
+    """
+    from .pack import pack as do_pack
+    do_pack(bundle_name, zstd_level, remove_files, progress_bar)
+
+@click.command()
+@click.argument("bundle_name", type=str)
+@click.option(
+    "--remove-pack",
+    is_flag=True,
+    default=False,
+    help="Remove the pack once its ELFs are written out.",
+)
+@progress_bar_option
+def unpack(bundle_name, remove_pack, progress_bar):
+    """
+    Write a packed bundle's ELFs out as a file per program.
+    """
+    from .pack import unpack as do_unpack
+    do_unpack(bundle_name, remove_pack, progress_bar)
+
+@click.command()
+@click.argument("bundle_name", type=str)
+@click.argument("program_id", type=str)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default=None,
+    help="File to write the ELF to, or - for stdout. Defaults to "
+    "<program_id>.elf.",
+)
+def extract(bundle_name, program_id, output):
+    """
+    Write one program's ELF out of a bundle, packed or not.
+    """
+    from .pack import extract as do_extract
+    do_extract(bundle_name, program_id, output)
+
 cli.add_command(clone)
 cli.add_command(sort)
 cli.add_command(profile_slots)
 cli.add_command(chart_profiled_slots)
+cli.add_command(analyze_profiles)
+cli.add_command(verify)
+cli.add_command(pack)
+cli.add_command(unpack)
+cli.add_command(extract)
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -0,0 +1,381 @@
+from pathlib import Path
+
+import numpy as np
+from solders.pubkey import Pubkey
+
+from cloner.table import parquet_supported, table_format, table_path
+from cloner.util import profile_full_path
+
+# Slots per epoch on mainnet-beta, which has no warmup epochs.
+SLOTS_PER_EPOCH = 432_000
+
+SLOTS_TABLE = "bpf_loader_3_keys_with_slots"
+
+# Points plotted per CDF line. Millions of slots would draw no better.
+CDF_POINTS = 2000
+
+class ProfileSlots:
+    """
+    Deployment slot of every Loader V3 program in a profile, as numpy arrays
+    of program IDs and u64 slots.
+
+    IDs are kept as fixed-width bytes, as read: base58 from CSV, or raw
+    32-byte pubkeys from Parquet. Encoding millions of pubkeys takes seconds,
+    so only those printed are encoded, unless a Parquet profile is compared
+    with a CSV one.
+    """
+    def __init__(self, name, program_ids, slots, raw_ids=False):
+        self.name = name
+        self.program_ids = program_ids
+        self.slots = slots
+        self.raw_ids = raw_ids
+        self._base58 = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    @staticmethod
+    def load(profile_name) -> "ProfileSlots":
+        """
+        Reads a profile's `bpf_loader_3_keys_with_slots` table, in either
+        format, straight into arrays.
+        """
+        path = profile_full_path(profile_name)
+        fmt = table_format(path, SLOTS_TABLE)
+        if fmt is None:
+            raise FileNotFoundError(table_path(path, SLOTS_TABLE, "csv"))
+        file_path = table_path(path, SLOTS_TABLE, fmt)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            table = pq.read_table(file_path).combine_chunks()
+            slots = table.column("slot").to_numpy().astype(np.uint64)
+            ids = table.column("program_id").chunks
+            # Fixed-size binary is one contiguous buffer of 32-byte keys.
+            program_ids = np.frombuffer(
+                ids[0].buffers()[1],
+                dtype="S32",
+                offset=ids[0].offset * 32,
+                count=len(ids[0]),
+            ) if len(ids) > 0 else np.zeros(0, dtype="S32")
+            return ProfileSlots(profile_name, program_ids, slots, True)
+        if parquet_supported():
+            # Arrow's CSV reader is several times faster than pandas'.
+            import pyarrow.csv as pc
+            table = pc.read_csv(
+                file_path,
+                read_options=pc.ReadOptions(
+                    column_names=["program_id", "slot"],
+                ),
+                convert_options=pc.ConvertOptions(
+                    column_types={"program_id": "string", "slot": "uint64"},
+                ),
+            )
+            slots = table.column("slot").to_numpy()
+            program_ids = table.column("program_id") \
+                .to_numpy(zero_copy_only=False)
+        else:
+            import pandas as pd
+            df = pd.read_csv(
+                file_path,
+                header=None,
+                names=["program_id", "slot"],
+                dtype={"program_id": str, "slot": np.uint64},
+            )
+            slots = df["slot"].to_numpy()
+            program_ids = df["program_id"].to_numpy()
+        return ProfileSlots(profile_name, program_ids.astype("S44"), slots)
+
+    def base58_ids(self, idx=slice(None)) -> np.ndarray:
+        """
+        Returns the program IDs at `idx` as fixed-width base58 bytes.
+        """
+        if not self.raw_ids:
+            return self.program_ids[idx]
+        if self._base58 is not None:
+            return self._base58[idx]
+        # Item access drops trailing zero bytes, which are part of a key.
+        ids = np.array(
+            [
+                str(Pubkey.from_bytes(k.ljust(32, b"\0")))
+                for k in self.program_ids[idx]
+            ],
+            dtype="S44",
+        )
+        if isinstance(idx, slice) and idx == slice(None):
+            self._base58 = ids
+        return ids
+
+def slot_bins(profiles, bins=40) -> np.ndarray:
+    """
+    Returns `bins + 1` slot range edges shared by every profile, rounded to
+    thousands of slots.
+    """
+    slots = [p.slots for p in profiles if len(p) > 0]
+    if len(slots) == 0:
+        return np.zeros(1, dtype=np.uint64)
+    low = min(int(s.min()) for s in slots) // 1000 * 1000
+    high = -(-max(int(s.max()) for s in slots) // 1000) * 1000
+    edges = np.round(np.linspace(low, max(high, low + 1000), bins + 1), -3)
+    # Narrow ranges round several edges to the same thousand.
+    return np.unique(edges)
+
+def histogram(profile, edges) -> np.ndarray:
+    """
+    Counts a profile's programs into the slot ranges between `edges`.
+    """
+    if len(edges) < 2:
+        return np.zeros(0, dtype=np.int64)
+    return np.histogram(profile.slots, edges)[0]
+
+def cdf(profile, points=None):
+    """
+    Returns sorted slots and the share of programs deployed at or before
+    each, thinned to about `points` evenly spaced quantiles if given.
+    """
+    slots = np.sort(profile.slots)
+    shares = np.arange(1, len(slots) + 1) / max(len(slots), 1)
+    if points is not None and len(slots) > points:
+        idx = np.linspace(0, len(slots) - 1, points).astype(np.int64)
+        return (slots[idx], shares[idx])
+    return (slots, shares)
+
+def deploys_per_epoch(profile, slots_per_epoch=SLOTS_PER_EPOCH):
+    """
+    Returns the epochs in which programs were last deployed, and how many
+    were deployed in each.
+    """
+    return np.unique(profile.slots // slots_per_epoch, return_counts=True)
+
+def top_recent(profile, n=20) -> list:
+    """
+    Returns the `n` most recently deployed programs, newest first, as
+    `(program_id, slot)` pairs.
+    """
+    n = min(n, len(profile))
+    if n == 0:
+        return []
+    idx = np.argpartition(profile.slots, len(profile) - n)[len(profile) - n:]
+    idx = idx[np.argsort(profile.slots[idx])[::-1]]
+    return list(zip(
+        [k.decode() for k in profile.base58_ids(idx).tolist()],
+        profile.slots[idx].tolist(),
+    ))
+
+def churn(before, after) -> dict:
+    """
+    Compares two profiles: programs new in `after`, closed since `before`,
+    redeployed in between, or unchanged.
+    """
+    if before.raw_ids == after.raw_ids:
+        (idx_before, idx_after) = match_ids(
+            before.program_ids,
+            after.program_ids,
+        )
+    else:
+        (idx_before, idx_after) = match_ids(
+            before.base58_ids(),
+            after.base58_ids(),
+        )
+    redeployed = int(np.count_nonzero(
+        before.slots[idx_before] != after.slots[idx_after]
+    ))
+    return {
+        "new": len(after) - len(idx_after),
+        "closed": len(before) - len(idx_before),
+        "redeployed": redeployed,
+        "unchanged": len(idx_after) - redeployed,
+    }
+
+def match_ids(a, b):
+    """
+    Returns the indices in `a` and in `b` of IDs found in both, each unique
+    within its array.
+
+    Sorting millions of byte strings is slow, so IDs are matched by a 64-bit
+    hash of their words, and only compared in full to confirm. Colliding
+    hashes fall back to sorting the IDs themselves.
+    """
+    (words_a, words_b) = (_words(a, b), _words(b, a))
+    (hash_a, hash_b) = (_hash(words_a), _hash(words_b))
+    (order_a, order_b) = (np.argsort(hash_a), np.argsort(hash_b))
+    (hash_a, hash_b) = (hash_a[order_a], hash_b[order_b])
+    if not (_has_duplicates(hash_a) or _has_duplicates(hash_b)):
+        pos = np.searchsorted(hash_a, hash_b)
+        found = pos < len(hash_a)
+        found[found] = hash_a[pos[found]] == hash_b[found]
+        (idx_a, idx_b) = (order_a[pos[found]], order_b[found])
+        if np.array_equal(words_a[idx_a], words_b[idx_b]):
+            return (idx_a, idx_b)
+    (_, idx_a, idx_b) = np.intersect1d(
+        a,
+        b,
+        assume_unique=True,
+        return_indices=True,
+    )
+    return (idx_a, idx_b)
+
+def _words(ids, other) -> np.ndarray:
+    """
+    Views fixed-width byte strings as rows of u64 words, zero-padded to the
+    width of the wider of `ids` and `other`.
+    """
+    width = max(ids.dtype.itemsize, other.dtype.itemsize)
+    width = -(-width // 8) * 8
+    return np.ascontiguousarray(ids, dtype=f"S{width}") \
+        .view(np.uint64).reshape(len(ids), width // 8)
+
+def _hash(words) -> np.ndarray:
+    h = np.zeros(len(words), dtype=np.uint64)
+    for i in range(words.shape[1]):
+        h = (h ^ words[:, i]) * np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(29)
+    return h
+
+def _has_duplicates(values) -> bool:
+    # `values` are sorted.
+    return bool(np.any(values[1:] == values[:-1]))
+
+def slot_range_labels(edges) -> list:
+    return [f"{int(a)} - {int(b)}" for (a, b) in zip(edges[:-1], edges[1:])]
+
+def new_figure(width=14, height=8):
+    """
+    Creates a figure rendered with Agg, straight to a file, so charts need
+    no display and no GUI toolkit.
+    """
+    from matplotlib.figure import Figure
+    return Figure(figsize=(width, height))
+
+def render_histogram(profiles, edges, path):
+    figure = new_figure()
+    axes = figure.subplots()
+    if len(profiles) == 1:
+        axes.bar(
+            np.arange(len(edges) - 1),
+            histogram(profiles[0], edges),
+            color="purple",
+        )
+        axes.set_xticks(np.arange(len(edges) - 1))
+        axes.set_xticklabels(
+            slot_range_labels(edges),
+            rotation=45,
+            ha="right",
+        )
+        axes.set_xlabel("Deployment Slot Ranges")
+    else:
+        for profile in profiles:
+            axes.stairs(histogram(profile, edges), edges, label=profile.name)
+        axes.legend()
+        axes.set_xlabel("Deployment Slot")
+    axes.set_ylabel("Count of Programs")
+    axes.set_title("Loader V3 Program Deployment Slot Distribution")
+    figure.tight_layout()
+    figure.savefig(path)
+
+def render_cdf(profiles, path):
+    figure = new_figure()
+    axes = figure.subplots()
+    for profile in profiles:
+        (slots, shares) = cdf(profile, CDF_POINTS)
+        axes.step(slots, shares, where="post", label=profile.name)
+    axes.set_xlabel("Deployment Slot")
+    axes.set_ylabel("Share of Programs Deployed By Slot")
+    axes.set_title("Loader V3 Program Deployment Slot CDF")
+    axes.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+def render_deploys_per_epoch(profiles, slots_per_epoch, path):
+    figure = new_figure()
+    axes = figure.subplots()
+    for profile in profiles:
+        (epochs, counts) = deploys_per_epoch(profile, slots_per_epoch)
+        axes.plot(epochs, counts, marker=".", label=profile.name)
+    axes.set_xlabel("Epoch")
+    axes.set_ylabel("Programs Last Deployed")
+    axes.set_title("Loader V3 Program Deployments per Epoch")
+    axes.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+def render_churn(pairs, path):
+    """
+    Renders stacked bars of `churn` results, one per `(before, after, churn)`
+    pair of profiles.
+    """
+    figure = new_figure()
+    axes = figure.subplots()
+    x = np.arange(len(pairs))
+    bottom = np.zeros(len(pairs))
+    for (kind, color) in [
+        ("unchanged", "lightgray"),
+        ("redeployed", "purple"),
+        ("new", "seagreen"),
+        ("closed", "firebrick"),
+    ]:
+        values = np.array([c[kind] for (_, _, c) in pairs])
+        axes.bar(x, values, bottom=bottom, color=color, label=kind)
+        bottom += values
+    axes.set_xticks(x)
+    axes.set_xticklabels([f"{a} → {b}" for (a, b, _) in pairs])
+    axes.set_ylabel("Count of Programs")
+    axes.set_title("Loader V3 Program Churn Between Profiles")
+    axes.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+def analyze_profiles(
+    profile_names,
+    output_dir=None,
+    bins=40,
+    top=20,
+    slots_per_epoch=SLOTS_PER_EPOCH,
+    image_format="png",
+):
+    print("Analyzing Loader V3 program slots...")
+    print(f"    Profile Names   : {', '.join(profile_names)}")
+
+    output_dir = Path(output_dir) if output_dir is not None \
+        else profile_full_path(profile_names[-1])
+    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"    Output          : {output_dir}")
+
+    profiles = [ProfileSlots.load(name) for name in profile_names]
+    for profile in profiles:
+        if len(profile) == 0:
+            print(f"{profile.name}: no programs")
+            continue
+        print(
+            f"{profile.name}: {len(profile)} programs, deployed between "
+            f"slots {int(profile.slots.min())} and {int(profile.slots.max())}"
+        )
+        print("    Most recently deployed:")
+        for (program_id, slot) in top_recent(profile, top):
+            print(f"        {slot:>12} {program_id}")
+
+    render_histogram(
+        profiles,
+        slot_bins(profiles, bins),
+        output_dir / f"slots_histogram.{image_format}",
+    )
+    render_cdf(profiles, output_dir / f"slots_cdf.{image_format}")
+    render_deploys_per_epoch(
+        profiles,
+        slots_per_epoch,
+        output_dir / f"deploys_per_epoch.{image_format}",
+    )
+
+    # Churn between each profile and the next, such as between snapshots.
+    if len(profiles) > 1:
+        pairs = [
+            (before.name, after.name, churn(before, after))
+            for (before, after) in zip(profiles, profiles[1:])
+        ]
+        print("Churn:")
+        for (before, after, counts) in pairs:
+            print(
+                f"    {before} -> {after}: {counts['new']} new, "
+                f"{counts['closed']} closed, {counts['redeployed']} "
+                f"redeployed, {counts['unchanged']} unchanged"
+            )
+        render_churn(pairs, output_dir / f"churn.{image_format}")
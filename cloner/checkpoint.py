@@ -0,0 +1,83 @@
+import csv
+import io
+import threading
+
+from .keys import KeyTable
+from .util import bundle_full_path, write_atomic
+
+class Checkpoint:
+    """
+    Append-only record of the ELFs already written to a bundle, stored as
+    `(loader, program_id, sha256)` rows in `checkpoint.csv`. A resumed clone
+    skips every program recorded here, and a finished clone's checkpoint is
+    the bundle's manifest of ELF digests.
+    """
+    FILE_NAME = "checkpoint.csv"
+
+    def __init__(self, bundle_name, resume=False):
+        self.path = bundle_full_path(bundle_name) / Checkpoint.FILE_NAME
+        self.done = read_manifest(bundle_name) if resume else {}
+        if resume:
+            print(f"Resuming with {len(self.done)} ELFs already written")
+        # Rewrite the surviving rows, so appends never follow a partial row.
+        self.file = open(self.path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerows(
+            [loader, program_id, digest]
+            for ((loader, program_id), digest) in sorted(self.done.items())
+        )
+        self.file.flush()
+        self.lock = threading.Lock()
+
+    def is_done(self, loader, program_id) -> bool:
+        return (loader, str(program_id)) in self.done
+
+    def remaining(self, loader, program_ids) -> KeyTable:
+        """
+        Returns the program IDs that have not been written yet.
+        """
+        if not isinstance(program_ids, KeyTable):
+            program_ids = KeyTable(program_ids)
+        return program_ids.select(lambda k: not self.is_done(loader, k))
+
+    def mark_done(self, loader, program_id, digest):
+        """
+        Records a written ELF. Call only once the ELF file is complete.
+        """
+        with self.lock:
+            self.done[(loader, str(program_id))] = digest
+            self.writer.writerow([loader, str(program_id), digest])
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def read_manifest(bundle_name) -> dict:
+    """
+    Reads a bundle's checkpoint into a `(loader, program_id) -> sha256` map.
+    """
+    path = bundle_full_path(bundle_name) / Checkpoint.FILE_NAME
+    manifest = {}
+    if not path.exists():
+        return manifest
+    with open(path, "r", newline="") as file:
+        for row in csv.reader(file):
+            # A crash can leave a truncated last row behind.
+            if len(row) == 3 and len(row[2]) == 64:
+                manifest[(row[0], row[1])] = row[2]
+    return manifest
+
+def write_manifest(bundle_name, manifest):
+    """
+    Replaces a bundle's checkpoint with a `(loader, program_id) -> sha256`
+    map, such as after its ELFs were rewritten.
+    """
+    text = io.StringIO(newline="")
+    csv.writer(text).writerows(
+        [loader, program_id, digest]
+        for ((loader, program_id), digest) in sorted(manifest.items())
+    )
+    write_atomic(
+        bundle_full_path(bundle_name) / Checkpoint.FILE_NAME,
+        text.getvalue().encode("utf-8"),
+    )
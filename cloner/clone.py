@@ -1,143 +1,749 @@
-import os
 import sys
 import time
 
 from cloner.filters import BPF_LOADER_2_PUBKEY, BPF_LOADER_3_PROGRAM_FILTER, \
-    BPF_LOADER_3_PUBKEY, BPF_LOADER_FILTER, BPF_LOADER_PUBKEY
+    BPF_LOADER_3_PROGRAM_SHARD_OFFSET, BPF_LOADER_3_PROGRAMDATA_ELF_FILTER, \
+    BPF_LOADER_3_PROGRAMDATA_FILTER, BPF_LOADER_3_PUBKEY, BPF_LOADER_FILTER, \
+    BPF_LOADER_PUBKEY
 
+from .checkpoint import Checkpoint, read_manifest
+from .keys import KeyTable
+from .pack import LOADER_NUMBERS, PackReader, PackWriter, delete_pack, \
+    is_packed
 from .rpc import SolanaRPC
-from .util import bundle_full_path, \
-    get_programdata_address, init_bundle, write_to_bundle_csv
+from .scheduler import Scheduler
+from .snapshot import SnapshotSource
+from .store import ElfFile, ElfStore, file_digest
+from .util import PROGRAMDATA_HEADER_LENGTH, Progress, ProgramDataIndex, \
+    bundle_full_path, bundle_table_exists, get_programdata_addresses, \
+    init_bundle, le_to_u64, link_or_copy, read_bundle_table, \
+    read_programdata_header, write_atomic, write_to_bundle_table
 
-def clone(bundle_name, url, rate_limit_buffer):
-    rpc = SolanaRPC(url)
+def clone(
+    bundle_name,
+    url,
+    rate_limit_buffer,
+    concurrency=1,
+    requests_per_second=None,
+    resume=False,
+    since=None,
+    store=False,
+    account_encoding="base64",
+    fmt="csv",
+    single_pass=False,
+    metrics=None,
+    progress_bar=False,
+    shard_bytes=0,
+    pack=False,
+    zstd_level=0,
+    snapshot=None,
+):
+    # A local snapshot answers the same account queries as an RPC.
+    if snapshot is not None:
+        rpc = SnapshotSource(snapshot, metrics, progress_bar=progress_bar)
+    else:
+        rpc = SolanaRPC(
+            url,
+            requests_per_second,
+            concurrency,
+            account_encoding,
+            metrics,
+            shard_bytes,
+        )
+    metrics = rpc.metrics
     version = rpc.get_version()
+    context_slot = rpc.pin_context_slot()
     now = time.localtime()
 
     print("Downloading all Solana programs...")
-    print(f"    RPC URL         : {url}")
+    print(f"    RPC URL         : {', '.join(rpc.urls)}")
     print(f"    Solana Version  : {version}")
+    print(f"    Context Slot    : {context_slot}")
     print(f"    Bundle Name     : {bundle_name}")
     print(f"    Date            : {time.strftime('%Y-%m-%d', now)}")
+    print(f"    Resume          : {resume}")
+    print(f"    Since Bundle    : {since}")
+    print(f"    ELF Store       : {store}")
+    print(f"    Format          : {fmt}")
+    print(f"    Single Pass     : {single_pass}")
+    print(f"    Shards          : {256 ** shard_bytes}")
+
+    # A resumed clone of a packed bundle keeps packing it.
+    if resume and is_packed(bundle_full_path(bundle_name)):
+        pack = True
+    print(f"    Packed          : {pack}")
+
+    if since is not None and not bundle_full_path(since).exists():
+        print(f"Bundle '{since}' does not exist.", file=sys.stderr)
+        since = None
 
     init_bundle(bundle_name)
+    if not pack:
+        # An earlier packed clone's pack would be read instead of the ELFs
+        # written now.
+        delete_pack(bundle_full_path(bundle_name))
+    checkpoint = Checkpoint(bundle_name, resume)
+    elf_store = ElfStore() if store else None
+    elf_pack = PackWriter(
+        bundle_full_path(bundle_name),
+        zstd_level,
+        append=resume,
+    ) if pack else None
 
     # Write both the date and the Solana version to "version.txt".
+    # A resumed clone keeps the version of the run it continues.
     version_file = bundle_full_path(bundle_name) / "version.txt"
-    with open(version_file, "w") as version_file:
-        version_file.write(f"Date: {time.strftime('%Y-%m-%d', now)}\n")
-        version_file.write(f"Solana Version: {version}\n")
+    if not (resume and version_file.exists()):
+        with open(version_file, "w") as version_file:
+            version_file.write(f"Date: {time.strftime('%Y-%m-%d', now)}\n")
+            version_file.write(f"Solana Version: {version}\n")
 
-    # BPF Loader Program Accounts.
-    print("Downloading BPF Loader program accounts...")
-    time.sleep(rate_limit_buffer)
-    bpf_loader_keys = list(rpc.get_program_account_keys(
-        BPF_LOADER_PUBKEY,
-        [BPF_LOADER_FILTER],
-    ));
-    print(f"Found {len(bpf_loader_keys)} BPF Loader program keys")
-    write_to_bundle_csv(
-        bundle_name,
-        "bpf_loader.csv",
-        [[str(k)] for k in bpf_loader_keys],
+    scheduler = Scheduler()
+    if single_pass:
+        _schedule_single_pass(
+            scheduler,
+            rpc,
+            bundle_name,
+            checkpoint,
+            elf_store,
+            elf_pack,
+            rate_limit_buffer,
+            fmt,
+            progress_bar,
+        )
+    else:
+        _schedule_clone(
+            scheduler,
+            rpc,
+            bundle_name,
+            checkpoint,
+            elf_store,
+            elf_pack,
+            rate_limit_buffer,
+            resume,
+            since,
+            fmt,
+            progress_bar,
+        )
+    # Phases run side by side as soon as their inputs are ready, sharing the
+    # RPC client's rate limit and in-flight budget.
+    scheduler.run()
+    _finish(rpc, checkpoint, elf_store, elf_pack)
+
+def _schedule_clone(
+    scheduler,
+    rpc,
+    bundle_name,
+    checkpoint,
+    elf_store,
+    elf_pack,
+    rate_limit_buffer,
+    resume,
+    since,
+    fmt,
+    progress_bar,
+):
+    """
+    Adds the tasks of a clone to `scheduler`. Each loader's programs are
+    listed, and its ELFs fetched as soon as its own list is in, without
+    waiting on the other loaders.
+    """
+    metrics = rpc.metrics
+
+    # BPF Loader, BPF Loader 2 and BPF Loader 3 Program Accounts. Loader V3
+    # listings are the largest, and can be split into shards by Program Data
+    # address.
+    for (table, loader_name, loader_pubkey, loader_filter, shard_offset) in [
+        (
+            "bpf_loader",
+            "BPF Loader",
+            BPF_LOADER_PUBKEY,
+            BPF_LOADER_FILTER,
+            None,
+        ),
+        (
+            "bpf_loader_2",
+            "BPF Loader 2",
+            BPF_LOADER_2_PUBKEY,
+            BPF_LOADER_FILTER,
+            None,
+        ),
+        (
+            "bpf_loader_3",
+            "BPF Loader 3",
+            BPF_LOADER_3_PUBKEY,
+            BPF_LOADER_3_PROGRAM_FILTER,
+            BPF_LOADER_3_PROGRAM_SHARD_OFFSET,
+        ),
+    ]:
+        def list_keys(
+            table=table,
+            loader_name=loader_name,
+            loader_pubkey=loader_pubkey,
+            loader_filter=loader_filter,
+            shard_offset=shard_offset,
+        ):
+            return _list_program_keys(
+                rpc,
+                bundle_name,
+                table,
+                loader_name,
+                loader_pubkey,
+                [loader_filter],
+                rate_limit_buffer,
+                resume,
+                fmt,
+                shard_offset,
+            )
+
+        scheduler.add(f"list_{table}", list_keys)
+
+    # BPF Loader 3 Program Accounts with Program Data Accounts.
+    data_keys_table = "bpf_loader_3_with_data_keys"
+
+    def index_program_data(bpf_loader_3_keys):
+        if resume and bundle_table_exists(bundle_name, data_keys_table):
+            return ProgramDataIndex(
+                read_bundle_table(bundle_name, data_keys_table)
+            )
+        with metrics.stage("programdata_addresses"):
+            bpf_loader_3_index = ProgramDataIndex.from_tables(
+                bpf_loader_3_keys,
+                get_programdata_addresses(bpf_loader_3_keys),
+            )
+        write_to_bundle_table(
+            bundle_name,
+            data_keys_table,
+            [[k, dk] for (k, dk) in bpf_loader_3_index],
+            fmt,
+        )
+        return bpf_loader_3_index
+
+    scheduler.add(
+        "programdata_addresses",
+        index_program_data,
+        ["list_bpf_loader_3"],
+    )
+
+    # BPF Loader 3 Program Accounts with deployment slots, read from the 8
+    # bytes at offset 4 of each Program Data account. A later clone compares
+    # against these to find redeployed programs.
+    slots_table = "bpf_loader_3_keys_with_slots"
+
+    def download_slots(bpf_loader_3_index):
+        if resume and bundle_table_exists(bundle_name, slots_table):
+            return KeyTable.from_items(
+                read_bundle_table(bundle_name, slots_table)
+            )
+        print("Downloading BPF Loader 3 deployment slots...")
+        time.sleep(rate_limit_buffer)
+        progress = Progress(
+            "Downloaded slots of",
+            len(bpf_loader_3_index),
+            "BPF Loader 3 programs",
+            bar=progress_bar,
+        )
+        with metrics.stage("deployment_slots") as stage:
+            bpf_loader_3_slots = bpf_loader_3_index.join(
+                (dk, le_to_u64(s))
+                for (dk, s) in progress.track(rpc.get_multiple_programs(
+                    bpf_loader_3_index.data_keys(),
+                    rate_limit_buffer,
+                    offset=4,
+                    length=8,
+                ))
+            )
+            stage["items"] = len(bpf_loader_3_slots)
+        write_to_bundle_table(
+            bundle_name,
+            slots_table,
+            bpf_loader_3_slots.items(),
+            fmt,
+        )
+        return bpf_loader_3_slots
+
+    scheduler.add(
+        "deployment_slots",
+        download_slots,
+        ["programdata_addresses"],
     )
-    
-    # BPF Loader 2 Program Accounts.
-    print("Downloading BPF Loader 2 program accounts...")
+
+    # Programs unchanged since the previous bundle are linked from it rather
+    # than downloaded. Loader V1 and V2 programs cannot be redeployed, and
+    # Loader V3 programs are unchanged if their deployment slot is.
+    previous_manifest = read_manifest(since) if since is not None else {}
+    previous_slots = KeyTable()
+    if since is not None and bundle_table_exists(since, slots_table):
+        previous_slots = KeyTable.from_items(
+            read_bundle_table(since, slots_table)
+        )
+
+    # BPF Loader and BPF Loader 2 ELFs.
+    for (loader, loader_name) in [
+        ("bpf_loader", "BPF Loader"),
+        ("bpf_loader_2", "BPF Loader 2"),
+    ]:
+        def download(keys, loader=loader, loader_name=loader_name):
+            with metrics.stage("link_unchanged", loader=loader):
+                keys = _link_unchanged(
+                    bundle_name,
+                    since,
+                    previous_manifest,
+                    loader,
+                    checkpoint.remaining(loader, keys),
+                    checkpoint,
+                    elf_pack,
+                )
+            return _download_elfs(
+                rpc,
+                bundle_name,
+                checkpoint,
+                elf_store,
+                elf_pack,
+                loader,
+                loader_name,
+                keys,
+                lambda program_id: program_id,
+                rate_limit_buffer,
+                progress_bar,
+            )
+
+        scheduler.add(f"download_{loader}", download, [f"list_{loader}"])
+
+    # BPF Loader 3 ELFs, from offset 45 of each Program Data account.
+    def download_bpf_loader_3(
+        bpf_loader_3_keys,
+        bpf_loader_3_index,
+        bpf_loader_3_slots,
+    ):
+        with metrics.stage("link_unchanged", loader="bpf_loader_3"):
+            remaining_bpf_loader_3_keys = _link_unchanged(
+                bundle_name,
+                since,
+                previous_manifest,
+                "bpf_loader_3",
+                checkpoint.remaining("bpf_loader_3", bpf_loader_3_keys),
+                checkpoint,
+                elf_pack,
+                lambda k: _same_slot(bpf_loader_3_slots, previous_slots, k),
+            )
+        bpf_loader_3_data_keys = bpf_loader_3_index.data_keys(
+            remaining_bpf_loader_3_keys
+        )
+        bpf_loader_3_elf_count = _download_elfs(
+            rpc,
+            bundle_name,
+            checkpoint,
+            elf_store,
+            elf_pack,
+            "bpf_loader_3",
+            "BPF Loader 3",
+            bpf_loader_3_data_keys,
+            bpf_loader_3_index.program_key,
+            rate_limit_buffer,
+            progress_bar,
+            offset=PROGRAMDATA_HEADER_LENGTH,
+        )
+        if bpf_loader_3_elf_count != len(bpf_loader_3_data_keys):
+            print(
+                f"Expected {len(bpf_loader_3_data_keys)} BPF Loader 3 ELFs, "
+                f"but found {bpf_loader_3_elf_count}",
+                file=sys.stderr,
+            )
+        return bpf_loader_3_elf_count
+
+    scheduler.add(
+        "download_bpf_loader_3",
+        download_bpf_loader_3,
+        ["list_bpf_loader_3", "programdata_addresses", "deployment_slots"],
+    )
+
+def _download_elfs(
+    rpc,
+    bundle_name,
+    checkpoint,
+    elf_store,
+    elf_pack,
+    loader,
+    loader_name,
+    keys,
+    program_key,
+    rate_limit_buffer,
+    progress_bar,
+    offset=0,
+):
+    """
+    Downloads the ELFs of the accounts `keys` into the bundle, naming each
+    after `program_key(key)`, and returns how many were written.
+
+    Each ELF is decoded and streamed to disk as its batch's response arrives,
+    while later batches are still in flight.
+    """
+    print(f"Downloading {loader_name} ELFs...")
     time.sleep(rate_limit_buffer)
-    bpf_loader_2_keys = list(rpc.get_program_account_keys(
-        BPF_LOADER_2_PUBKEY,
-        [BPF_LOADER_FILTER],
-    ));
-    print(f"Found {len(bpf_loader_2_keys)} BPF Loader 2 program keys")
-    write_to_bundle_csv(
-        bundle_name,
-        "bpf_loader_2.csv",
-        [[str(k)] for k in bpf_loader_2_keys],
+    count = 0
+    progress = Progress(
+        "Downloaded",
+        len(keys),
+        f"{loader_name} ELFs",
+        bar=progress_bar,
+    )
+    with rpc.metrics.stage("download_elfs", loader=loader) as stage:
+        for (key, digest) in progress.track(rpc.download_multiple_programs(
+            keys,
+            lambda key: _open_elf(
+                bundle_name,
+                loader,
+                program_key(key),
+                elf_store,
+                elf_pack,
+            ),
+            rate_limit_buffer,
+            offset=offset,
+        )):
+            checkpoint.mark_done(loader, program_key(key), digest)
+            count += 1
+        stage["items"] = count
+    print(f"Found {count} {loader_name} ELFs")
+    return count
+
+def _open_elf(bundle_name, loader, program_id, elf_store, elf_pack):
+    """
+    Returns the sink a program's ELF is written to: an entry of the bundle's
+    pack, or a file in its loader's directory.
+    """
+    if elf_pack is not None:
+        return elf_pack.open_entry(program_id, LOADER_NUMBERS[loader])
+    dir = bundle_full_path(bundle_name) / loader
+    dir.mkdir(parents=True, exist_ok=True)
+    return ElfFile(dir / f"{program_id}.elf", elf_store)
+
+def _finish(rpc, checkpoint, elf_store, elf_pack):
+    if len(rpc.pool) > 1:
+        print("RPC endpoints:")
+        rpc.pool.report()
+    if elf_store is not None:
+        print(
+            f"Stored {elf_store.written} new ELFs, {elf_store.reused} already "
+            "in the store"
+        )
+    if elf_pack is not None:
+        elf_pack.close()
+        print(
+            f"Packed {elf_pack.elf_bytes} bytes of ELFs into "
+            f"{elf_pack.stored_bytes} bytes, {len(elf_pack)} ELFs in the pack"
+        )
+    checkpoint.close()
+
+def _schedule_single_pass(
+    scheduler,
+    rpc,
+    bundle_name,
+    checkpoint,
+    elf_store,
+    elf_pack,
+    rate_limit_buffer,
+    fmt,
+    progress_bar=False,
+):
+    """
+    Adds the tasks of a clone with one `getProgramAccounts` call per account
+    type to `scheduler`, rather than listing keys and fetching accounts by
+    key.
+
+    Loader V1 and V2 program accounts hold their ELFs, so each loader takes a
+    single call. Loader V3 takes two: Program accounts sliced to their
+    Program Data addresses, then every Program Data account whole, with its
+    slot, authority and ELF.
+    """
+    for (loader, loader_name, loader_pubkey) in [
+        ("bpf_loader", "BPF Loader", BPF_LOADER_PUBKEY),
+        ("bpf_loader_2", "BPF Loader 2", BPF_LOADER_2_PUBKEY),
+    ]:
+        def download(
+            loader=loader,
+            loader_name=loader_name,
+            loader_pubkey=loader_pubkey,
+        ):
+            print(f"Downloading {loader_name} program accounts with ELFs...")
+            time.sleep(rate_limit_buffer)
+            keys = KeyTable()
+            with rpc.metrics.stage(
+                "download_program_accounts",
+                loader=loader,
+            ) as stage:
+                for (program_id, digest) in rpc.download_program_accounts(
+                    loader_pubkey,
+                    [BPF_LOADER_FILTER],
+                    lambda program_id: _open_elf(
+                        bundle_name,
+                        loader,
+                        program_id,
+                        elf_store,
+                        elf_pack,
+                    ),
+                ):
+                    checkpoint.mark_done(loader, program_id, digest)
+                    keys.append(program_id)
+                stage["items"] = len(keys)
+            print(f"Found {len(keys)} {loader_name} ELFs")
+            write_to_bundle_table(
+                bundle_name,
+                loader,
+                [[k] for k in keys],
+                fmt,
+            )
+
+        scheduler.add(f"download_{loader}", download)
+
+    # BPF Loader 3 Program Accounts, each holding its Program Data address
+    # at offset 4.
+    def list_bpf_loader_3():
+        print("Downloading BPF Loader 3 program accounts...")
+        time.sleep(rate_limit_buffer)
+        with rpc.metrics.stage("list_keys", loader="bpf_loader_3") as stage:
+            bpf_loader_3_index = ProgramDataIndex(
+                rpc.get_program_accounts(
+                    BPF_LOADER_3_PUBKEY,
+                    [BPF_LOADER_3_PROGRAM_FILTER],
+                    offset=4,
+                    length=32,
+                    shard_offset=BPF_LOADER_3_PROGRAM_SHARD_OFFSET,
+                )
+            )
+            stage["items"] = len(bpf_loader_3_index)
+        print(f"Found {len(bpf_loader_3_index)} BPF Loader 3 program keys")
+        write_to_bundle_table(
+            bundle_name,
+            "bpf_loader_3",
+            [[k] for k in bpf_loader_3_index.program_keys],
+            fmt,
+        )
+        write_to_bundle_table(
+            bundle_name,
+            "bpf_loader_3_with_data_keys",
+            [[k, dk] for (k, dk) in bpf_loader_3_index],
+            fmt,
+        )
+        return bpf_loader_3_index
+
+    scheduler.add("list_bpf_loader_3", list_bpf_loader_3)
+
+    # BPF Loader 3 Program Data Accounts with ELFs.
+    def download_bpf_loader_3(bpf_loader_3_index):
+        print("Downloading BPF Loader 3 program data accounts with ELFs...")
+        time.sleep(rate_limit_buffer)
+
+        def open_program_data(data_key):
+            # Program Data of programs deployed since the listing is skipped.
+            program_id = bpf_loader_3_index.program_key(data_key)
+            if program_id is None:
+                return None
+            return _ProgramDataFile(_open_elf(
+                bundle_name,
+                "bpf_loader_3",
+                program_id,
+                elf_store,
+                elf_pack,
+            ))
+
+        slots = KeyTable()
+        authorities = []
+        progress = Progress(
+            "Downloaded",
+            len(bpf_loader_3_index),
+            "BPF Loader 3 ELFs",
+            bar=progress_bar,
+        )
+        with rpc.metrics.stage(
+            "download_program_accounts",
+            loader="bpf_loader_3",
+        ) as stage:
+            for (data_key, (header, digest)) in progress.track(
+                rpc.download_program_accounts(
+                    BPF_LOADER_3_PUBKEY,
+                    [
+                        BPF_LOADER_3_PROGRAMDATA_FILTER,
+                        BPF_LOADER_3_PROGRAMDATA_ELF_FILTER,
+                    ],
+                    open_program_data,
+                )
+            ):
+                program_id = bpf_loader_3_index.program_key(data_key)
+                (slot, authority) = read_programdata_header(header)
+                slots.append(program_id, slot)
+                authorities.append(authority)
+                checkpoint.mark_done("bpf_loader_3", program_id, digest)
+            stage["items"] = len(slots)
+        if len(slots) != len(bpf_loader_3_index):
+            print(
+                f"Expected {len(bpf_loader_3_index)} BPF Loader 3 ELFs, but "
+                f"found {len(slots)}",
+                file=sys.stderr,
+            )
+        print(f"Found {len(slots)} BPF Loader 3 ELFs")
+        # Written in index order, like the listing.
+        order = [
+            idx for idx in map(
+                slots.find,
+                bpf_loader_3_index.program_keys,
+            )
+            if idx is not None
+        ]
+        write_to_bundle_table(
+            bundle_name,
+            "bpf_loader_3_keys_with_slots",
+            slots.take(order).items(),
+            fmt,
+        )
+        write_to_bundle_table(
+            bundle_name,
+            "bpf_loader_3_keys_with_authorities",
+            [[slots.key(idx), authorities[idx]] for idx in order],
+            fmt,
+        )
+
+    scheduler.add(
+        "download_bpf_loader_3",
+        download_bpf_loader_3,
+        ["list_bpf_loader_3"],
     )
-    
-    # BPF Loader 3 Program Accounts.
-    print("Downloading BPF Loader 3 program accounts...")
+
+class _ProgramDataFile:
+    """
+    Sink for a whole Program Data account, which keeps its header and
+    streams the ELF after it into `elf_file`. `commit` returns the header
+    and the ELF's digest.
+    """
+    def __init__(self, elf_file):
+        self.elf_file = elf_file
+        self.header = b""
+
+    def write(self, data):
+        if len(self.header) < PROGRAMDATA_HEADER_LENGTH:
+            split = PROGRAMDATA_HEADER_LENGTH - len(self.header)
+            self.header += data[:split]
+            data = data[split:]
+        if len(data) > 0:
+            self.elf_file.write(data)
+
+    def commit(self):
+        return (self.header, self.elf_file.commit())
+
+    def abort(self):
+        self.elf_file.abort()
+
+def _list_program_keys(
+    rpc,
+    bundle_name,
+    table,
+    loader_name,
+    loader_pubkey,
+    filters,
+    rate_limit_buffer,
+    resume,
+    fmt,
+    shard_offset=None,
+):
+    """
+    Lists the program keys owned by a loader and writes them to `table`, or
+    reads them back from a previous run's `table` when resuming. The listing
+    is sharded at `shard_offset` if the client shards listings.
+    """
+    if resume and bundle_table_exists(bundle_name, table):
+        keys = KeyTable(
+            row[0] for row in read_bundle_table(bundle_name, table)
+        )
+        print(f"Resuming with {len(keys)} {loader_name} program keys")
+        return keys
+    print(f"Downloading {loader_name} program accounts...")
     time.sleep(rate_limit_buffer)
-    bpf_loader_3_keys = list(rpc.get_program_account_keys(
-        BPF_LOADER_3_PUBKEY,
-        [BPF_LOADER_3_PROGRAM_FILTER],
-    ));
-    print(f"Found {len(bpf_loader_3_keys)} BPF Loader 3 program keys")
-    write_to_bundle_csv(
+    with rpc.metrics.stage("list_keys", loader=table) as stage:
+        keys = KeyTable(rpc.get_program_account_keys(
+            loader_pubkey,
+            filters,
+            shard_offset,
+        ))
+        stage["items"] = len(keys)
+    print(f"Found {len(keys)} {loader_name} program keys")
+    write_to_bundle_table(
         bundle_name,
-        "bpf_loader_3.csv",
-        [[str(k)] for k in bpf_loader_3_keys],
+        table,
+        [[str(k)] for k in keys],
+        fmt,
     )
+    return keys
 
-    # BPF Loader 3 Program Accounts with Program Data Accounts.
-    bpf_loader_3_keys_with_data_keys = [
-        (k, get_programdata_address(str(k)))
-        for k in bpf_loader_3_keys
-    ]
-    bpf_loader_3_data_keys = [
-        dk for (_, dk) in bpf_loader_3_keys_with_data_keys
-    ]
-    write_to_bundle_csv(
-        bundle_name,
-        "bpf_loader_3_with_data_keys.csv",
-        [[str(k), str(dk)] for (k, dk) in bpf_loader_3_keys_with_data_keys],
+def _same_slot(slots, previous_slots, program_key) -> bool:
+    """
+    Returns whether a program was deployed at the same slot as in a previous
+    bundle.
+    """
+    idx = slots.find(program_key)
+    previous_idx = previous_slots.find(program_key)
+    return (
+        idx is not None
+        and previous_idx is not None
+        and slots.slots[idx] == previous_slots.slots[previous_idx]
     )
-    
-    # BPF Loader ELFs.
-    print("Downloading BPF Loader ELFs...")
-    time.sleep(rate_limit_buffer)
-    bpf_loader_elfs = list(rpc.get_multiple_programs(
-        bpf_loader_keys,
-        rate_limit_buffer,
-    ))
-    print(f"Found {len(bpf_loader_elfs)} BPF Loader ELFs")
-    for (program_id, elf) in bpf_loader_elfs:
-        dir = bundle_full_path(bundle_name) / "bpf_loader"
-        dir.mkdir(parents=True, exist_ok=True)
-        file_name = dir / f"{program_id}.elf"
-        with open(file_name, "wb") as program_file:
-            program_file.write(elf)
-
-    # BPF Loader 2 ELFs.
-    print("Downloading BPF Loader 2 ELFs...")
-    time.sleep(rate_limit_buffer)
-    bpf_loader_2_elfs = list(rpc.get_multiple_programs(
-        bpf_loader_2_keys,
-        rate_limit_buffer,
-    ))
-    print(f"Found {len(bpf_loader_2_elfs)} BPF Loader 2 ELFs")
-    for (program_id, elf) in bpf_loader_2_elfs:
-        dir = bundle_full_path(bundle_name) / "bpf_loader_2"
-        dir.mkdir(parents=True, exist_ok=True)
-        file_name = os.path.join(dir, f"{program_id}.elf")
-        with open(file_name, "wb") as program_file:
-            program_file.write(elf)
-
-    # BPF Loader 3 ELFs.
-    print("Downloading BPF Loader 3 ELFs...")
-    time.sleep(rate_limit_buffer)
-    bpf_loader_3_elfs = list(rpc.get_multiple_programs(
-        bpf_loader_3_data_keys,
-        rate_limit_buffer,
-        offset=45,
-    ))
-    if len(bpf_loader_3_elfs) != len(bpf_loader_3_data_keys):
-        print(
-            f"Expected {len(bpf_loader_3_data_keys)} BPF Loader 3 ELFs, but "
-            f"found {len(bpf_loader_3_elfs)}",
-            sys.stderr,
-        )
-    print(f"Found {len(bpf_loader_3_elfs)} BPF Loader 3 ELFs")
-    for (data_key, elf) in bpf_loader_3_elfs:
-        # Find the program key associated with the data key.
-        program_key = None
-        for (program_key, data_key_) in bpf_loader_3_keys_with_data_keys:
-            if data_key == data_key_:
-                break
-        if program_key is not None:
-            dir = bundle_full_path(bundle_name) / "bpf_loader_3"
-            dir.mkdir(parents=True, exist_ok=True)
-            file_name = os.path.join(dir, f"{program_id}.elf")
-            with open(file_name, "wb") as program_file:
-                program_file.write(elf)
\ No newline at end of file
+
+def _link_unchanged(
+    bundle_name,
+    since,
+    previous_manifest,
+    loader,
+    program_keys,
+    checkpoint,
+    elf_pack=None,
+    is_unchanged=None,
+):
+    """
+    Links the ELFs of unchanged programs from the `since` bundle into this
+    bundle, and returns the program keys that still have to be downloaded.
+    ELFs are copied instead when either bundle is packed.
+    """
+    if since is None:
+        return program_keys
+    src_dir = bundle_full_path(since) / loader
+    dst_dir = bundle_full_path(bundle_name) / loader
+    if elf_pack is None:
+        dst_dir.mkdir(parents=True, exist_ok=True)
+    previous_pack = PackReader(bundle_full_path(since)) \
+        if is_packed(bundle_full_path(since)) else None
+    remaining = KeyTable()
+    for k in program_keys:
+        if is_unchanged is not None and not is_unchanged(k):
+            remaining.append(k)
+            continue
+        data = None
+        if previous_pack is not None:
+            i = previous_pack.find(k)
+            if i is None:
+                remaining.append(k)
+                continue
+            (data, digest) = (previous_pack.read(i), previous_pack.digest(i))
+        else:
+            src = src_dir / f"{k}.elf"
+            if not src.exists():
+                remaining.append(k)
+                continue
+            digest = previous_manifest.get((loader, k))
+            if digest is None:
+                digest = file_digest(src)
+        if elf_pack is not None:
+            if data is None:
+                with open(src, "rb") as file:
+                    data = file.read()
+            elf_pack.add(k, LOADER_NUMBERS[loader], data, digest)
+        elif data is not None:
+            write_atomic(dst_dir / f"{k}.elf", data)
+        else:
+            link_or_copy(src, dst_dir / f"{k}.elf")
+        checkpoint.mark_done(loader, k, digest)
+    if previous_pack is not None:
+        previous_pack.close()
+    print(
+        f"Linked {len(program_keys) - len(remaining)} unchanged {loader} ELFs "
+        f"from '{since}'"
+    )
+    return remaining
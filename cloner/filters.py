@@ -26,6 +26,28 @@ BPF_LOADER_3_PROGRAMDATA_FILTER = {
         "offset": 0,
         "bytes": b58encode(b"\x03\x00\x00\x00").decode("utf-8"),
     },
-    # ELF
+}
+# BPF Loader 3 Program Data Accounts holding an ELF, which starts after the
+# 45-byte Program Data header. Each filter is a single `memcmp`, so this is
+# passed alongside `BPF_LOADER_3_PROGRAMDATA_FILTER`.
+BPF_LOADER_3_PROGRAMDATA_ELF_FILTER = {
     "memcmp": {"offset": 45, "bytes": b58encode(ELF_MAGIC).decode("utf-8")},
-}
\ No newline at end of file
+}
+
+# Offsets of evenly spread bytes in Loader V3 accounts, by which listings can
+# be split into shards: the Program Data address of a Program account, and
+# the low byte of the deployment slot of a Program Data account.
+BPF_LOADER_3_PROGRAM_SHARD_OFFSET = 4
+BPF_LOADER_3_PROGRAMDATA_SHARD_OFFSET = 4
+
+def shard_filter(offset, prefix):
+    """
+    Returns a filter matching accounts whose data at `offset` starts with
+    the bytes `prefix`.
+    """
+    return {
+        "memcmp": {
+            "offset": offset,
+            "bytes": b58encode(prefix).decode("utf-8"),
+        },
+    }
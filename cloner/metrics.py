@@ -0,0 +1,235 @@
+import bisect
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from .util import write_atomic
+
+METRICS_FORMATS = ["jsonl", "prometheus"]
+
+# Upper bounds of request latency buckets, in seconds. Single calls take
+# milliseconds, while a full-data `getProgramAccounts` can take minutes.
+LATENCY_BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+PREFIX = "cloner_"
+
+class Histogram:
+    """
+    Counts observations into buckets by upper bound, as Prometheus does.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Returns `(upper_bound, count)` pairs, counting every observation at
+        or below each bound, ending with `+Inf`.
+        """
+        total = 0
+        pairs = []
+        for (bound, count) in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+class Metrics:
+    """
+    Thread-safe counters, histograms and stage timings for one command.
+
+    With a `path`, metrics are written there every `interval` seconds and on
+    `close`, either as Prometheus text (rewritten each time, for a
+    node_exporter textfile collector) or as JSON lines (appended, so a run is
+    traced as it goes). JSON lines also get one `span` line per finished
+    stage. Without a `path`, metrics are only kept in memory.
+    """
+    def __init__(self, path=None, fmt="jsonl", interval=60.0):
+        if fmt not in METRICS_FORMATS:
+            raise ValueError(f"Unknown metrics format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if path is not None:
+            if fmt == "jsonl":
+                open(path, "w").close()
+            self.thread = threading.Thread(
+                target=self._flush_every,
+                args=(interval,),
+                daemon=True,
+            )
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds `value` to the counter `name` with `labels`.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds an observation to the histogram `name` with `labels`.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Times a stage of a command. Yields a dict whose items, such as an
+        item count, are added to the stage's span.
+        """
+        fields = {}
+        start = time.time()
+        started = time.monotonic()
+        try:
+            yield fields
+        finally:
+            seconds = time.monotonic() - started
+            self.count("stage_seconds_total", seconds, stage=name, **labels)
+            self.count("stage_runs_total", 1, stage=name, **labels)
+            if self.path is not None and self.fmt == "jsonl":
+                self._append([{
+                    "time": time.time(),
+                    "type": "span",
+                    "name": name,
+                    "labels": labels,
+                    "start": start,
+                    "seconds": seconds,
+                    **fields,
+                }])
+
+    def value(self, name, **labels):
+        """
+        Returns the value of a counter, or 0.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            return self.counters.get(key, 0)
+
+    def samples(self) -> list:
+        """
+        Returns every counter and histogram as a JSON-compatible dict.
+        """
+        now = time.time()
+        samples = []
+        with self.lock:
+            for ((name, labels), value) in sorted(self.counters.items()):
+                samples.append({
+                    "time": now,
+                    "type": "counter",
+                    "name": name,
+                    "labels": dict(labels),
+                    "value": value,
+                })
+            for ((name, labels), histogram) in sorted(
+                self.histograms.items()
+            ):
+                samples.append({
+                    "time": now,
+                    "type": "histogram",
+                    "name": name,
+                    "labels": dict(labels),
+                    "buckets": {
+                        str(bound): count
+                        for (bound, count) in histogram.cumulative()
+                    },
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                })
+        return samples
+
+    def prometheus(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        typed = set()
+        for sample in self.samples():
+            name = PREFIX + sample["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {sample['type']}")
+            labels = sample["labels"]
+            if sample["type"] == "counter":
+                lines.append(
+                    f"{name}{_labels(labels)} {_number(sample['value'])}"
+                )
+                continue
+            for (bound, count) in sample["buckets"].items():
+                lines.append(
+                    f"{name}_bucket{_labels({**labels, 'le': bound})} {count}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} "
+                         f"{_number(sample['sum'])}")
+            lines.append(f"{name}_count{_labels(labels)} {sample['count']}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """
+        Writes the current metrics to `path`, if any.
+        """
+        if self.path is None:
+            return
+        if self.fmt == "prometheus":
+            with self.write_lock:
+                write_atomic(self.path, self.prometheus().encode("utf-8"))
+        else:
+            self._append(self.samples())
+
+    def close(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def _flush_every(self, interval):
+        while not self.stopped.wait(interval):
+            self.flush()
+
+    def _append(self, records):
+        with self.write_lock:
+            with open(self.path, "a") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+
+def _labels(labels) -> str:
+    if len(labels) == 0:
+        return ""
+    pairs = ",".join(
+        f'{k}="{_escape(v)}"' for (k, v) in labels.items()
+    )
+    return "{" + pairs + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,503 @@
+from hashlib import sha256
+import mmap
+import os
+import struct
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .keys import KEY_LENGTH, key_bytes, key_str
+from .util import Progress, bundle_full_path, imap_bounded, write_atomic
+
+# Loader directories of a bundle, with the loader number used in tables and
+# packs.
+LOADERS = [("bpf_loader", 1), ("bpf_loader_2", 2), ("bpf_loader_3", 3)]
+LOADER_NUMBERS = dict(LOADERS)
+LOADER_NAMES = {number: name for (name, number) in LOADERS}
+
+PACK_FILE_NAME = "programs.pack"
+INDEX_FILE_NAME = "programs.idx"
+
+# A pack is a magic number followed by entries, each an entry header and the
+# ELF, compressed with zstd if the header's flags say so. Entries are only
+# ever appended, so a pack cut short by a crash loses at most its last entry.
+PACK_MAGIC = b"CLNRPAK1"
+# Program ID, loader, flags, stored length, ELF length and ELF SHA-256.
+ENTRY_HEADER = struct.Struct("<32sBB6xQQ32s")
+FLAG_ZSTD = 0x1
+
+# The index is a header, with the length of the pack it covers, followed by
+# one fixed-size record per program sorted by program ID, so a program is
+# found by binary search straight from the memory-mapped file. Records hold
+# the program ID, loader, flags, the offset of the stored ELF in the pack,
+# and its stored and ELF lengths.
+INDEX_MAGIC = b"CLNRIDX1"
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_RECORD = struct.Struct("<32sBB6xQQQ")
+
+def is_packed(dir_path) -> bool:
+    return (dir_path / PACK_FILE_NAME).exists()
+
+def delete_pack(dir_path):
+    """
+    Removes the pack of the bundle at `dir_path` and its index, if any.
+    """
+    for name in (PACK_FILE_NAME, INDEX_FILE_NAME):
+        if (dir_path / name).exists():
+            os.remove(dir_path / name)
+
+def _scan(data, start):
+    """
+    Reads the index records of the entries of pack `data` from offset
+    `start`, and returns them with the end of the last complete entry.
+    """
+    records = []
+    end = start
+    while end + ENTRY_HEADER.size <= len(data):
+        (program_id, loader, flags, stored_length, length, _) = \
+            ENTRY_HEADER.unpack_from(data, end)
+        offset = end + ENTRY_HEADER.size
+        if offset + stored_length > len(data):
+            break
+        records.append(
+            (program_id, loader, flags, offset, stored_length, length)
+        )
+        end = offset + stored_length
+    return (records, end)
+
+def _index_header(path):
+    """
+    Returns the record count of the index at `path` and the pack length it
+    covers, or `None` if it is missing or unreadable.
+    """
+    if not path.exists():
+        return None
+    with open(path, "rb") as file:
+        data = file.read(INDEX_HEADER.size)
+    if len(data) < INDEX_HEADER.size:
+        return None
+    (magic, count, covered) = INDEX_HEADER.unpack(data)
+    if magic != INDEX_MAGIC or os.path.getsize(path) \
+            != INDEX_HEADER.size + count * INDEX_RECORD.size:
+        return None
+    return (count, covered)
+
+def _read_index(dir_path):
+    """
+    Returns the records of a pack's index, and the pack length it covers.
+    A missing or unreadable index covers nothing.
+    """
+    path = dir_path / INDEX_FILE_NAME
+    if _index_header(path) is None:
+        return ([], len(PACK_MAGIC))
+    with open(path, "rb") as file:
+        data = file.read()
+    (_, _, covered) = INDEX_HEADER.unpack_from(data)
+    return (
+        list(INDEX_RECORD.iter_unpack(data[INDEX_HEADER.size:])),
+        covered,
+    )
+
+def _index_bytes(records, covered) -> bytes:
+    """
+    Serializes index records, sorted by program ID. A program packed more
+    than once keeps its last entry.
+    """
+    latest = {record[0]: record for record in records}
+    return INDEX_HEADER.pack(INDEX_MAGIC, len(latest), covered) + b"".join(
+        INDEX_RECORD.pack(*latest[k]) for k in sorted(latest)
+    )
+
+def _load(dir_path, data):
+    """
+    Returns the index records of pack `data`, from its index and from a scan
+    of any entries appended after the index was written, and the end of the
+    last complete entry.
+    """
+    (records, covered) = _read_index(dir_path)
+    if covered > len(data):
+        (records, covered) = ([], len(PACK_MAGIC))
+    (appended, end) = _scan(data, covered)
+    return (records + appended, end)
+
+class PackWriter:
+    """
+    Appends ELFs to the pack of the bundle at `dir_path`, and writes its
+    index on `close`. ELFs are compressed with zstd at `zstd_level`, or
+    stored as they are at level 0, and kept uncompressed if compression does
+    not make them smaller.
+
+    With `append`, entries are added to an existing pack. Entries appended
+    after its index was last written, such as by a clone that crashed, are
+    recovered by scanning the pack. Otherwise the pack is started anew.
+    """
+    def __init__(self, dir_path, zstd_level=0, append=False):
+        if zstd_level > 0 and zstandard is None:
+            raise RuntimeError(
+                "Compressed packs need the optional `zstandard` package."
+            )
+        self.dir_path = dir_path
+        self.zstd_level = zstd_level
+        path = dir_path / PACK_FILE_NAME
+        self.records = []
+        if append and path.exists() and os.path.getsize(path) > 0:
+            self.file = open(path, "r+b")
+            with mmap.mmap(
+                self.file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            ) as data:
+                if data[:len(PACK_MAGIC)] != PACK_MAGIC:
+                    self.file.close()
+                    raise ValueError(f"{path} is not a pack")
+                (self.records, self.end) = _load(dir_path, data)
+            # Drop a partial last entry.
+            self.file.truncate(self.end)
+            self.file.seek(self.end)
+        else:
+            # A previous pack's index would not match the new pack.
+            if (dir_path / INDEX_FILE_NAME).exists():
+                os.remove(dir_path / INDEX_FILE_NAME)
+            self.file = open(path, "wb")
+            self.file.write(PACK_MAGIC)
+            self.end = len(PACK_MAGIC)
+        self.stored_bytes = 0
+        self.elf_bytes = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len({record[0] for record in self.records})
+
+    def add(self, program_id, loader, data, digest=None) -> str:
+        """
+        Appends an ELF to the pack, and returns its digest. Safe to call from
+        several threads, which compress their ELFs in parallel.
+        """
+        digest = digest if digest is not None else sha256(data).hexdigest()
+        (stored, flags) = (data, 0)
+        if self.zstd_level > 0:
+            compressed = zstandard.ZstdCompressor(
+                level=self.zstd_level,
+            ).compress(data)
+            if len(compressed) < len(data):
+                (stored, flags) = (compressed, FLAG_ZSTD)
+        header = ENTRY_HEADER.pack(
+            key_bytes(program_id),
+            loader,
+            flags,
+            len(stored),
+            len(data),
+            bytes.fromhex(digest),
+        )
+        with self.lock:
+            offset = self.end + ENTRY_HEADER.size
+            self.file.write(header)
+            self.file.write(stored)
+            # An entry is recorded in a checkpoint once added, so it must
+            # survive the process crashing.
+            self.file.flush()
+            self.end = offset + len(stored)
+            self.records.append((
+                key_bytes(program_id),
+                loader,
+                flags,
+                offset,
+                len(stored),
+                len(data),
+            ))
+            self.stored_bytes += len(stored)
+            self.elf_bytes += len(data)
+        return digest
+
+    def open_entry(self, program_id, loader):
+        return PackEntry(self, program_id, loader)
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+            write_atomic(
+                self.dir_path / INDEX_FILE_NAME,
+                _index_bytes(self.records, self.end),
+            )
+
+class PackEntry:
+    """
+    Sink that collects an ELF, hashing it on the way, and appends it to a
+    pack once `commit` is called.
+    """
+    def __init__(self, pack, program_id, loader):
+        self.pack = pack
+        self.program_id = program_id
+        self.loader = loader
+        self.digest = sha256()
+        self.data = bytearray()
+
+    def write(self, data):
+        self.digest.update(data)
+        self.data += data
+
+    def commit(self) -> str:
+        """
+        Appends the ELF to the pack and returns its digest.
+        """
+        return self.pack.add(
+            self.program_id,
+            self.loader,
+            bytes(self.data),
+            self.digest.hexdigest(),
+        )
+
+    def abort(self):
+        self.data = bytearray()
+
+class PackReader:
+    """
+    Reads ELFs from the pack of the bundle at `dir_path` through memory maps,
+    without extracting it. A program is found by binary search over the
+    index, and only its own entry of the pack is read.
+
+    If the index does not cover the whole pack, such as after a crashed
+    clone, the entries past it are scanned and indexed in memory.
+    """
+    def __init__(self, dir_path):
+        path = dir_path / PACK_FILE_NAME
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(PACK_MAGIC)] != PACK_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a pack")
+        self.index_file = None
+        index_path = dir_path / INDEX_FILE_NAME
+        header = _index_header(index_path)
+        if header is not None and header[1] == len(self.data):
+            self.index_file = open(index_path, "rb")
+            self.index = mmap.mmap(
+                self.index_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            )
+        else:
+            (records, end) = _load(dir_path, self.data)
+            self.index = _index_bytes(records, end)
+        (_, self.count, _) = INDEX_HEADER.unpack_from(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Yields the base58 program ID and loader number of every entry.
+        """
+        for i in range(len(self)):
+            (program_id, loader, _, _, _, _) = self.record(i)
+            yield (key_str(program_id), loader)
+
+    def __contains__(self, program_id):
+        return self.find(program_id) is not None
+
+    def record(self, i):
+        return INDEX_RECORD.unpack_from(
+            self.index,
+            INDEX_HEADER.size + i * INDEX_RECORD.size,
+        )
+
+    def _key(self, i) -> bytes:
+        start = INDEX_HEADER.size + i * INDEX_RECORD.size
+        return self.index[start:start + KEY_LENGTH]
+
+    def find(self, program_id):
+        """
+        Returns the index of `program_id`'s entry, or `None`, by binary
+        search.
+        """
+        target = key_bytes(program_id)
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._key(lo) == target:
+            return lo
+        return None
+
+    def read(self, i) -> bytes:
+        """
+        Returns the ELF of the `i`th entry.
+        """
+        (_, _, flags, offset, stored_length, length) = self.record(i)
+        stored = self.data[offset:offset + stored_length]
+        if flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise RuntimeError(
+                    "This pack is compressed, which needs the optional "
+                    "`zstandard` package."
+                )
+            return zstandard.ZstdDecompressor().decompress(
+                stored,
+                max_output_size=length,
+            )
+        return stored
+
+    def digest(self, i) -> str:
+        """
+        Returns the SHA-256 digest of the `i`th entry's ELF, as packed.
+        """
+        (_, _, _, offset, _, _) = self.record(i)
+        (_, _, _, _, _, digest) = ENTRY_HEADER.unpack_from(
+            self.data,
+            offset - ENTRY_HEADER.size,
+        )
+        return digest.hex()
+
+    def get(self, program_id):
+        """
+        Returns the ELF of `program_id`, or `None` if it is not packed.
+        """
+        i = self.find(program_id)
+        return self.read(i) if i is not None else None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+        if self.index_file is not None:
+            self.index.close()
+            self.index_file.close()
+
+def loose_elfs(dir_path):
+    """
+    Returns the `(loader, program_id, path)` of every ELF file in the bundle
+    at `dir_path`.
+    """
+    elfs = []
+    for (loader, _) in LOADERS:
+        loader_dir = dir_path / loader
+        if loader_dir.exists():
+            elfs.extend(
+                (loader, path.stem, path)
+                for path in sorted(loader_dir.glob("*.elf"))
+            )
+    return elfs
+
+def pack(bundle_name, zstd_level=0, remove_files=False, progress_bar=False):
+    bundle_path = bundle_full_path(bundle_name)
+    if not bundle_path.exists():
+        print(f"Bundle '{bundle_name}' does not exist.", file=sys.stderr)
+        sys.exit(1)
+    threads = os.cpu_count() or 1
+
+    print("Packing bundle ELFs...")
+    print(f"    Bundle Name     : {bundle_name}")
+    print(f"    zstd Level      : {zstd_level or 'uncompressed'}")
+    print(f"    Remove Files    : {'yes' if remove_files else 'no'}")
+
+    elfs = loose_elfs(bundle_path)
+    print(f"Found {len(elfs)} ELF files")
+
+    def add(elf):
+        (loader, program_id, path) = elf
+        with open(path, "rb") as file:
+            data = file.read()
+        writer.add(program_id, LOADER_NUMBERS[loader], data)
+
+    progress = Progress("Packed", len(elfs), "ELFs", bar=progress_bar)
+    # Added to an existing pack, whose entries for the same programs are
+    # replaced.
+    with PackWriter(bundle_path, zstd_level, append=True) as writer:
+        for _ in imap_bounded(add, elfs, threads):
+            progress.update(1)
+        progress.close()
+    print(
+        f"Packed {writer.elf_bytes} bytes of ELFs into {writer.stored_bytes} "
+        f"bytes, {len(writer)} ELFs in the pack"
+    )
+
+    if remove_files:
+        for (_, _, path) in elfs:
+            os.remove(path)
+        for (loader, _) in LOADERS:
+            loader_dir = bundle_path / loader
+            if loader_dir.exists() and not any(loader_dir.iterdir()):
+                loader_dir.rmdir()
+        print(f"Removed {len(elfs)} ELF files")
+
+def unpack(bundle_name, remove_pack=False, progress_bar=False):
+    bundle_path = bundle_full_path(bundle_name)
+    if not is_packed(bundle_path):
+        print(f"Bundle '{bundle_name}' is not packed.", file=sys.stderr)
+        sys.exit(1)
+
+    print("Unpacking bundle ELFs...")
+    print(f"    Bundle Name     : {bundle_name}")
+    print(f"    Remove Pack     : {'yes' if remove_pack else 'no'}")
+
+    with PackReader(bundle_path) as reader:
+        progress = Progress("Unpacked", len(reader), "ELFs", bar=progress_bar)
+        for (i, (program_id, loader)) in enumerate(reader):
+            loader_dir = bundle_path / LOADER_NAMES[loader]
+            loader_dir.mkdir(parents=True, exist_ok=True)
+            write_atomic(loader_dir / f"{program_id}.elf", reader.read(i))
+            progress.update(1)
+        progress.close()
+        count = len(reader)
+    print(f"Unpacked {count} ELFs")
+
+    if remove_pack:
+        delete_pack(bundle_path)
+        print("Removed the pack")
+
+def read_elf(bundle_name, program_id):
+    """
+    Returns a program's ELF from a bundle, packed or not, or `None` if the
+    bundle does not hold it.
+    """
+    bundle_path = bundle_full_path(bundle_name)
+    if is_packed(bundle_path):
+        with PackReader(bundle_path) as reader:
+            return reader.get(program_id)
+    for (loader, _) in LOADERS:
+        path = bundle_path / loader / f"{program_id}.elf"
+        if path.exists():
+            with open(path, "rb") as file:
+                return file.read()
+    return None
+
+def extract(bundle_name, program_id, output=None):
+    try:
+        key_bytes(program_id)
+    except ValueError:
+        print(f"'{program_id}' is not a program ID.", file=sys.stderr)
+        sys.exit(1)
+    data = read_elf(bundle_name, program_id)
+    if data is None:
+        print(
+            f"Program '{program_id}' is not in bundle '{bundle_name}'.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    output = output if output is not None else f"{program_id}.elf"
+    if output == "-":
+        sys.stdout.buffer.write(data)
+        return
+    with open(output, "wb") as file:
+        file.write(data)
+    print(f"Wrote {len(data)} bytes to {output}", file=sys.stderr)
@@ -2,21 +2,55 @@ import os
 import sys
 import time
 
-from cloner.filters import BPF_LOADER_3_PROGRAM_FILTER, BPF_LOADER_3_PUBKEY
+from cloner.filters import BPF_LOADER_3_PROGRAM_FILTER, \
+    BPF_LOADER_3_PROGRAM_SHARD_OFFSET, BPF_LOADER_3_PROGRAMDATA_FILTER, \
+    BPF_LOADER_3_PROGRAMDATA_SHARD_OFFSET, BPF_LOADER_3_PUBKEY
 
+from .keys import KeyTable
 from .rpc import SolanaRPC
-from .util import get_programdata_address, le_to_u64, profile_full_path, \
-    init_profile, write_to_profile_csv
+from .snapshot import SnapshotSource
+from .util import Progress, ProgramDataIndex, get_programdata_addresses, \
+    le_to_u64, profile_full_path, init_profile, write_to_profile_table
 
-def profile_slots(profile_name, url, rate_limit_buffer):
-    rpc = SolanaRPC(url)
+def profile_slots(
+    profile_name,
+    url,
+    rate_limit_buffer,
+    concurrency=1,
+    requests_per_second=None,
+    account_encoding="base64",
+    fmt="csv",
+    single_pass=False,
+    metrics=None,
+    progress_bar=False,
+    shard_bytes=0,
+    snapshot=None,
+):
+    # A local snapshot answers the same account queries as an RPC.
+    if snapshot is not None:
+        rpc = SnapshotSource(snapshot, metrics, progress_bar=progress_bar)
+    else:
+        rpc = SolanaRPC(
+            url,
+            requests_per_second,
+            concurrency,
+            account_encoding,
+            metrics,
+            shard_bytes,
+        )
+    metrics = rpc.metrics
     version = rpc.get_version()
+    context_slot = rpc.pin_context_slot()
     now = time.localtime()
 
     print("Profiling all Solana Loader V3 program slots...")
-    print(f"    RPC URL         : {url}")
+    print(f"    RPC URL         : {', '.join(rpc.urls)}")
     print(f"    Solana Version  : {version}")
+    print(f"    Context Slot    : {context_slot}")
     print(f"    Profile Name    : {profile_name}")
+    print(f"    Format          : {fmt}")
+    print(f"    Single Pass     : {single_pass}")
+    print(f"    Shards          : {256 ** shard_bytes}")
     print(f"    Date            : {time.strftime('%Y-%m-%d', now)}")
 
     init_profile(profile_name)
@@ -30,62 +64,105 @@ def profile_slots(profile_name, url, rate_limit_buffer):
     # BPF Loader 3 Program Accounts.
     print("Downloading BPF Loader 3 program accounts...")
     time.sleep(rate_limit_buffer)
-    bpf_loader_3_keys = list(rpc.get_program_account_keys(
-        BPF_LOADER_3_PUBKEY,
-        [BPF_LOADER_3_PROGRAM_FILTER],
-    ));
+    with metrics.stage("list_keys", loader="bpf_loader_3") as stage:
+        if single_pass:
+            # Each Program account holds its Program Data address at offset
+            # 4.
+            bpf_loader_3_index = ProgramDataIndex(
+                rpc.get_program_accounts(
+                    BPF_LOADER_3_PUBKEY,
+                    [BPF_LOADER_3_PROGRAM_FILTER],
+                    offset=4,
+                    length=32,
+                    shard_offset=BPF_LOADER_3_PROGRAM_SHARD_OFFSET,
+                )
+            )
+            bpf_loader_3_keys = bpf_loader_3_index.program_keys
+        else:
+            bpf_loader_3_keys = KeyTable(rpc.get_program_account_keys(
+                BPF_LOADER_3_PUBKEY,
+                [BPF_LOADER_3_PROGRAM_FILTER],
+                BPF_LOADER_3_PROGRAM_SHARD_OFFSET,
+            ))
+        stage["items"] = len(bpf_loader_3_keys)
     print(f"Found {len(bpf_loader_3_keys)} BPF Loader 3 program keys")
-    write_to_profile_csv(
+    write_to_profile_table(
         profile_name,
-        "bpf_loader_3.csv",
-        [[str(k)] for k in bpf_loader_3_keys],
+        "bpf_loader_3",
+        [[k] for k in bpf_loader_3_keys],
+        fmt,
     )
 
     # BPF Loader 3 Program Accounts with Program Data Accounts.
-    bpf_loader_3_keys_with_data_keys = [
-        (k, get_programdata_address(str(k)))
-        for k in bpf_loader_3_keys
-    ]
-    bpf_loader_3_data_keys = [
-        dk for (_, dk) in bpf_loader_3_keys_with_data_keys
-    ]
-    write_to_profile_csv(
+    if not single_pass:
+        with metrics.stage("programdata_addresses"):
+            bpf_loader_3_index = ProgramDataIndex.from_tables(
+                bpf_loader_3_keys,
+                get_programdata_addresses(bpf_loader_3_keys),
+            )
+    bpf_loader_3_data_keys = bpf_loader_3_index.data_keys()
+    write_to_profile_table(
         profile_name,
-        "bpf_loader_3_with_data_keys.csv",
-        [[str(k), str(dk)] for (k, dk) in bpf_loader_3_keys_with_data_keys],
+        "bpf_loader_3_with_data_keys",
+        [[k, dk] for (k, dk) in bpf_loader_3_index],
+        fmt,
     )
 
     print("Profiling BPF Loader 3 slots...")
     time.sleep(rate_limit_buffer)
 
     # BPF Loader 3 Program Data accounts with slots.
-    bpf_loader_3_data_keys_with_slots = list(rpc.get_multiple_programs(
-        bpf_loader_3_data_keys,
-        rate_limit_buffer,
-        offset=4,
-        length=8,
-    ))
-    write_to_profile_csv(
+    with metrics.stage("deployment_slots") as stage:
+        if single_pass:
+            # Every Program Data account at once, kept in index order and
+            # without those of programs deployed since the listing.
+            slots = KeyTable.from_items(
+                (dk, le_to_u64(s)) for (dk, s) in rpc.get_program_accounts(
+                    BPF_LOADER_3_PUBKEY,
+                    [BPF_LOADER_3_PROGRAMDATA_FILTER],
+                    offset=4,
+                    length=8,
+                    shard_offset=BPF_LOADER_3_PROGRAMDATA_SHARD_OFFSET,
+                )
+            )
+            bpf_loader_3_data_keys_with_slots = slots.take(
+                idx for idx in map(slots.find, bpf_loader_3_data_keys)
+                if idx is not None
+            )
+        else:
+            progress = Progress(
+                "Profiled",
+                len(bpf_loader_3_data_keys),
+                bar=progress_bar,
+            )
+            bpf_loader_3_data_keys_with_slots = KeyTable.from_items(
+                (dk, le_to_u64(s)) for (dk, s) in progress.track(
+                    rpc.get_multiple_programs(
+                        bpf_loader_3_data_keys,
+                        rate_limit_buffer,
+                        offset=4,
+                        length=8,
+                    )
+                )
+            )
+        stage["items"] = len(bpf_loader_3_data_keys_with_slots)
+    write_to_profile_table(
         profile_name,
-        "bpf_loader_3_data_keys_with_slots.csv",
-        sorted(
-            [[str(k), le_to_u64(s)] for (k, s) in bpf_loader_3_data_keys_with_slots],
-            key=lambda x: x[1],
-        ),
+        "bpf_loader_3_data_keys_with_slots",
+        bpf_loader_3_data_keys_with_slots.sorted_by_slot().items(),
+        fmt,
     )
 
     # BPF Loader 3 Program accounts with slots.
-    bpf_loader_3_keys_with_slots = [
-        (str(k), le_to_u64(s))
-        for (k, kdk) in bpf_loader_3_keys_with_data_keys
-        for (ddk, s) in bpf_loader_3_data_keys_with_slots
-        if kdk == ddk
-    ]
-    write_to_profile_csv(
+    bpf_loader_3_keys_with_slots = bpf_loader_3_index.join(
+        bpf_loader_3_data_keys_with_slots.items()
+    )
+    write_to_profile_table(
         profile_name,
-        "bpf_loader_3_keys_with_slots.csv",
-        sorted(
-            [[str(k), s] for (k, s) in bpf_loader_3_keys_with_slots],
-            key=lambda x: x[1],
-        ),
-    )
\ No newline at end of file
+        "bpf_loader_3_keys_with_slots",
+        bpf_loader_3_keys_with_slots.sorted_by_slot().items(),
+        fmt,
+    )
+    if len(rpc.pool) > 1:
+        print("RPC endpoints:")
+        rpc.pool.report()
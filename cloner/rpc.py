@@ -1,13 +1,35 @@
-from base64 import b64decode
+from collections import deque
 from dataclasses import dataclass
-from typing import Any, Generator, Iterable, Optional, Tuple
+from typing import Any, Callable, Deque, Generator, Iterable, List, \
+    Optional, Sequence, Tuple, Union
 
+import binascii
+import email.utils
 import itertools
+import json
+import random
 import requests
 import sys
+import threading
 import time
+import urllib.parse
+import urllib3
 
-from cloner.filters import ELF_MAGIC
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from cloner.filters import ELF_MAGIC, shard_filter
+from cloner.metrics import Metrics
+from cloner.stream import AccountDataStream, PROGRAM_ACCOUNT_DATA_PATH
+from cloner.util import chunked, imap_bounded
+
+# Compressed response encodings to negotiate with the RPC. `zstd` is only
+# offered when `zstandard` is installed. urllib3 2.x decodes it on its own,
+# while older versions hand the body back still compressed.
+ACCEPT_ENCODING = "gzip, deflate" + (", zstd" if zstandard else "")
+URLLIB3_DECODES_ZSTD = "zstd" in urllib3.util.request.ACCEPT_ENCODING
 
 class RPCError(Exception):
     """
@@ -35,7 +57,7 @@ class RPCResponse:
     JSON-RPC 2.0 result.
     https://www.jsonrpc.org/specification#response_object
     """
-    id: int
+    id: Optional[int]
     result: Optional[Any] = None
     error: Optional[RPCError] = None
 
@@ -48,21 +70,541 @@ class RPCResponse:
 
     @staticmethod
     def from_json(obj: dict) -> "RPCResponse":
+        # Servers answer requests they could not parse with a null ID.
         return RPCResponse(
-            id=obj["id"],
+            id=obj.get("id"),
             result=obj.get("result"),
             error=RPCError.from_json(obj.get("error")),
         )
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Blocks until `tokens` are available and returns the time spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def set_rate(self, rate: float):
+        """
+        Changes the rate, keeping the tokens accrued so far.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated) * self.rate,
+            )
+            self.updated = now
+            self.rate = rate
+            self.capacity = max(rate, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+
+# JSON-RPC error codes used by RPC providers to signal rate limiting.
+RATE_LIMIT_ERROR_CODES = (429, -32429)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    Returns whether an error raised by the client signals rate limiting,
+    either as an HTTP 429 or as a JSON-RPC error.
+    """
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None and error.response.status_code == 429
+        )
+    if isinstance(error, RPCError):
+        return (
+            error.code in RATE_LIMIT_ERROR_CODES
+            or "rate limit" in (error.message or "").lower()
+            or "too many requests" in (error.message or "").lower()
+        )
+    return False
+
+
+class AdaptiveRateLimiter:
+    """
+    Rate limit shared by every request to an endpoint, adjusted by additive
+    increase and multiplicative decrease. Requests are not limited until the
+    endpoint first rate limits one. The limit then starts at half the rate
+    requests were sent at over the last second, is halved again on each
+    rate-limited request, down to `minimum` requests per second, and rises by
+    `increase` on each success.
+
+    Requests in flight when the limit was lowered were sent at the old rate,
+    so their rate limiting does not lower it again.
+    """
+    def __init__(self, minimum: float = 0.5, increase: float = 0.5):
+        self.minimum = minimum
+        self.increase = increase
+        self.bucket: Optional[TokenBucket] = None
+        self.sent: Deque[float] = deque()
+        self.lowered = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request may be sent, and returns the time spent
+        waiting.
+        """
+        with self.lock:
+            bucket = self.bucket
+        waited = bucket.acquire() if bucket is not None else 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.sent.append(now)
+            while self.sent[0] < now - 1.0:
+                self.sent.popleft()
+        return waited
+
+    def failure(self, sent_at: float):
+        """
+        Lowers the limit after a request sent at `sent_at` was rate limited.
+        """
+        with self.lock:
+            if sent_at < self.lowered:
+                return
+            rate = self.bucket.rate if self.bucket is not None \
+                else float(len(self.sent))
+            rate = max(self.minimum, rate / 2)
+            if self.bucket is None:
+                self.bucket = TokenBucket(rate)
+            else:
+                self.bucket.set_rate(rate)
+            self.lowered = time.monotonic()
+
+    def success(self):
+        with self.lock:
+            if self.bucket is not None:
+                self.bucket.set_rate(self.bucket.rate + self.increase)
+
+    @property
+    def rate(self) -> Optional[float]:
+        with self.lock:
+            return self.bucket.rate if self.bucket is not None else None
+
+
+# HTTP statuses of failures that may pass on their own: timeouts, rate
+# limiting, and server or gateway errors.
+TRANSIENT_HTTP_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+# JSON-RPC error codes with which a node reports that it, rather than the
+# request, is at fault: a block not available yet (-32004, -32014), the node
+# unhealthy (-32005) or behind the pinned minimum context slot (-32016), or
+# rate limiting.
+TRANSIENT_ERROR_CODES = (-32004, -32005, -32014, -32016) \
+    + RATE_LIMIT_ERROR_CODES
+# Failures caused by the request itself, which fail again however often, or
+# however split, the request is sent.
+PERMANENT_HTTP_STATUSES = (400, 401, 403, 404, 405)
+PERMANENT_ERROR_CODES = (-32600, -32601, -32602)
+# HTTP statuses with which a node or its gateway may give up on a request too
+# large or slow to serve.
+TOO_LARGE_HTTP_STATUSES = (408, 413, 500, 502, 504)
+
+# Exceptions a request can fail with, whether raised by `requests`, while
+# decoding the body, or for a JSON-RPC error.
+RPC_EXCEPTIONS = (requests.RequestException, ValueError, RPCError) \
+    + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Returns whether a request that failed with `error` may succeed if sent
+    again, later or to another endpoint.
+    """
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None
+            and error.response.status_code in TRANSIENT_HTTP_STATUSES
+        )
+    if isinstance(error, RPCError):
+        return error.code in TRANSIENT_ERROR_CODES or is_rate_limited(error)
+    # Dropped connections, timeouts, and bodies cut short.
+    return isinstance(error, (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        ValueError,
+    )) or zstandard is not None and isinstance(error, zstandard.ZstdError)
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Returns whether `error` is caused by the request itself.
+    """
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None
+            and error.response.status_code in PERMANENT_HTTP_STATUSES
+        )
+    if isinstance(error, RPCError):
+        return error.code in PERMANENT_ERROR_CODES
+    return False
+
+
+def is_too_large(error: Exception) -> bool:
+    """
+    Returns whether a request that failed with `error` may have asked too
+    much of the node, such as a scan that timed out, so that a narrower one
+    could succeed. Unreachable nodes and requests at fault are not.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    if isinstance(error, (
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None
+            and error.response.status_code in TOO_LARGE_HTTP_STATUSES
+        )
+    if isinstance(error, RPCError):
+        return not is_transient(error) and not is_permanent(error)
+    return False
+
+
+def _transient_error(body: Any) -> Optional[RPCError]:
+    """
+    Returns the error of a response body that failed as a whole for a
+    transient reason: a single error object, or a batch of nothing but
+    errors.
+    """
+    objs = body if isinstance(body, list) else [body]
+    if len(objs) == 0 or not all(
+        isinstance(obj, dict) and obj.get("error") is not None
+        for obj in objs
+    ):
+        return None
+    error = RPCError.from_json(objs[0]["error"])
+    return error if is_transient(error) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the seconds to wait given by the `Retry-After` header of a failed
+    HTTP response, if any.
+    """
+    if not isinstance(error, requests.HTTPError) or error.response is None:
+        return None
+    value = error.response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+def error_label(error: Exception) -> str:
+    """
+    Short label for an error in metrics: its HTTP status, JSON-RPC error
+    code, or exception type.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return str(error.response.status_code)
+    if isinstance(error, RPCError):
+        return str(error.code)
+    return type(error).__name__
+
+
+class RetryPolicy:
+    """
+    Retries transient failures with full-jitter exponential backoff: retry
+    `n` waits a random delay of up to `initial * 2 ** n` seconds, capped at
+    `maximum`, or longer if the server asked for it with `Retry-After`.
+    Retries and the time spent waiting on them are counted in `metrics`.
+    """
+    def __init__(
+        self,
+        max_attempts: int = 8,
+        initial: float = 0.5,
+        maximum: float = 30.0,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.initial = initial
+        self.maximum = maximum
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(
+            0,
+            min(self.maximum, self.initial * 2 ** attempt),
+        )
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def backoff(self, attempt: int, error: Exception):
+        """
+        Sleeps before retrying a call that failed `attempt` times, last with
+        `error`. Raises `error` instead if it is not transient or attempts
+        are used up.
+        """
+        if not is_transient(error) or attempt >= self.max_attempts:
+            raise error
+        delay = self.delay(attempt, error)
+        self.metrics.count("rpc_retries_total", error=error_label(error))
+        self.metrics.count("rpc_retry_wait_seconds_total", delay)
+        time.sleep(delay)
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        """
+        Calls `fn` until it returns, retrying transient failures.
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except RPC_EXCEPTIONS as e:
+                attempt += 1
+                self.backoff(attempt, e)
+
+
+class Endpoint:
+    """
+    RPC node in an `EndpointPool`, with an optional weight and rate limit of
+    its own, a limit adapted to the rate it answers without rate limiting,
+    and running latency and error statistics.
+    """
+    def __init__(
+        self,
+        url: str,
+        weight: float = 1.0,
+        requests_per_second: Optional[float] = None,
+    ):
+        self.url = url
+        self.weight = weight
+        self.rate_limiter = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+        self.adaptive_limiter = AdaptiveRateLimiter()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        # Exponentially weighted moving average, in seconds.
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.cooldown = 0.0
+        self.down_until = 0.0
+
+    @staticmethod
+    def parse(spec: str) -> "Endpoint":
+        """
+        Parses `URL[#weight=W&rps=R]`. The fragment is never sent to the
+        node, so it cannot clash with the URL itself.
+        """
+        (url, _, fragment) = spec.partition("#")
+        opts = dict(urllib.parse.parse_qsl(fragment))
+        unknown = set(opts) - {"weight", "rps"}
+        if len(unknown) > 0:
+            raise ValueError(
+                f"Unknown RPC URL options: {', '.join(sorted(unknown))}"
+            )
+        weight = float(opts.get("weight", 1.0))
+        if weight <= 0:
+            raise ValueError("RPC URL weight must be positive")
+        rps = float(opts["rps"]) if "rps" in opts else None
+        return Endpoint(url, weight, rps)
+
+
+class EndpointPool:
+    """
+    Load balancer over one or more RPC endpoints.
+
+    Each request goes to the healthy endpoint with the fewest requests in
+    flight relative to its weight, so faster nodes take more of the load.
+    An endpoint failing `max_failures` requests in a row is left out for a
+    cooldown, doubled each time it trips again, up to `max_cooldown`.
+    """
+    def __init__(
+        self,
+        endpoints: Sequence[Endpoint],
+        max_failures: int = 3,
+        cooldown: float = 5.0,
+        max_cooldown: float = 60.0,
+    ):
+        if len(endpoints) == 0:
+            raise ValueError("At least one RPC URL is required")
+        self.endpoints = list(endpoints)
+        self.max_failures = max_failures
+        self.initial_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        """
+        Picks an endpoint for a request, preferring those not in `exclude`.
+        If every candidate is cooling down, the one back soonest is used.
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in exclude] \
+                or self.endpoints
+            healthy = [e for e in candidates if e.down_until <= now]
+            if len(healthy) > 0:
+                # Ties, such as between idle endpoints, go by weighted share
+                # of requests so far.
+                endpoint = min(
+                    healthy,
+                    key=lambda e: (
+                        (e.in_flight + 1) / e.weight,
+                        e.requests / e.weight,
+                    ),
+                )
+            else:
+                endpoint = min(candidates, key=lambda e: e.down_until)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(
+        self,
+        endpoint: Endpoint,
+        latency: float,
+        error: Optional[Exception] = None,
+        settled: bool = True,
+    ):
+        """
+        Records the outcome of a request sent with `acquire`. A streamed
+        response is not `settled` until its body has been read, and is then
+        settled with `success` or `failure`.
+        """
+        with self.lock:
+            endpoint.in_flight -= 1
+            if error is None:
+                endpoint.latency = latency if endpoint.latency is None \
+                    else 0.8 * endpoint.latency + 0.2 * latency
+        if error is not None:
+            self.failure(endpoint, error)
+        elif settled:
+            self.success(endpoint)
+
+    def success(self, endpoint: Endpoint):
+        with self.lock:
+            endpoint.failures = 0
+            endpoint.cooldown = 0.0
+
+    def failure(self, endpoint: Endpoint, error: Exception):
+        """
+        Counts an error against an endpoint, and takes it out of rotation if
+        it keeps failing.
+        """
+        with self.lock:
+            endpoint.errors += 1
+            if not is_transient(error):
+                return
+            endpoint.failures += 1
+            if endpoint.failures < self.max_failures or len(self) == 1:
+                return
+            endpoint.failures = 0
+            endpoint.cooldown = min(
+                self.max_cooldown,
+                max(self.initial_cooldown, endpoint.cooldown * 2),
+            )
+            endpoint.down_until = time.monotonic() + endpoint.cooldown
+            cooldown = endpoint.cooldown
+        print(
+            f"WARN: {endpoint.url} is failing ({error}), leaving it out for "
+            f"{cooldown:.0f}s",
+            file=sys.stderr,
+        )
+
+    def report(self):
+        """
+        Prints request counts, error rates and latencies per endpoint.
+        """
+        for e in self.endpoints:
+            latency = f"{e.latency * 1000:.0f}ms" \
+                if e.latency is not None else "-"
+            error_rate = e.errors / e.requests if e.requests > 0 else 0.0
+            print(
+                f"    {e.url}: {e.requests} requests, "
+                f"{error_rate:.1%} errors, {latency} latency"
+            )
+
+
 class RPCClient:
     """
     JSON-RPC 2.0 HTTP client
+
+    `url` is a single RPC URL or a list of them, each optionally suffixed
+    with `#weight=W&rps=R`. Requests are spread across the URLs through an
+    `EndpointPool`, and retried on another URL when one fails. Once every
+    URL has failed, transient failures are retried by `retry_policy`.
+
+    At most `concurrency` requests are in flight at once, however many
+    threads share the client, so concurrent phases of a command draw on one
+    budget. A streamed response holds its slot until `close_stream`.
+
+    Requests, calls, latencies, bytes sent and received, errors and time
+    spent throttled are counted per method in `metrics`.
     """
-    def __init__(self, url: str):
+    def __init__(
+        self,
+        url: Union[str, Sequence[str]],
+        requests_per_second: Optional[float] = None,
+        concurrency: int = 1,
+        retry_policy: Optional[RetryPolicy] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        urls = [url] if isinstance(url, str) else list(url)
+        self.pool = EndpointPool([Endpoint.parse(u) for u in urls])
         self.session = requests.Session()
+        # Keep enough pooled connections for every in-flight request.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=len(self.pool),
+            pool_maxsize=max(concurrency, 10),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
         self.counter = 0
-        self.url = url
+        self.lock = threading.Lock()
+        self.url = self.pool.endpoints[0].url
+        self.urls = [e.url for e in self.pool.endpoints]
+        self.concurrency = max(concurrency, 1)
+        self.budget = threading.BoundedSemaphore(self.concurrency)
+        self.rate_limiter = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.retry = retry_policy if retry_policy is not None \
+            else RetryPolicy(metrics=self.metrics)
 
     def request(self, method: str, *params) -> Any:
         """
@@ -74,24 +616,327 @@ class RPCClient:
 
     def request_response(self, method: str, *params) -> RPCResponse:
         """
-        Sends an RPC request and returns the response object.
+        Sends an RPC request and returns the response object, retrying
+        transient failures.
+        """
+        request = self.make_request(method, *params)
+        try:
+            body = self.retry.run(lambda: self.post(request))
+        except RPCError as e:
+            return RPCResponse(id=request["id"], error=e)
+        return RPCResponse.from_json(body)
+
+    def request_batch(
+        self, calls: Sequence[Tuple[str, list]]
+    ) -> List[RPCResponse]:
+        """
+        Sends `(method, params)` calls as a single JSON-RPC batch and returns
+        their responses in call order.
+
+        Transient failures of the whole batch are retried. If the server
+        rejects the whole batch otherwise, it is split in half and each half
+        is sent again, down to single calls. Calls missing from a response,
+        or failed for a transient reason, are re-sent the same way.
+        """
+        if len(calls) == 0:
+            return []
+        requests_ = [self.make_request(method, *params)
+                     for (method, params) in calls]
+        try:
+            body = self.retry.run(lambda: self.post(requests_))
+        except RPC_EXCEPTIONS as e:
+            # Splitting a batch failing for a transient reason would only
+            # multiply requests.
+            if len(calls) == 1 or is_transient(e) or is_permanent(e):
+                raise
+            body = None
+        if not isinstance(body, list):
+            # A single error object (or no body) for the whole batch.
+            if len(calls) == 1:
+                return [RPCResponse.from_json({
+                    **body,
+                    "id": requests_[0]["id"],
+                })]
+            mid = len(calls) // 2
+            return (
+                self.request_batch(calls[:mid])
+                + self.request_batch(calls[mid:])
+            )
+        responses = {}
+        for obj in body:
+            response = RPCResponse.from_json(obj)
+            if response.is_error() and is_transient(response.error):
+                continue
+            responses[response.id] = response
+        missing = [idx for idx, request in enumerate(requests_)
+                   if request["id"] not in responses]
+        if len(missing) == len(calls):
+            if len(calls) == 1:
+                return [RPCResponse(
+                    id=requests_[0]["id"],
+                    error=RPCError(-32603, "Missing response in batch"),
+                )]
+            mid = len(calls) // 2
+            return (
+                self.request_batch(calls[:mid])
+                + self.request_batch(calls[mid:])
+            )
+        retried = iter(self.request_batch([calls[idx] for idx in missing]))
+        return [
+            responses[request["id"]]
+            if request["id"] in responses else next(retried)
+            for request in requests_
+        ]
+
+    def make_request(self, method: str, *params) -> dict:
         """
-        request = {
+        Builds a JSON-RPC request object with a fresh ID.
+        """
+        return {
             "jsonrpc": "2.0",
             "id": self.nonce(),
             "method": method,
             "params": list(params),
         }
-        res = self.session.post(self.url, json=request)
-        res.raise_for_status()
-        return RPCResponse.from_json(res.json())
+
+    def post(self, payload: Any) -> Any:
+        """
+        POSTs a request or batch of requests and returns the decoded body.
+        """
+        return self._post(payload, stream=False)
+
+    def post_stream(self, payload: Any) -> requests.Response:
+        """
+        POSTs a request and returns the response without reading its body.
+        The endpoint that answered is kept as `res.endpoint`, and the
+        request is measured once the body is read, in `settle_stream`.
+        """
+        return self._post(payload, stream=True)
+
+    def _post(self, payload: Any, stream: bool) -> Any:
+        """
+        POSTs to the pool's next endpoint, moving on to endpoints not yet
+        tried while the failure is transient. The last failure is raised once
+        every endpoint has been tried.
+        """
+        # Batches sent here always hold calls of a single method.
+        if isinstance(payload, list):
+            (method, calls) = (payload[0]["method"], len(payload))
+        else:
+            (method, calls) = (payload["method"], 1)
+        data = json.dumps(payload).encode("utf-8")
+        tried = []
+        while True:
+            endpoint = self.pool.acquire(tried)
+            tried.append(endpoint)
+            if len(tried) > 1:
+                self.metrics.count("rpc_failovers_total", method=method)
+            if self.rate_limiter is not None:
+                self.metrics.count(
+                    "rpc_throttle_wait_seconds_total",
+                    self.rate_limiter.acquire(),
+                    limiter="client",
+                )
+            if endpoint.rate_limiter is not None:
+                self.metrics.count(
+                    "rpc_throttle_wait_seconds_total",
+                    endpoint.rate_limiter.acquire(),
+                    limiter="endpoint",
+                )
+            # Concurrent requests all slow down while the node rate limits,
+            # rather than each retrying on its own schedule.
+            self.metrics.count(
+                "rpc_throttle_wait_seconds_total",
+                endpoint.adaptive_limiter.acquire(),
+                limiter="adaptive",
+            )
+            start = time.monotonic()
+            self.budget.acquire()
+            self.metrics.count(
+                "rpc_throttle_wait_seconds_total",
+                time.monotonic() - start,
+                limiter="budget",
+            )
+            self.metrics.count("rpc_requests_total", method=method)
+            self.metrics.count("rpc_calls_total", calls, method=method)
+            self.metrics.count(
+                "rpc_sent_bytes_total",
+                len(data),
+                method=method,
+            )
+            start = time.monotonic()
+            res = None
+            try:
+                res = self.session.post(
+                    endpoint.url,
+                    data=data,
+                    headers={"Content-Type": "application/json"},
+                    stream=stream,
+                )
+                res.raise_for_status()
+                if stream:
+                    res.endpoint = endpoint
+                    res.method = method
+                    res.started = start
+                    body = res
+                else:
+                    body = _decode_body(res)
+            except BaseException as e:
+                self.budget.release()
+                if not isinstance(e, RPC_EXCEPTIONS):
+                    raise
+                if is_rate_limited(e):
+                    endpoint.adaptive_limiter.failure(start)
+                self.pool.release(endpoint, time.monotonic() - start, e)
+                self._measure(method, time.monotonic() - start, res, e)
+                if not is_transient(e) or len(tried) >= len(self.pool):
+                    raise
+                continue
+            if not stream:
+                self.budget.release()
+            error = None if stream else _transient_error(body)
+            if error is not None and is_rate_limited(error):
+                endpoint.adaptive_limiter.failure(start)
+            else:
+                endpoint.adaptive_limiter.success()
+            self.pool.release(
+                endpoint,
+                time.monotonic() - start,
+                error,
+                settled=not stream,
+            )
+            if not stream:
+                self._measure(method, time.monotonic() - start, res, error)
+            if error is None:
+                return body
+            if len(tried) >= len(self.pool):
+                raise error
+
+    def _measure(
+        self,
+        method: str,
+        seconds: float,
+        res: Optional[requests.Response],
+        error: Optional[Exception],
+    ):
+        self.metrics.observe("rpc_request_seconds", seconds, method=method)
+        if res is not None:
+            # Bytes read off the wire, before decompression.
+            self.metrics.count(
+                "rpc_received_bytes_total",
+                res.raw.tell(),
+                method=method,
+            )
+        if error is not None:
+            self.metrics.count(
+                "rpc_errors_total",
+                method=method,
+                error=error_label(error),
+            )
+
+    def settle_stream(
+        self,
+        res: requests.Response,
+        error: Optional[Exception],
+    ):
+        """
+        Records the outcome of a streamed response once its body is read, or
+        failed to be.
+        """
+        self._measure(
+            res.method,
+            time.monotonic() - res.started,
+            res,
+            error,
+        )
+        if error is None or not is_transient(error):
+            self.pool.success(res.endpoint)
+        else:
+            self.pool.failure(res.endpoint, error)
+
+    def close_stream(self, res: requests.Response):
+        """
+        Closes a streamed response, and frees its slot in the budget.
+        """
+        res.close()
+        if not getattr(res, "released", False):
+            res.released = True
+            self.budget.release()
+
+    def iter_content(
+        self,
+        res: requests.Response,
+        chunk_size: int = 1 << 16,
+    ) -> Generator[bytes, None, None]:
+        """
+        Yields the decompressed body of a streamed response.
+        """
+        chunks = res.iter_content(chunk_size=chunk_size)
+        if not _is_zstd_encoded(res):
+            yield from chunks
+            return
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if len(data) > 0:
+                yield data
 
     def nonce(self) -> int:
         """
         Increments the request ID nonce.
         """
-        self.counter += 1
-        return self.counter
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+
+def _decode_body(res: requests.Response) -> Any:
+    if _is_zstd_encoded(res):
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        return json.loads(decompressor.decompress(res.content))
+    return res.json()
+
+
+def _is_zstd_encoded(res: requests.Response) -> bool:
+    """
+    Returns whether a response body is still zstd-compressed.
+    """
+    return (
+        not URLLIB3_DECODES_ZSTD
+        and zstandard is not None
+        and res.headers.get("Content-Encoding", "").lower() == "zstd"
+    )
+
+
+class _ZstdSink:
+    """
+    Decompresses `base64+zstd` account data into another sink.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def write(self, data):
+        data = self.decompressor.decompress(data)
+        if len(data) > 0:
+            self.sink.write(data)
+
+    def commit(self):
+        return self.sink.commit()
+
+    def abort(self):
+        self.sink.abort()
+
+
+# Only the newest signature is needed to find the last execution slot.
+LAST_SIGNATURE_CONFIG = {
+    "commitment": "confirmed",
+    "limit": 1,
+}
+
+# Longest account data prefix a failing `getProgramAccounts` shard is split
+# down to, at which point it is 1/16777216th of the listing.
+MAX_SHARD_BYTES = 3
 
 
 class SolanaRPC(RPCClient):
@@ -99,8 +944,69 @@ class SolanaRPC(RPCClient):
     Solana JSON-RPC Wrapper.
     https://solana.com/docs/rpc
     """
+    def __init__(
+        self,
+        url: str,
+        requests_per_second: Optional[float] = None,
+        concurrency: int = 1,
+        account_encoding: str = "base64",
+        metrics: Optional[Metrics] = None,
+        shard_bytes: int = 0,
+    ):
+        super().__init__(
+            url,
+            requests_per_second,
+            concurrency,
+            metrics=metrics,
+        )
+        if account_encoding == "base64+zstd" and zstandard is None:
+            print(
+                "WARN: `zstandard` is not installed, using base64 account "
+                "encoding",
+                file=sys.stderr,
+            )
+            account_encoding = "base64"
+        self.account_encoding = account_encoding
+        self.shard_bytes = shard_bytes
+        self.min_context_slot: Optional[int] = None
+
     def get_version(self) -> dict:
         return self.request("getVersion")
+
+    def pin_context_slot(self) -> Optional[int]:
+        """
+        With several endpoints, pins every later read to the newest slot any
+        of them has reached, so a lagging node cannot answer with older state
+        than the rest. Nodes behind the pinned slot reject reads, which are
+        then retried on another endpoint.
+        """
+        if len(self.pool) <= 1:
+            return None
+        slots = []
+        for endpoint in self.pool.endpoints:
+            request = self.make_request("getSlot", {"commitment": "confirmed"})
+            try:
+                res = self.session.post(endpoint.url, json=request)
+                res.raise_for_status()
+                response = RPCResponse.from_json(_decode_body(res))
+                response.raise_for_result()
+                slots.append(response.result)
+            except (requests.RequestException, ValueError, RPCError) as e:
+                print(
+                    f"WARN: Could not read the slot of {endpoint.url}: {e}",
+                    file=sys.stderr,
+                )
+        if len(slots) > 0:
+            self.min_context_slot = max(slots)
+        return self.min_context_slot
+
+    def with_context_slot(self, config: dict) -> dict:
+        """
+        Adds the pinned minimum context slot, if any, to a request config.
+        """
+        if self.min_context_slot is None:
+            return config
+        return {**config, "minContextSlot": self.min_context_slot}
     
     def get_multiple_programs(
         self,
@@ -109,65 +1015,559 @@ class SolanaRPC(RPCClient):
         offset: int = 0,
         length: int = 1 << 31,
     ) -> Generator[Tuple[str, bytes], None, None]:
-        batch = 100
-        pubkeys = iter(pubkeys) # Program Data keys
-        while True:
-            chunk = list(itertools.islice(pubkeys, batch))
-            if len(chunk) == 0:
-                break
-            for (program_id, elf) in self._get_multiple_programs_batch(
+        """
+        Fetches account data for `pubkeys` in batches of 100.
+
+        With a concurrency of 1, batches are fetched one at a time with a
+        `rate_limit_buffer` sleep between them. Otherwise up to `concurrency`
+        batches are kept in flight, throttled only by the client's token
+        bucket. Either way, results are yielded in input order as soon as
+        each batch completes.
+        """
+        return self._map_batches(
+            pubkeys,
+            lambda chunk: list(self._get_multiple_programs_batch(
+                chunk,
+                offset,
+                length,
+            )),
+            rate_limit_buffer,
+        )
+
+    def download_multiple_programs(
+        self,
+        pubkeys: Iterable[str],
+        open_sink: Callable[[str], Any],
+        rate_limit_buffer,
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, Any], None, None]:
+        """
+        Streams account data for `pubkeys` into sinks, in batches of 100.
+
+        `open_sink(pubkey)` returns an object with `write(data)`, `commit()`
+        and `abort()`. Each account's data is decoded and written as the
+        response arrives, so memory use is bounded by the read size rather
+        than by the batch. Yields `(pubkey, sink.commit())` for each account,
+        batched like `get_multiple_programs`.
+        """
+        return self._map_batches(
+            pubkeys,
+            lambda chunk: list(self._download_multiple_programs_batch(
                 chunk,
+                open_sink,
                 offset,
                 length,
-            ):
-                yield (program_id, elf)
-            time.sleep(rate_limit_buffer)
+            )),
+            rate_limit_buffer,
+        )
 
-    def _get_multiple_programs_batch(
+    def _map_batches(
         self,
         pubkeys: Iterable[str],
+        fetch: Callable[[List[str]], list],
+        rate_limit_buffer,
+    ) -> Generator[Any, None, None]:
+        batch = 100
+        chunks = chunked(pubkeys, batch) # Program Data keys
+        if self.concurrency <= 1:
+            for chunk in chunks:
+                for item in fetch(chunk):
+                    yield item
+                time.sleep(rate_limit_buffer)
+            return
+        for result in imap_bounded(fetch, chunks, self.concurrency):
+            for item in result:
+                yield item
+
+    def _recover_batch(
+        self,
+        pubkeys: List[str],
+        fetch: Callable[[List[str]], Iterable[Tuple[str, Any]]],
+    ) -> Generator[Tuple[str, Any], None, None]:
+        """
+        Runs `fetch(pubkeys)`, a single attempt at a batch yielding
+        `(pubkey, result)` pairs, and recovers from its failures.
+
+        Transient failures retry the accounts not yielded yet, with backoff.
+        Other failures bisect the batch, so an account that cannot be fetched
+        is skipped with a warning without failing the rest of its batch.
+        Failures caused by the request itself are raised.
+        """
+        remaining = list(pubkeys)
+        attempt = 0
+        while len(remaining) > 0:
+            done = set()
+            try:
+                for item in fetch(remaining):
+                    done.add(item[0])
+                    yield item
+                return
+            except RPC_EXCEPTIONS as e:
+                remaining = [k for k in remaining if k not in done]
+                if is_transient(e):
+                    attempt += 1
+                    self.retry.backoff(attempt, e)
+                    continue
+                if is_permanent(e):
+                    raise
+                if len(remaining) == 1:
+                    print(
+                        f"WARN: Skipping {remaining[0]}: {e}",
+                        file=sys.stderr,
+                    )
+                    return
+                mid = len(remaining) // 2
+                yield from self._recover_batch(remaining[:mid], fetch)
+                yield from self._recover_batch(remaining[mid:], fetch)
+                return
+
+    def _get_multiple_programs_batch(
+        self,
+        pubkeys: List[str],
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, bytes], None, None]:
+        return self._recover_batch(
+            pubkeys,
+            lambda keys: self._fetch_multiple_programs(keys, offset, length),
+        )
+
+    def _fetch_multiple_programs(
+        self,
+        pubkeys: List[str],
         offset: int = 0,
         length: int = 1 << 31,
     ) -> Generator[Tuple[str, bytes], None, None]:
         data_slice = {"offset": offset, "length": length}
-        result = self.request(
+        encoding = self.account_encoding
+        request = self.make_request(
             "getMultipleAccounts",
             pubkeys,
-            {
-                "encoding": "base64",
+            self.with_context_slot({
+                "encoding": encoding,
                 "dataSlice": data_slice,
-            },
+            }),
         )
-        for idx, item in enumerate(result["value"]):
+        response = RPCResponse.from_json(self.post(request))
+        if response.is_error() \
+                and self._fall_back_from_zstd(response.error, encoding):
+            yield from self._fetch_multiple_programs(pubkeys, offset, length)
+            return
+        response.raise_for_result()
+        for idx, item in enumerate(response.result["value"]):
             if item is None:
                 print(f"WARN: {pubkeys[idx]} not found!", sys.stderr)
                 continue
-            data = b64decode(item["data"][0])
+            # `a2b_base64` decodes the ASCII `str` directly, without the
+            # intermediate `bytes` copy `b64decode` makes.
+            data = binascii.a2b_base64(item["data"][0])
+            if item["data"][1] == "base64+zstd":
+                data = zstandard.ZstdDecompressor().decompressobj() \
+                    .decompress(data)
             yield (pubkeys[idx], data)
+
+    def _fall_back_from_zstd(self, error: RPCError, encoding: str) -> bool:
+        """
+        Switches to plain base64 account encoding if the node rejected
+        `base64+zstd`, and returns whether the request should be retried.
+        """
+        if encoding == "base64" or error.code != -32602:
+            return False
+        with self.lock:
+            if self.account_encoding == "base64":
+                return True
+            self.account_encoding = "base64"
+        print(
+            "WARN: RPC does not support base64+zstd, falling back to base64",
+            file=sys.stderr,
+        )
+        return True
     
+    def _download_multiple_programs_batch(
+        self,
+        pubkeys: List[str],
+        open_sink: Callable[[str], Any],
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, Any], None, None]:
+        return self._recover_batch(
+            pubkeys,
+            lambda keys: self._stream_multiple_programs(
+                keys,
+                open_sink,
+                offset,
+                length,
+            ),
+        )
+
+    def _stream_multiple_programs(
+        self,
+        pubkeys: List[str],
+        open_sink: Callable[[str], Any],
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, Any], None, None]:
+        data_slice = {"offset": offset, "length": length}
+        encoding = self.account_encoding
+        request = self.make_request(
+            "getMultipleAccounts",
+            pubkeys,
+            self.with_context_slot({
+                "encoding": encoding,
+                "dataSlice": data_slice,
+            }),
+        )
+        if encoding == "base64+zstd":
+            def open_account_sink(pubkey):
+                return _ZstdSink(open_sink(pubkey))
+        else:
+            open_account_sink = open_sink
+        res = self.post_stream(request)
+        parser = AccountDataStream()
+        sinks = {}
+        try:
+            chunks = self.iter_content(res)
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is None:
+                    events = parser.close()
+                else:
+                    events = parser.feed(chunk)
+                for event in events:
+                    idx = event[1]
+                    if event[0] == "start":
+                        sinks[idx] = open_account_sink(pubkeys[idx])
+                    elif event[0] == "data":
+                        sinks[idx].write(event[2])
+                    elif event[0] == "end":
+                        yield (pubkeys[idx], sinks.pop(idx).commit())
+                    elif event[0] == "missing":
+                        print(
+                            f"WARN: {pubkeys[idx]} not found!",
+                            file=sys.stderr,
+                        )
+            response = RPCResponse.from_json(parser.top)
+        except RPC_EXCEPTIONS as e:
+            self.settle_stream(res, e)
+            raise
+        finally:
+            for sink in sinks.values():
+                sink.abort()
+            self.close_stream(res)
+        self.settle_stream(res, response.error)
+        if response.is_error() \
+                and self._fall_back_from_zstd(response.error, encoding):
+            yield from self._stream_multiple_programs(
+                pubkeys,
+                open_sink,
+                offset,
+                length,
+            )
+            return
+        response.raise_for_result()
+
     def get_program_account_keys(
-        self, pubkey: str, filters: list
+        self,
+        pubkey: str,
+        filters: list,
+        shard_offset: Optional[int] = None,
     ) -> Generator[str, None, None]:
-        opts = {
-            "encoding": "base64",
-            "dataSlice": {"offset": 0, "length": 0},
-            "filters": filters,
-        }
-        accounts = self.request("getProgramAccounts", pubkey, opts)
-        for account in accounts:
-            yield account["pubkey"]
+        """
+        Lists the keys of every account owned by `pubkey` matching `filters`,
+        sharded as in `get_program_accounts`.
+        """
+        def fetch(shard_filters):
+            opts = self.with_context_slot({
+                "encoding": "base64",
+                "dataSlice": {"offset": 0, "length": 0},
+                "filters": shard_filters,
+            })
+            accounts = self.request("getProgramAccounts", pubkey, opts)
+            return [account["pubkey"] for account in accounts]
+
+        return self._sharded(pubkey, filters, shard_offset, fetch)
+
+    def get_program_accounts(
+        self,
+        pubkey: str,
+        filters: list,
+        offset: int = 0,
+        length: int = 1 << 31,
+        shard_offset: Optional[int] = None,
+    ) -> Generator[Tuple[str, bytes], None, None]:
+        """
+        Fetches the keys and a slice of the data of every account owned by
+        `pubkey` matching `filters`. Meant for short slices; use
+        `download_program_accounts` for ELFs.
+
+        With `shard_bytes` set on the client and a `shard_offset`, the
+        listing is split into `256 ** shard_bytes` narrower calls, one per
+        prefix of the account data at `shard_offset`, which has to be evenly
+        spread, such as a pubkey. Otherwise it is a single call.
+        """
+        def fetch(shard_filters):
+            opts = self.with_context_slot({
+                "encoding": "base64",
+                "dataSlice": {"offset": offset, "length": length},
+                "filters": shard_filters,
+            })
+            accounts = self.request("getProgramAccounts", pubkey, opts)
+            return [
+                (
+                    account["pubkey"],
+                    binascii.a2b_base64(account["account"]["data"][0]),
+                )
+                for account in accounts
+            ]
+
+        return self._sharded(pubkey, filters, shard_offset, fetch)
+
+    def _sharded(
+        self,
+        pubkey: str,
+        filters: list,
+        shard_offset: Optional[int],
+        fetch: Callable[[list], list],
+    ) -> Generator[Any, None, None]:
+        """
+        Calls `fetch(filters)` once, or once per shard with a shard filter
+        added. Up to `concurrency` shards are in flight, and their results
+        are yielded in shard order as they complete.
+        """
+        if shard_offset is None or self.shard_bytes <= 0:
+            yield from fetch(filters)
+            return
+        prefixes = (
+            bytes(prefix)
+            for prefix in itertools.product(
+                range(256),
+                repeat=self.shard_bytes,
+            )
+        )
+        for result in imap_bounded(
+            lambda prefix: self._fetch_shard(
+                pubkey,
+                filters,
+                shard_offset,
+                prefix,
+                fetch,
+            ),
+            prefixes,
+            self.concurrency,
+        ):
+            yield from result
+
+    def _fetch_shard(
+        self,
+        pubkey: str,
+        filters: list,
+        shard_offset: int,
+        prefix: bytes,
+        fetch: Callable[[list], list],
+    ) -> list:
+        """
+        Fetches one shard, retrying transient failures. A shard that still
+        fails in a way a narrower scan may not, such as by timing out, is
+        split into 256 narrower shards by the next byte, down to
+        `MAX_SHARD_BYTES`.
+        """
+        try:
+            return fetch([*filters, shard_filter(shard_offset, prefix)])
+        except RPC_EXCEPTIONS as e:
+            if not is_too_large(e) or len(prefix) >= MAX_SHARD_BYTES:
+                raise
+            print(
+                f"WARN: {pubkey} shard {prefix.hex()} failed ({e}), splitting "
+                "it",
+                file=sys.stderr,
+            )
+            self.metrics.count("rpc_shard_splits_total")
+            return [
+                item
+                for byte in range(256)
+                for item in self._fetch_shard(
+                    pubkey,
+                    filters,
+                    shard_offset,
+                    prefix + bytes([byte]),
+                    fetch,
+                )
+            ]
+
+    def download_program_accounts(
+        self,
+        pubkey: str,
+        filters: list,
+        open_sink: Callable[[str], Any],
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, Any], None, None]:
+        """
+        Streams the data of every account owned by `pubkey` matching
+        `filters` into sinks, from a single `getProgramAccounts` call.
+
+        Sinks work as in `download_multiple_programs`, except that
+        `open_sink(pubkey)` may return `None` to skip an account. Yields
+        `(pubkey, sink.commit())` for each account as its data completes.
+
+        Transient failures send the call again with backoff, skipping the
+        accounts already yielded.
+        """
+        done = set()
+
+        def open_remaining_sink(key):
+            return None if key in done else open_sink(key)
+
+        attempt = 0
+        while True:
+            try:
+                for (key, result) in self._download_program_accounts(
+                    pubkey,
+                    filters,
+                    open_remaining_sink,
+                    offset,
+                    length,
+                ):
+                    done.add(key)
+                    yield (key, result)
+                return
+            except RPC_EXCEPTIONS as e:
+                attempt += 1
+                self.retry.backoff(attempt, e)
+
+    def _download_program_accounts(
+        self,
+        pubkey: str,
+        filters: list,
+        open_sink: Callable[[str], Any],
+        offset: int = 0,
+        length: int = 1 << 31,
+    ) -> Generator[Tuple[str, Any], None, None]:
+        encoding = self.account_encoding
+        request = self.make_request(
+            "getProgramAccounts",
+            pubkey,
+            self.with_context_slot({
+                "encoding": encoding,
+                "dataSlice": {"offset": offset, "length": length},
+                "filters": filters,
+            }),
+        )
+        res = self.post_stream(request)
+        parser = AccountDataStream(PROGRAM_ACCOUNT_DATA_PATH)
+        keys = {}
+        # Data that arrived before its account's `pubkey`.
+        pending = {}
+        sinks = {}
+
+        def sink_for(idx):
+            if idx not in sinks:
+                sink = open_sink(keys[idx])
+                if sink is not None and encoding == "base64+zstd":
+                    sink = _ZstdSink(sink)
+                sinks[idx] = sink
+                for data in pending.pop(idx, []):
+                    if sink is not None:
+                        sink.write(data)
+            return sinks[idx]
+
+        try:
+            chunks = self.iter_content(res)
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is None:
+                    events = parser.close()
+                else:
+                    events = parser.feed(chunk)
+                for event in events:
+                    idx = event[1]
+                    if event[0] == "field" and event[2] == "pubkey":
+                        keys[idx] = event[3]
+                    elif event[0] == "data":
+                        if idx not in keys:
+                            pending.setdefault(idx, []).append(event[2])
+                        elif sink_for(idx) is not None:
+                            sinks[idx].write(event[2])
+                    elif event[0] == "end":
+                        sink = sink_for(idx)
+                        del sinks[idx]
+                        if sink is not None:
+                            yield (keys[idx], sink.commit())
+            response = RPCResponse.from_json(parser.top)
+        except RPC_EXCEPTIONS as e:
+            self.settle_stream(res, e)
+            raise
+        finally:
+            for sink in sinks.values():
+                if sink is not None:
+                    sink.abort()
+            self.close_stream(res)
+        self.settle_stream(res, response.error)
+        if response.is_error() \
+                and self._fall_back_from_zstd(response.error, encoding):
+            yield from self._download_program_accounts(
+                pubkey,
+                filters,
+                open_sink,
+                offset,
+                length,
+            )
+            return
+        response.raise_for_result()
     
     def get_last_slot_for_address(self, address: str) -> int:
         res = self.request(
             "getSignaturesForAddress",
             address,
-            {
-                "commitment": "confirmed",
-                "limit": 1
-            }
+            self.with_context_slot(LAST_SIGNATURE_CONFIG),
         )
         if len(res) == 0:
-            print("Slot: 0")
             return 0
-        print(f"Slot: {res[0]['slot']}")
-        return res[0]["slot"]
\ No newline at end of file
+        return res[0]["slot"]
+
+    def get_last_slots_for_addresses(
+        self,
+        addresses: Iterable[str],
+        batch_size: int = 100,
+    ) -> Generator[Tuple[str, int], None, None]:
+        """
+        Looks up the last signature slot of each address, packing
+        `batch_size` `getSignaturesForAddress` calls into every HTTP POST.
+        Addresses with no signatures have a slot of 0.
+        """
+        for (address, slot, _) in self.get_last_signatures_for_addresses(
+            ((address, None) for address in addresses),
+            batch_size,
+        ):
+            yield (address, slot)
+
+    def get_last_signatures_for_addresses(
+        self,
+        addresses_with_until: Iterable[Tuple[str, Optional[str]]],
+        batch_size: int = 100,
+    ) -> Generator[Tuple[str, int, Optional[str]], None, None]:
+        """
+        Looks up the last signature of each address and its slot, packing
+        `batch_size` `getSignaturesForAddress` calls into every HTTP POST.
+
+        An address given with an `until` signature is only searched back to
+        it, so an address with no activity since is cheap to look up.
+        Addresses with no signatures (newer than `until`) have a slot of 0
+        and a signature of `None`.
+        """
+        config = self.with_context_slot(LAST_SIGNATURE_CONFIG)
+        for chunk in chunked(addresses_with_until, batch_size):
+            responses = self.request_batch([
+                (
+                    "getSignaturesForAddress",
+                    [address, config if until is None
+                        else {**config, "until": until}],
+                )
+                for (address, until) in chunk
+            ])
+            for ((address, _), res) in zip(chunk, responses):
+                res.raise_for_result()
+                if len(res.result) == 0:
+                    yield (address, 0, None)
+                else:
+                    last = res.result[0]
+                    yield (address, last["slot"], last["signature"])
\ No newline at end of file
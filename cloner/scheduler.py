@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import sys
+import threading
+
+class Scheduler:
+    """
+    Runs named tasks as a DAG on threads. Each task starts as soon as every
+    task it depends on has finished, and is called with their results.
+
+    Tasks share whatever they close over, such as one `SolanaRPC` with its
+    connection pool, rate limit and in-flight budget, so running phases side
+    by side does not multiply the load on the RPC.
+
+    If a task fails, tasks not started yet are dropped, and the first error is
+    raised once the running ones have finished. While tasks run, stdout and
+    stderr are written a line at a time, so their output does not interleave
+    within lines.
+    """
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name, fn, deps=()):
+        """
+        Adds a task calling `fn(*results_of_deps)`. Dependencies have to be
+        added first, which keeps the graph acyclic.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Task '{name}' already exists")
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task '{name}' depends on unknown '{dep}'")
+        self.tasks[name] = (fn, tuple(deps))
+
+    def run(self) -> dict:
+        """
+        Runs every task and returns their results by name.
+        """
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        sys.stdout = _LineWriter(stdout)
+        sys.stderr = _LineWriter(stderr)
+        try:
+            return self._run()
+        finally:
+            (sys.stdout, sys.stderr) = (stdout, stderr)
+
+    def _run(self) -> dict:
+        results = {}
+        pending = dict(self.tasks)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(len(self.tasks), 1)) as pool:
+            while True:
+                if error is None:
+                    # Tasks start in the order they were added.
+                    for (name, (fn, deps)) in list(pending.items()):
+                        if all(dep in results for dep in deps):
+                            del pending[name]
+                            future = pool.submit(
+                                fn,
+                                *(results[dep] for dep in deps),
+                            )
+                            running[future] = name
+                if len(running) == 0:
+                    break
+                (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+        if error is not None:
+            raise error
+        return results
+
+class _LineWriter:
+    """
+    Text stream wrapper that holds each thread's output until it ends a line
+    or is flushed, and then writes it in one piece.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, "buf", "") + text
+        cut = buf.rfind("\n") + 1
+        if cut > 0:
+            with self.lock:
+                self.stream.write(buf[:cut])
+        self.local.buf = buf[cut:]
+        return len(text)
+
+    def flush(self):
+        buf = getattr(self.local, "buf", "")
+        self.local.buf = ""
+        with self.lock:
+            if len(buf) > 0:
+                self.stream.write(buf)
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
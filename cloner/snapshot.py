@@ -0,0 +1,355 @@
+from base64 import b64decode
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+from pathlib import Path
+import re
+import struct
+import sys
+import threading
+
+from base58 import b58decode
+
+from cloner.filters import BPF_LOADER_2_PUBKEY, BPF_LOADER_3_PUBKEY, \
+    BPF_LOADER_PUBKEY
+
+from .keys import key_bytes, key_str
+from .metrics import Metrics
+from .util import Progress, chunked
+
+# Account storage files of a snapshot, named `<slot>.<id>`.
+STORAGE_FILE_NAME = re.compile(r"^(\d+)\.(\d+)$")
+
+# Each account in an AppendVec storage file is a header followed by its data,
+# padded to 8 bytes. The header holds the stored meta (write version, data
+# length and pubkey), the account meta (lamports, rent epoch, owner and
+# executable flag) and a 32-byte account hash, as written by Agave.
+ACCOUNT_HEADER = struct.Struct("<QQ32sQQ32s?7x32s")
+ALIGNMENT = 8
+
+# Longest account data allowed on chain. A larger data length means the rest
+# of a storage file is not accounts.
+MAX_DATA_LENGTH = 10 << 20
+
+# Every loader-owned account found in a scan keeps this much of its data in
+# memory, enough to apply the loader filters and read Program addresses and
+# Program Data headers without going back to the storage file.
+HEAD_LENGTH = 64
+
+LOADER_PUBKEYS = [BPF_LOADER_PUBKEY, BPF_LOADER_2_PUBKEY, BPF_LOADER_3_PUBKEY]
+
+# Storage files scanned by each worker task.
+CHUNK_SIZE = 64
+
+# Below this many storage files, scanning them is not worth the cost of
+# starting worker processes.
+PARALLEL_SCAN_THRESHOLD = 256
+
+# Size of reads of account data streamed into sinks.
+READ_SIZE = 1 << 20
+
+def storage_files(path):
+    """
+    Returns the `(slot, path)` of every account storage file under `path`,
+    such as an unpacked snapshot archive or a validator's accounts directory.
+    A file found in several places, such as hard links in `run` and
+    `snapshot` directories, is only returned once.
+    """
+    files = {}
+    for file in sorted(Path(path).rglob("*")):
+        match = STORAGE_FILE_NAME.match(file.name)
+        if match is not None and file.is_file():
+            files.setdefault(file.name, (int(match.group(1)), file))
+    return sorted(files.values(), key=lambda item: item[0])
+
+def scan_storage(path, owners):
+    """
+    Scans the storage file at `path` through a read-only memory map, and
+    returns the pubkey, owner, lamports, data offset, data length and first
+    `HEAD_LENGTH` bytes of data of each account owned by one of `owners`, in
+    the order they were written. Closed accounts, with no lamports left, are
+    returned whatever their owner, as they replace any earlier version.
+
+    Scanning stops at the first header that cannot be an account, such as
+    the zeroed space past the end of a file's accounts.
+    """
+    accounts = []
+    if os.path.getsize(path) == 0:
+        return accounts
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = len(data)
+            offset = 0
+            while offset + ACCOUNT_HEADER.size <= end:
+                (
+                    _, data_length, pubkey, lamports, _, owner, _, _,
+                ) = ACCOUNT_HEADER.unpack_from(data, offset)
+                data_offset = offset + ACCOUNT_HEADER.size
+                if (
+                    data_length > MAX_DATA_LENGTH
+                    or data_offset + data_length > end
+                    or (lamports == 0 and data_length == 0
+                        and pubkey == bytes(32))
+                ):
+                    break
+                if owner in owners or lamports == 0:
+                    accounts.append((
+                        pubkey,
+                        owner,
+                        lamports,
+                        data_offset,
+                        data_length,
+                        data[data_offset:data_offset + min(
+                            data_length,
+                            HEAD_LENGTH,
+                        )],
+                    ))
+                offset = -(-(data_offset + data_length) // ALIGNMENT) \
+                    * ALIGNMENT
+    return accounts
+
+def _scan_chunk(args):
+    (paths, owners) = args
+    return [scan_storage(path, owners) for path in paths]
+
+def _matches(account, filters, read):
+    """
+    Returns whether an account passes RPC `getProgramAccounts` filters,
+    reading past its head through `read(offset, length)` if a filter needs
+    to.
+    """
+    (_, _, _, _, data_length, head) = account
+    for f in filters:
+        if "dataSize" in f:
+            if data_length != f["dataSize"]:
+                return False
+        elif "memcmp" in f:
+            memcmp = f["memcmp"]
+            expected = b64decode(memcmp["bytes"]) \
+                if memcmp.get("encoding") == "base64" \
+                else b58decode(memcmp["bytes"])
+            start = memcmp["offset"]
+            if start + len(expected) <= len(head):
+                actual = head[start:start + len(expected)]
+            else:
+                actual = read(start, len(expected))
+            if actual != expected:
+                return False
+        else:
+            raise ValueError(f"Unsupported filter: {f}")
+    return True
+
+class SnapshotSource:
+    """
+    Offline stand-in for `SolanaRPC`, answering the account queries of
+    `clone` and `profile-slots` from the account storage files of a local
+    snapshot rather than from an RPC.
+
+    Storage files are memory-mapped and scanned across `processes` worker
+    processes for accounts owned by the loaders, once, on the first query.
+    An account stored more than once keeps its version from the latest
+    slot, and accounts closed by then, with no lamports left, are left out,
+    as an RPC would at the snapshot's slot. Data past each account's head is
+    read from its storage file when needed.
+    """
+    def __init__(
+        self,
+        path,
+        metrics=None,
+        processes=None,
+        progress_bar=False,
+    ):
+        self.path = Path(path)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.processes = processes if processes is not None \
+            else os.cpu_count() or 1
+        self.progress_bar = progress_bar
+        self.urls = [self.path.resolve().as_uri()]
+        # No RPC endpoints to report on.
+        self.pool = []
+        self.files = storage_files(self.path)
+        self.slot = max((slot for (slot, _) in self.files), default=0)
+        self.accounts = None
+        self.lock = threading.Lock()
+
+    def get_version(self) -> dict:
+        version = {"snapshot-slot": self.slot}
+        version_path = self.path / "version"
+        if version_path.exists():
+            version["snapshot-version"] = version_path.read_text().strip()
+        return version
+
+    def pin_context_slot(self):
+        """
+        Returns the snapshot's slot, that of its newest storage file.
+        """
+        return self.slot
+
+    def _scan(self):
+        """
+        Returns the loader-owned accounts of the snapshot by pubkey, as
+        `(storage file index, account)` pairs, scanning it the first time.
+        """
+        with self.lock:
+            if self.accounts is not None:
+                return self.accounts
+            print(
+                f"Scanning {len(self.files)} snapshot storage files with "
+                f"{self.processes} processes..."
+            )
+            owners = frozenset(key_bytes(k) for k in LOADER_PUBKEYS)
+            chunks = (
+                ([str(path) for (_, path) in chunk], owners)
+                for chunk in chunked(self.files, CHUNK_SIZE)
+            )
+            progress = Progress(
+                "Scanned",
+                len(self.files),
+                "storage files",
+                bar=self.progress_bar,
+            )
+            accounts = {}
+            i = 0
+            with self.metrics.stage("scan_snapshot") as stage:
+                if len(self.files) >= PARALLEL_SCAN_THRESHOLD \
+                        and self.processes > 1:
+                    executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                    )
+                    results = executor.map(_scan_chunk, chunks)
+                else:
+                    executor = None
+                    results = map(_scan_chunk, chunks)
+                try:
+                    # Files are in slot order and each file's accounts in
+                    # write order, so later versions replace earlier ones.
+                    for chunk in results:
+                        for found in chunk:
+                            for account in found:
+                                accounts[account[0]] = (i, account)
+                            i += 1
+                        progress.update(len(chunk))
+                finally:
+                    if executor is not None:
+                        executor.shutdown()
+                progress.close()
+                self.accounts = {
+                    pubkey: item for (pubkey, item) in accounts.items()
+                    if item[1][2] > 0
+                }
+                stage["items"] = len(self.accounts)
+            print(f"Found {len(self.accounts)} loader accounts")
+            return self.accounts
+
+    def _read(self, file_index, account, offset=0, length=1 << 31):
+        """
+        Returns a slice of an account's data, read from its storage file.
+        """
+        (_, _, _, data_offset, data_length, head) = account
+        end = min(data_length, offset + length)
+        if offset >= end:
+            return b""
+        if end <= len(head):
+            return head[offset:end]
+        with open(self.files[file_index][1], "rb") as file:
+            file.seek(data_offset + offset)
+            return file.read(end - offset)
+
+    def _owned(self, pubkey, filters):
+        """
+        Yields the `(file index, account)` pairs owned by `pubkey` that pass
+        `filters`, ordered by pubkey.
+        """
+        owner = key_bytes(pubkey)
+        accounts = self._scan()
+        for k in sorted(accounts):
+            (i, account) = accounts[k]
+            if account[1] == owner and _matches(
+                account,
+                filters,
+                lambda offset, length: self._read(i, account, offset, length),
+            ):
+                yield (i, account)
+
+    def _lookup(self, pubkeys):
+        """
+        Yields the `(pubkey, file index, account)` of each of `pubkeys`,
+        warning about those not found, like `getMultipleAccounts`.
+        """
+        accounts = self._scan()
+        for k in pubkeys:
+            item = accounts.get(key_bytes(k))
+            if item is None:
+                print(f"WARN: {k} not found!", file=sys.stderr)
+                continue
+            yield (str(k), *item)
+
+    def get_program_account_keys(self, pubkey, filters, shard_offset=None):
+        # A local scan needs no shards.
+        for (_, account) in self._owned(pubkey, filters):
+            yield key_str(account[0])
+
+    def get_program_accounts(
+        self,
+        pubkey,
+        filters,
+        offset=0,
+        length=1 << 31,
+        shard_offset=None,
+    ):
+        for (i, account) in self._owned(pubkey, filters):
+            yield (key_str(account[0]), self._read(i, account, offset, length))
+
+    def get_multiple_programs(
+        self,
+        pubkeys,
+        rate_limit_buffer,
+        offset=0,
+        length=1 << 31,
+    ):
+        for (k, i, account) in self._lookup(pubkeys):
+            yield (k, self._read(i, account, offset, length))
+
+    def download_multiple_programs(
+        self,
+        pubkeys,
+        open_sink,
+        rate_limit_buffer,
+        offset=0,
+        length=1 << 31,
+    ):
+        for (k, i, account) in self._lookup(pubkeys):
+            yield (k, self._stream(i, account, open_sink(k), offset, length))
+
+    def download_program_accounts(
+        self,
+        pubkey,
+        filters,
+        open_sink,
+        offset=0,
+        length=1 << 31,
+    ):
+        for (i, account) in self._owned(pubkey, filters):
+            k = key_str(account[0])
+            sink = open_sink(k)
+            if sink is not None:
+                yield (k, self._stream(i, account, sink, offset, length))
+
+    def _stream(self, file_index, account, sink, offset, length):
+        """
+        Writes a slice of an account's data into `sink` in reads of
+        `READ_SIZE`, and returns `sink.commit()`.
+        """
+        end = min(account[4], offset + length)
+        try:
+            for start in range(offset, end, READ_SIZE):
+                sink.write(self._read(
+                    file_index,
+                    account,
+                    start,
+                    min(READ_SIZE, end - start),
+                ))
+        except BaseException:
+            sink.abort()
+            raise
+        return sink.commit()
@@ -1,68 +1,145 @@
 import sys
 import time
 
+from .keys import KeyTable
 from .rpc import SolanaRPC
-from .util import bundle_full_path, write_to_bundle_csv
+from .util import Progress, bundle_full_path, bundle_table_exists, chunked, \
+    imap_bounded, read_bundle_table, write_to_bundle_table
 
-def sort(bundle_name, url, rate_limit_buffer):
-    if not bundle_full_path(bundle_name).exists:
-        print(f"Bundle '{bundle_name}' does not exist.", sys.stderr)
+def sort(
+    bundle_name,
+    url,
+    rate_limit_buffer,
+    batch_size=100,
+    concurrency=1,
+    requests_per_second=None,
+    fmt="csv",
+    metrics=None,
+    progress_bar=False,
+    full=False,
+):
+    if not bundle_full_path(bundle_name).exists():
+        print(f"Bundle '{bundle_name}' does not exist.", file=sys.stderr)
 
-    rpc = SolanaRPC(url)
+    rpc = SolanaRPC(url, requests_per_second, concurrency, metrics=metrics)
+    metrics = rpc.metrics
+    context_slot = rpc.pin_context_slot()
 
     print("Sorting programs by last execution slot...")
-    print(f"    RPC URL         : {url}")
+    print(f"    RPC URL         : {', '.join(rpc.urls)}")
+    print(f"    Context Slot    : {context_slot}")
     print(f"    Bundle Name     : {bundle_name}")
+    print(f"    Format          : {fmt}")
+    print(f"    Incremental     : {'no' if full else 'yes'}")
 
-    program_keys = []
-    program_keys_with_slot = []
+    program_keys = KeyTable()
 
-    # BPF Loader Programs.
-    file_name = bundle_full_path(bundle_name) / "bpf_loader.csv"
-    if not file_name.exists:
-        print(f"File '{file_name}' does not exist.", sys.stderr)
-    with open(file_name, 'r') as file:
-        for line in file:
-            program_keys.append((line.strip(), 1))
-    
-    # BPF Loader 2 Programs.
-    file_name = bundle_full_path(bundle_name) / "bpf_loader_2.csv"
-    if not file_name.exists:
-        print(f"File '{file_name}' does not exist.", sys.stderr)
-    with open(file_name, 'r') as file:
-        for line in file:
-            program_keys.append((line.strip(), 2))
+    # BPF Loader, BPF Loader 2 and BPF Loader 3 Programs.
+    with metrics.stage("read_keys") as stage:
+        for (table, loader) in (
+            ("bpf_loader", 1),
+            ("bpf_loader_2", 2),
+            ("bpf_loader_3", 3),
+        ):
+            if not bundle_table_exists(bundle_name, table):
+                print(f"Table '{table}' does not exist.", file=sys.stderr)
+                continue
+            program_keys.extend(
+                (row[0] for row in read_bundle_table(bundle_name, table)),
+                loader=loader,
+            )
+        stage["items"] = len(program_keys)
 
-    # BPF Loader 3 Programs.
-    file_name = bundle_full_path(bundle_name) / "bpf_loader_3.csv"
-    if not file_name.exists:
-        print(f"File '{file_name}' does not exist.", sys.stderr)
-    with open(file_name, 'r') as file:
-        for line in file:
-            program_keys.append((line.strip(), 3))
-    
-    # Using `GetSignaturesForAddress`, get the last execution slot for each
-    # program.
-    total_programs_to_sort = len(program_keys)
-    current_program = 0
-    chunk = 0
-    for program in program_keys:
-        slot = rpc.get_last_slot_for_address(program[0])
-        program_keys_with_slot.append((slot, program[0], program[1]))
-        if chunk % 10 == 0:
-            print(f"    Sorted {current_program}/{total_programs_to_sort} programs")
-        chunk += 1
-        current_program += 1
-        time.sleep(rate_limit_buffer)
+    # Each program's last signature as of the previous sort. Lookups for
+    # these programs only search back to it, and keep its slot if there is
+    # nothing newer.
+    signatures = [None] * len(program_keys)
+    if not full and bundle_table_exists(bundle_name, "last_signatures"):
+        with metrics.stage("read_signatures") as stage:
+            previous = KeyTable()
+            previous_signatures = []
+            for (k, slot, signature) in read_bundle_table(
+                bundle_name,
+                "last_signatures",
+            ):
+                previous.append(k, slot)
+                previous_signatures.append(signature or None)
+            for i in range(len(program_keys)):
+                j = previous.find(program_keys.key_bytes(i))
+                if j is not None and previous_signatures[j] is not None:
+                    program_keys.slots[i] = previous.slots[j]
+                    signatures[i] = previous_signatures[j]
+            stage["items"] = len(program_keys) - signatures.count(None)
+        print(
+            f"Found previous signatures for {stage['items']} of "
+            f"{len(program_keys)} programs"
+        )
 
-    # Sort by slot.
-    program_keys_with_slot.sort(key=lambda x: x[0], reverse=True)
+    # Using `GetSignaturesForAddress`, get the last execution slot for each
+    # program. Lookups are packed into JSON-RPC batches of `batch_size` calls,
+    # with up to `concurrency` batches in flight.
+    progress = Progress("Sorted", len(program_keys), bar=progress_bar)
+    unchanged = 0
+    with metrics.stage("last_slots") as stage:
+        # Chunks are ranges of rows, whose keys are only encoded as base58
+        # for their batch.
+        for (chunk, results) in imap_bounded(
+            lambda chunk: (chunk, _scan_last_signatures(
+                rpc,
+                [(program_keys.key(i), signatures[i]) for i in chunk],
+            )),
+            chunked(range(len(program_keys)), batch_size),
+            concurrency,
+        ):
+            for (i, (slot, signature)) in zip(chunk, results):
+                if signature is None and signatures[i] is not None:
+                    # No activity since the previous sort.
+                    unchanged += 1
+                    continue
+                program_keys.slots[i] = slot
+                signatures[i] = signature
+            progress.update(len(chunk))
+            if concurrency <= 1:
+                time.sleep(rate_limit_buffer)
+        progress.close()
+        stage["items"] = len(program_keys)
+    if unchanged > 0:
+        print(f"{unchanged} programs unchanged since the previous sort")
 
-    # Write sorted programs to a new file.
-    file_name = bundle_full_path(bundle_name) / "sorted_programs.csv"
-    with open(file_name, 'w') as file:
-        write_to_bundle_csv(
+    # Sort by slot, and write sorted programs to a new file.
+    with metrics.stage("write"):
+        write_to_bundle_table(
+            bundle_name,
+            "sorted_programs",
+            (
+                (slot, k, loader) for (k, slot, loader)
+                in program_keys.sorted_by_slot(reverse=True).rows()
+            ),
+            fmt,
+        )
+        write_to_bundle_table(
             bundle_name,
-            "sorted_programs.csv",
-            program_keys_with_slot,
-        )
\ No newline at end of file
+            "last_signatures",
+            (
+                (k, slot, signature) for ((k, slot), signature)
+                in zip(program_keys.items(), signatures)
+            ),
+            fmt,
+        )
+
+    if len(rpc.pool) > 1:
+        print("RPC endpoints:")
+        rpc.pool.report()
+
+def _scan_last_signatures(rpc, addresses_with_until):
+    """
+    Looks up the last signature of every address and its slot. Failed
+    batches, including rate-limited ones, are retried by the client.
+    """
+    return [
+        (slot, signature) for (_, slot, signature)
+        in rpc.get_last_signatures_for_addresses(
+            addresses_with_until,
+            len(addresses_with_until),
+        )
+    ]
@@ -0,0 +1,105 @@
+from hashlib import sha256
+import os
+import threading
+
+from .util import link_or_copy, store_full_path, write_atomic
+
+def elf_digest(data) -> str:
+    return sha256(data).hexdigest()
+
+def file_digest(path) -> str:
+    digest = sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ElfStore:
+    """
+    Content-addressed ELF store shared by all bundles, under
+    `bundles/.store`. Each distinct ELF is written once, named by its SHA-256
+    digest, and hard-linked into every bundle that contains it.
+    """
+    def __init__(self, path=None):
+        self.path = path if path is not None else store_full_path()
+        self.written = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return self.path / digest[:2] / f"{digest}.elf"
+
+    def put(self, data, digest=None) -> str:
+        """
+        Adds an ELF to the store, skipping the write if an ELF with the same
+        digest is already stored, and returns its digest.
+        """
+        digest = digest if digest is not None else elf_digest(data)
+        blob_path = self.blob_path(digest)
+        if blob_path.exists():
+            with self.lock:
+                self.reused += 1
+            return digest
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(blob_path, data)
+        with self.lock:
+            self.written += 1
+        return digest
+
+    def put_file(self, path, digest) -> str:
+        """
+        Moves a complete ELF file at `path` into the store, or discards it if
+        an ELF with the same digest is already stored.
+        """
+        blob_path = self.blob_path(digest)
+        if blob_path.exists():
+            os.remove(path)
+            with self.lock:
+                self.reused += 1
+            return digest
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, blob_path)
+        with self.lock:
+            self.written += 1
+        return digest
+
+    def link(self, digest, dst):
+        """
+        Links a stored ELF into a bundle at `dst`.
+        """
+        link_or_copy(self.blob_path(digest), dst)
+
+class ElfFile:
+    """
+    Sink that streams an ELF to `path` through a temporary file, hashing it
+    on the way. The ELF is only put in place, directly or through `elf_store`,
+    once `commit` is called.
+    """
+    def __init__(self, path, elf_store=None):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.elf_store = elf_store
+        self.digest = sha256()
+        self.file = open(self.tmp_path, "wb")
+
+    def write(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+
+    def commit(self) -> str:
+        """
+        Puts the ELF in place and returns its digest.
+        """
+        self.file.close()
+        digest = self.digest.hexdigest()
+        if self.elf_store is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.elf_store.put_file(self.tmp_path, digest)
+            self.elf_store.link(digest, self.path)
+        return digest
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
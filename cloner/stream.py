@@ -0,0 +1,221 @@
+import binascii
+import codecs
+import json
+from typing import List, Optional, Tuple
+
+# Paths of the base64 account data string in `getMultipleAccounts` and
+# `getProgramAccounts` responses, with `None` matching any account index.
+ACCOUNT_DATA_PATH = ("result", "value", None, "data", 0)
+PROGRAM_ACCOUNT_DATA_PATH = ("result", None, "account", "data", 0)
+
+_WHITESPACE = " \t\r\n"
+_DECODER = json.JSONDecoder()
+
+def _matches(path: tuple, pattern: tuple) -> bool:
+    """
+    Returns whether `path` is a prefix of `pattern`, with `None` in
+    `pattern` matching any array index.
+    """
+    if len(path) > len(pattern):
+        return False
+    return all(p is None or p == k for (k, p) in zip(path, pattern))
+
+class AccountDataStream:
+    """
+    Incremental parser for `getMultipleAccounts` and `getProgramAccounts`
+    responses, which can hold many accounts of several hundred KB each.
+
+    Bytes are passed to `feed` as they arrive, and come back as events:
+
+    - `("start", idx)` when account `idx` begins.
+    - `("field", idx, key, value)` for other members of account `idx`, such
+      as the `pubkey` of a `getProgramAccounts` entry.
+    - `("data", idx, bytes)` with the next decoded piece of its data.
+    - `("end", idx)` when account `idx` is complete.
+    - `("missing", idx)` when account `idx` does not exist.
+
+    Only the containers leading to account data (`data_path`) are walked by
+    the parser; every other value is small and decoded whole with `json`.
+    Top-level members other than `result` (such as `error`) are kept in
+    `top`.
+    """
+    def __init__(self, data_path=ACCOUNT_DATA_PATH):
+        self.data_path = data_path
+        self.account_depth = data_path.index(None) + 1
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.stack: List[dict] = []
+        self.top = {}
+        self.done = False
+        # Account index while inside a streamed data string.
+        self.streaming: Optional[int] = None
+        self.b64_tail = ""
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Tuple]:
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk, final)
+        self.pos = 0
+        events = []
+        self._parse(events, final)
+        return events
+
+    def close(self) -> List[Tuple]:
+        events = self.feed(b"", final=True)
+        if not self.done:
+            raise ValueError("Truncated JSON-RPC response")
+        return events
+
+    def _parse(self, events: list, final: bool):
+        buf = self.buf
+        while True:
+            if self.streaming is not None:
+                if not self._stream_string(events, final):
+                    return
+                continue
+            while self.pos < len(buf) and buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos >= len(buf) or self.done:
+                return
+            c = buf[self.pos]
+            frame = self.stack[-1] if self.stack else None
+            if frame is None:
+                if not self._value((), c, events, final):
+                    return
+            elif frame["kind"] == "obj":
+                state = frame["state"]
+                if state == "key":
+                    if c == "}":
+                        self._close(events)
+                        continue
+                    try:
+                        key, end = json.decoder.scanstring(buf, self.pos + 1)
+                    except json.JSONDecodeError:
+                        if final:
+                            raise
+                        return
+                    frame["key"] = key
+                    frame["state"] = "colon"
+                    self.pos = end
+                elif state == "colon":
+                    self._expect(c, ":")
+                    frame["state"] = "value"
+                elif state == "value":
+                    path = frame["path"] + (frame["key"],)
+                    if not self._value(path, c, events, final):
+                        return
+                else:
+                    if c == "}":
+                        self._close(events)
+                    else:
+                        self._expect(c, ",")
+                        frame["state"] = "key"
+            else:
+                if frame["state"] == "value":
+                    if c == "]" and frame["index"] == 0:
+                        self._close(events)
+                        continue
+                    path = frame["path"] + (frame["index"],)
+                    if not self._value(path, c, events, final):
+                        return
+                else:
+                    if c == "]":
+                        self._close(events)
+                    else:
+                        self._expect(c, ",")
+                        frame["index"] += 1
+                        frame["state"] = "value"
+
+    def _value(self, path: tuple, c: str, events: list, final: bool) -> bool:
+        """
+        Parses the value starting at `pos`. Returns `False` if more input is
+        needed first.
+        """
+        depth = self.account_depth
+        is_account = len(path) == depth and _matches(path, self.data_path)
+        if len(path) == len(self.data_path) and c == '"' \
+                and _matches(path, self.data_path):
+            self.streaming = path[depth - 1]
+            self.b64_tail = ""
+            self.pos += 1
+            return True
+        if c in "{[" and _matches(path, self.data_path):
+            self.stack.append({
+                "kind": "obj" if c == "{" else "arr",
+                "path": path,
+                "state": "key" if c == "{" else "value",
+                "key": None,
+                "index": 0,
+            })
+            if is_account:
+                events.append(("start", path[depth - 1]))
+            self.pos += 1
+            return True
+        try:
+            value, end = _DECODER.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False
+        # A number at the end of the buffer may continue in the next chunk.
+        if end == len(self.buf) and not final and len(path) > 0:
+            return False
+        self.pos = end
+        if is_account and value is None:
+            events.append(("missing", path[depth - 1]))
+        if len(path) == depth + 1 and _matches(path[:depth], self.data_path):
+            events.append(("field", path[depth - 1], path[depth], value))
+        if len(path) == 1:
+            self.top[path[0]] = value
+        self._value_done()
+        return True
+
+    def _stream_string(self, events: list, final: bool) -> bool:
+        """
+        Decodes the streamed base64 string up to the end of the buffer or its
+        closing quote. Returns `False` if more input is needed.
+        """
+        end = self.buf.find('"', self.pos)
+        piece = self.buf[self.pos:] if end < 0 else self.buf[self.pos:end]
+        # Hold back a trailing escape until its pair arrives.
+        if end < 0 and piece.endswith("\\") and not final:
+            piece = piece[:-1]
+        self.pos += len(piece)
+        if "\\" in piece:
+            piece = piece.replace("\\/", "/")
+        text = self.b64_tail + piece
+        cut = len(text) // 4 * 4 if end < 0 else len(text)
+        self.b64_tail = text[cut:]
+        if cut > 0:
+            events.append((
+                "data",
+                self.streaming,
+                binascii.a2b_base64(text[:cut]),
+            ))
+        if end < 0:
+            return False
+        self.pos = end + 1
+        self.streaming = None
+        self._value_done()
+        return True
+
+    def _close(self, events: list):
+        frame = self.stack.pop()
+        self.pos += 1
+        path = frame["path"]
+        depth = self.account_depth
+        if len(path) == depth and _matches(path, self.data_path):
+            events.append(("end", path[depth - 1]))
+        self._value_done()
+
+    def _value_done(self):
+        if len(self.stack) == 0:
+            self.done = True
+        else:
+            self.stack[-1]["state"] = "comma"
+
+    def _expect(self, c: str, expected: str):
+        if c != expected:
+            raise ValueError(
+                f"Expected '{expected}' at position {self.pos}, found '{c}'"
+            )
+        self.pos += 1
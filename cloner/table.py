@@ -0,0 +1,173 @@
+import csv
+import importlib.util
+import os
+
+from solders.pubkey import Pubkey
+
+FORMATS = ["csv", "parquet"]
+
+# Columns of every table written to bundles and profiles. In Parquet, pubkeys
+# and SHA-256 digests are stored as fixed 32-byte binary and slots as u64.
+# CSV files have no header and keep the same column order, with digests in
+# hex.
+SCHEMAS = {
+    "bpf_loader": [("program_id", "pubkey")],
+    "bpf_loader_2": [("program_id", "pubkey")],
+    "bpf_loader_3": [("program_id", "pubkey")],
+    "bpf_loader_3_with_data_keys": [
+        ("program_id", "pubkey"),
+        ("programdata_id", "pubkey"),
+    ],
+    "bpf_loader_3_keys_with_slots": [
+        ("program_id", "pubkey"),
+        ("slot", "u64"),
+    ],
+    "bpf_loader_3_data_keys_with_slots": [
+        ("programdata_id", "pubkey"),
+        ("slot", "u64"),
+    ],
+    # Immutable programs have no authority, left empty (or null).
+    "bpf_loader_3_keys_with_authorities": [
+        ("program_id", "pubkey"),
+        ("authority", "pubkey"),
+    ],
+    "sorted_programs": [
+        ("slot", "u64"),
+        ("program_id", "pubkey"),
+        ("loader", "u8"),
+    ],
+    # Each program's last signature, left empty (or null) if it has none,
+    # which the next `sort` only searches back to.
+    "last_signatures": [
+        ("program_id", "pubkey"),
+        ("slot", "u64"),
+        ("signature", "str"),
+    ],
+    # Written by `verify`. Sizes are in bytes, and section sizes are summed
+    # by kind.
+    "elf_index": [
+        ("program_id", "pubkey"),
+        ("loader", "u8"),
+        ("status", "str"),
+        ("file_size", "u64"),
+        ("elf_size", "u64"),
+        ("sha256", "sha256"),
+        ("text_size", "u64"),
+        ("rodata_size", "u64"),
+        ("data_size", "u64"),
+        ("bss_size", "u64"),
+    ],
+}
+
+# Column kinds read from CSV as they are, rather than as integers.
+TEXT_KINDS = ["pubkey", "sha256", "str"]
+
+def parquet_supported() -> bool:
+    # Checked without importing `pyarrow`, which is slow to load.
+    return importlib.util.find_spec("pyarrow") is not None
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return (pyarrow, pyarrow.parquet)
+
+def table_path(dir_path, name, fmt):
+    return dir_path / f"{name}.{fmt}"
+
+def table_format(dir_path, name):
+    """
+    Returns the format a table was written in, or `None` if it does not
+    exist. Parquet is preferred if both exist.
+    """
+    for fmt in reversed(FORMATS):
+        if table_path(dir_path, name, fmt).exists():
+            return fmt
+    return None
+
+def write_table(dir_path, name, rows, fmt="csv"):
+    """
+    Writes `rows` to the table `name` in `dir_path`, replacing it in any
+    format. The file is written to a temporary path first, so an existing
+    table is always complete.
+    """
+    path = table_path(dir_path, name, fmt)
+    tmp_path = f"{path}.tmp"
+    rows = list(rows)
+    if fmt == "csv":
+        with open(tmp_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            for row in rows:
+                writer.writerow(row)
+    else:
+        (pa, pq) = _pyarrow()
+        schema = SCHEMAS[name]
+        columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(schema)
+        table = pa.table({
+            column: _to_arrow(kind, values)
+            for ((column, kind), values) in zip(schema, columns)
+        })
+        pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    # Drop a stale copy in another format, which readers could pick instead.
+    for other in FORMATS:
+        if other != fmt and table_path(dir_path, name, other).exists():
+            os.remove(table_path(dir_path, name, other))
+
+def read_table(dir_path, name) -> list:
+    """
+    Reads the table `name` from `dir_path` in whichever format it was written,
+    as rows of base58 pubkey strings and integers.
+    """
+    schema = SCHEMAS[name]
+    fmt = table_format(dir_path, name)
+    if fmt is None:
+        raise FileNotFoundError(table_path(dir_path, name, "csv"))
+    path = table_path(dir_path, name, fmt)
+    if fmt == "csv":
+        with open(path, "r", newline="") as file:
+            return [
+                [
+                    int(value) if kind not in TEXT_KINDS else value or None
+                    for ((_, kind), value) in zip(schema, row)
+                ]
+                for row in csv.reader(file) if len(row) > 0
+            ]
+    (_, pq) = _pyarrow()
+    table = pq.read_table(path)
+    columns = [
+        _from_arrow(kind, table.column(column))
+        for (column, kind) in schema
+    ]
+    return [list(row) for row in zip(*columns)]
+
+def _to_arrow(kind, values):
+    (pa, _) = _pyarrow()
+    if kind == "pubkey":
+        return pa.array(
+            [
+                bytes(Pubkey.from_string(str(v))) if v is not None else None
+                for v in values
+            ],
+            type=pa.binary(32),
+        )
+    if kind == "sha256":
+        return pa.array(
+            [bytes.fromhex(v) if v is not None else None for v in values],
+            type=pa.binary(32),
+        )
+    if kind == "str":
+        return pa.array(values, type=pa.string())
+    if kind == "u64":
+        return pa.array(values, type=pa.uint64())
+    return pa.array(values, type=pa.uint8())
+
+def _from_arrow(kind, column):
+    values = column.to_pylist()
+    if kind == "pubkey":
+        return [
+            str(Pubkey.from_bytes(v)) if v is not None else None
+            for v in values
+        ]
+    if kind == "sha256":
+        return [v.hex() if v is not None else None for v in values]
+    return values
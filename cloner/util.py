@@ -1,35 +1,278 @@
+from array import array
 from base64 import b64decode
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import csv
+import io
+import itertools
 import os
+import shutil
+import sys
+import threading
+import time
 from pathlib import Path
 from solders.pubkey import Pubkey
 
 from cloner.filters import BPF_LOADER_3_PUBKEY
+from cloner.keys import KEY_LENGTH, KeyTable, key_bytes
+from cloner.table import read_table, table_format, write_table
 
-def get_programdata_address(program_address):
-    program_id = Pubkey.from_string(str(program_address))
-    loader_id = Pubkey.from_string(BPF_LOADER_3_PUBKEY)
-    pda = Pubkey.find_program_address([bytes(program_id)], loader_id)
-    return str(pda[0])
+BPF_LOADER_3_ID = Pubkey.from_string(BPF_LOADER_3_PUBKEY)
+
+# Below this many uncached programs (roughly 0.3s of serial derivation),
+# derivation is not worth the cost of starting worker processes.
+PARALLEL_DERIVATION_THRESHOLD = 20000
+
+def get_programdata_address(program_address) -> bytes:
+    """
+    Derives the Program Data address of a Loader V3 program, as 32 bytes.
+    """
+    pda = Pubkey.find_program_address(
+        [key_bytes(program_address)],
+        BPF_LOADER_3_ID,
+    )
+    return bytes(pda[0])
+
+def _get_programdata_address_chunk(program_addresses):
+    # Keys cross the process boundary as one block of 32-byte records.
+    return b"".join(
+        get_programdata_address(program_addresses[i:i + KEY_LENGTH])
+        for i in range(0, len(program_addresses), KEY_LENGTH)
+    )
+
+def get_programdata_addresses(program_addresses) -> KeyTable:
+    """
+    Returns the Program Data address of each program, in order. Derivations
+    never change, so they are kept in a persistent cache and only uncached
+    programs are derived, across all cores for large sets.
+    """
+    if not isinstance(program_addresses, KeyTable):
+        program_addresses = KeyTable(program_addresses)
+    cache_path = cache_full_path() / "programdata_addresses.csv"
+    (cached_keys, cached_data_keys) = (KeyTable(), KeyTable())
+    if cache_path.exists():
+        with open(cache_path, "r", newline="") as file:
+            # Caches written before it was replaced whole can end in a row
+            # cut short by a crash, which is dropped even if it decodes.
+            lines = [
+                line for line in file.read().splitlines(keepends=True)
+                if line.endswith("\n")
+            ]
+        for row in csv.reader(lines):
+            try:
+                (key, data_key) = (key_bytes(row[0]), key_bytes(row[1]))
+            except (IndexError, ValueError):
+                continue
+            cached_keys.append(key)
+            cached_data_keys.append(data_key)
+    cached = [cached_keys.find(k) for k in _key_bytes(program_addresses)]
+    uncached = KeyTable()
+    seen = set()
+    for (i, idx) in enumerate(cached):
+        key = program_addresses.key_bytes(i)
+        if idx is None and key not in seen:
+            seen.add(key)
+            uncached.append(key)
+    workers = os.cpu_count() or 1
+    if len(uncached) >= PARALLEL_DERIVATION_THRESHOLD and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            blocks = chunked_bytes(
+                uncached.data,
+                KEY_LENGTH * -(-len(uncached) // (workers * 4)),
+            )
+            derived = b"".join(
+                executor.map(_get_programdata_address_chunk, blocks)
+            )
+    else:
+        derived = _get_programdata_address_chunk(bytes(uncached.data))
+    derived = KeyTable(
+        derived[i:i + KEY_LENGTH]
+        for i in range(0, len(derived), KEY_LENGTH)
+    )
+    if len(uncached) > 0:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        buffer = io.StringIO(newline="")
+        writer = csv.writer(buffer)
+        writer.writerows(zip(cached_keys, cached_data_keys))
+        writer.writerows(zip(uncached, derived))
+        write_atomic(cache_path, buffer.getvalue().encode("utf-8"))
+    data_keys = KeyTable()
+    for (i, idx) in enumerate(cached):
+        if idx is not None:
+            data_keys.append(cached_data_keys.key_bytes(idx))
+        else:
+            key = program_addresses.key_bytes(i)
+            data_keys.append(derived.key_bytes(uncached.find(key)))
+    return data_keys
+
+def _key_bytes(table):
+    for i in range(len(table)):
+        yield table.key_bytes(i)
+
+def chunked_bytes(data, size):
+    """
+    Yields `data` in blocks of up to `size` bytes.
+    """
+    size = max(size, 1)
+    for i in range(0, len(data), size):
+        yield bytes(data[i:i + size])
+
+class ProgramDataIndex:
+    """
+    Index between Loader V3 program keys and their Program Data keys, kept as
+    two parallel `KeyTable`s, so data fetched by Program Data key joins back
+    to programs by binary search.
+    """
+    def __init__(self, keys_with_data_keys=()):
+        self.program_keys = KeyTable()
+        self.data_key_table = KeyTable()
+        for (k, dk) in keys_with_data_keys:
+            self.program_keys.append(k)
+            self.data_key_table.append(dk)
+
+    @staticmethod
+    def from_tables(program_keys, data_keys) -> "ProgramDataIndex":
+        """
+        Builds an index from parallel tables of program and Program Data
+        keys.
+        """
+        index = ProgramDataIndex()
+        (index.program_keys, index.data_key_table) = (program_keys, data_keys)
+        return index
+
+    def __len__(self):
+        return len(self.program_keys)
+
+    def __iter__(self):
+        return zip(self.program_keys, self.data_key_table)
+
+    def program_key(self, data_key):
+        """
+        Returns the program key for a Program Data key, or `None`.
+        """
+        idx = self.data_key_table.find(data_key)
+        return self.program_keys.key(idx) if idx is not None else None
+
+    def data_keys(self, program_keys=None) -> KeyTable:
+        """
+        Returns the Program Data keys of `program_keys`, or of every program,
+        in index order.
+        """
+        if program_keys is None:
+            return self.data_key_table
+        if not isinstance(program_keys, KeyTable):
+            program_keys = KeyTable(program_keys)
+        return self.data_key_table.take(
+            i for i in range(len(self))
+            if self.program_keys.key_bytes(i) in program_keys
+        )
+
+    def join(self, data_keys_with_slots) -> KeyTable:
+        """
+        Maps `(data_key, slot)` pairs to a table of program keys with slots,
+        in index order. Programs without a slot are left out.
+        """
+        slots = array("Q", bytes(8 * len(self)))
+        found = bytearray(len(self))
+        for (dk, slot) in data_keys_with_slots:
+            idx = self.data_key_table.find(dk)
+            if idx is not None:
+                (slots[idx], found[idx]) = (slot, 1)
+        table = self.program_keys.take(
+            i for i in range(len(self)) if found[i]
+        )
+        table.slots = array("Q", (
+            slots[i] for i in range(len(self)) if found[i]
+        ))
+        return table
 
 def bundle_full_path(bundle_name) -> Path:
     return Path(os.getcwd()) / "bundles" / bundle_name
 
+def cache_full_path() -> Path:
+    return Path(os.getcwd()) / "cache"
+
+def store_full_path() -> Path:
+    return Path(os.getcwd()) / "bundles" / ".store"
+
 def init_bundle(bundle_name):
     full_path = bundle_full_path(bundle_name)
     full_path.mkdir(parents=True, exist_ok=True)
     print(f"Initialized bundle '{bundle_name}'.")
 
-def write_to_bundle_csv(bundle_name, filename, data_list):
-    full_path = bundle_full_path(bundle_name) / filename
-    with open(full_path, 'w', newline='') as file:
-        writer = csv.writer(file)
-        for data in data_list:
-            writer.writerow(data)
+def write_to_bundle_table(bundle_name, name, data_list, fmt="csv"):
+    write_table(bundle_full_path(bundle_name), name, data_list, fmt)
+
+def read_bundle_table(bundle_name, name):
+    return read_table(bundle_full_path(bundle_name), name)
+
+def bundle_table_exists(bundle_name, name) -> bool:
+    return table_format(bundle_full_path(bundle_name), name) is not None
+
+def write_atomic(path, data):
+    """
+    Writes `data` to `path` through a temporary file, so `path` never holds a
+    partial write. The temporary file is named after the writing process and
+    thread, so concurrent writers of the same path, such as workers putting
+    the same ELF in the store, each replace it whole.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def link_or_copy(src, dst):
+    """
+    Hard-links `src` to `dst`. Falls back to `copy_file_range`, which reflinks
+    on filesystems that support it, and then to a plain copy.
+    """
+    tmp_path = f"{dst}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        with open(src, "rb") as src_file, open(tmp_path, "wb") as dst_file:
+            try:
+                remaining = os.fstat(src_file.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        src_file.fileno(),
+                        dst_file.fileno(),
+                        remaining,
+                    )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except (AttributeError, OSError):
+                src_file.seek(0)
+                dst_file.seek(0)
+                dst_file.truncate()
+                shutil.copyfileobj(src_file, dst_file)
+    os.replace(tmp_path, dst)
 
 def le_to_u64(data) -> int:
     return int.from_bytes(data, byteorder='little')
 
+# Loader V3 Program Data header: a 4-byte enum, the deployment slot (u64), and
+# the optional upgrade authority (1 + 32 bytes). The ELF follows it.
+PROGRAMDATA_HEADER_LENGTH = 45
+
+def read_programdata_header(header):
+    """
+    Returns the deployment slot and upgrade authority (or `None`) from a
+    Program Data header.
+    """
+    slot = le_to_u64(header[4:12])
+    if header[12] == 0:
+        return (slot, None)
+    return (slot, str(Pubkey.from_bytes(bytes(header[13:45]))))
+
 def profile_full_path(profile_name) -> Path:
     return Path(os.getcwd()) / "profiles" / profile_name
 
@@ -38,9 +281,114 @@ def init_profile(profile_name):
     full_path.mkdir(parents=True, exist_ok=True)
     print(f"Initialized profile '{profile_name}'.")
 
-def write_to_profile_csv(profile_name, filename, data_list):
-    full_path = profile_full_path(profile_name) / filename
-    with open(full_path, 'w', newline='') as file:
-        writer = csv.writer(file)
-        for data in data_list:
-            writer.writerow(data)
\ No newline at end of file
+def write_to_profile_table(profile_name, name, data_list, fmt="csv"):
+    write_table(profile_full_path(profile_name), name, data_list, fmt)
+
+def chunked(items, size):
+    """
+    Yields lists of up to `size` items from `items`.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+def imap_bounded(fn, items, concurrency):
+    """
+    Maps `fn` over `items` on a thread pool, keeping at most `concurrency`
+    calls in flight. Results are yielded in input order.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+class Progress:
+    """
+    Periodically prints how many of `total` items are done, along with the
+    throughput and estimated time remaining.
+
+    With `bar`, progress is drawn as a single bar redrawn in place on stderr
+    instead, which is only worth it on a terminal.
+    """
+    def __init__(self, verb, total, noun="programs", interval=1.0, bar=False):
+        self.verb = verb
+        self.noun = noun
+        self.total = total
+        self.bar = bar
+        self.interval = 0.2 if bar else interval
+        self.count = 0
+        self.started = time.monotonic()
+        self.printed = self.started
+        self.closed = False
+
+    def update(self, count):
+        self.count += count
+        now = time.monotonic()
+        if now - self.printed >= self.interval or self.count >= self.total:
+            self.printed = now
+            if self.bar:
+                self._draw(now)
+            else:
+                print(f"    {self.report(now)}")
+
+    def track(self, items):
+        """
+        Yields `items`, counting each one as done once the caller is through
+        with it.
+        """
+        for item in items:
+            yield item
+            self.update(1)
+        self.close()
+
+    def close(self):
+        """
+        Ends the bar's line, if items ran out before `total`.
+        """
+        if self.bar and not self.closed:
+            self._draw(time.monotonic())
+            print(file=sys.stderr)
+            self.closed = True
+
+    def _draw(self, now):
+        width = 30
+        share = min(self.count / self.total, 1.0) if self.total > 0 else 1.0
+        filled = int(share * width)
+        print(
+            f"\r    [{'#' * filled}{'.' * (width - filled)}] {share:4.0%} "
+            f"{self.report(now)}",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
+        if self.count >= self.total and not self.closed:
+            print(file=sys.stderr)
+            self.closed = True
+
+    def report(self, now=None) -> str:
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.count / elapsed
+        if rate > 0:
+            eta = format_duration((self.total - self.count) / rate)
+        else:
+            eta = "?"
+        return (
+            f"{self.verb} {self.count}/{self.total} {self.noun} "
+            f"({rate:.1f}/s, ETA {eta})"
+        )
+
+def format_duration(seconds) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
@@ -0,0 +1,269 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+import mmap
+import os
+import struct
+import sys
+
+from cloner.filters import ELF_MAGIC
+
+from .checkpoint import read_manifest, write_manifest
+from .pack import LOADERS, is_packed
+from .store import ElfStore
+from .util import Progress, bundle_full_path, chunked, store_full_path, \
+    write_atomic, write_to_bundle_table
+
+# ELF files checked by each worker task.
+CHUNK_SIZE = 256
+
+# Below this many ELFs, checking them is not worth the cost of starting
+# worker processes.
+PARALLEL_VERIFY_THRESHOLD = 2000
+
+# ELF64 file, program and section headers, little-endian, as used by sBPF.
+ELF_HEADER = struct.Struct("<4sBBB9xHHIQQQIHHHHHH")
+PROGRAM_HEADER = struct.Struct("<IIQQQQQQ")
+SECTION_HEADER = struct.Struct("<IIQQQQIIQQ")
+
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+EV_CURRENT = 1
+PT_NULL = 0
+SHT_NULL = 0
+SHT_NOBITS = 8
+SHF_EXECINSTR = 0x4
+
+# Statuses of an ELF in the index. `padded` ELFs are followed by zeros, which
+# `trimmed` ones had removed. Anything other than these three is broken.
+VALID_STATUSES = ["ok", "padded", "trimmed"]
+
+def inspect_elf(data):
+    """
+    Validates the ELF at the start of `data`, and returns its status, its
+    true length, which `data` may run past, and its text, read-only data,
+    data and bss section sizes.
+
+    The true length is the end of whatever lies furthest into the file: the
+    program or section header table, or the contents of a segment or
+    section.
+    """
+    sizes = (0, 0, 0, 0)
+    if len(data) < ELF_HEADER.size:
+        status = "truncated" if data[:4] == ELF_MAGIC[:len(data)] \
+            and len(data) > 0 else "not_elf"
+        return (status, 0, sizes)
+    (
+        magic, elf_class, elf_data, elf_version, _, _, _, _, phoff, shoff, _,
+        ehsize, phentsize, phnum, shentsize, shnum, shstrndx,
+    ) = ELF_HEADER.unpack_from(data)
+    if magic != ELF_MAGIC:
+        return ("not_elf", 0, sizes)
+    if (
+        elf_class != ELFCLASS64
+        or elf_data != ELFDATA2LSB
+        or elf_version != EV_CURRENT
+        or ehsize != ELF_HEADER.size
+        or (phnum > 0 and phentsize != PROGRAM_HEADER.size)
+        or (shnum > 0 and shentsize != SECTION_HEADER.size)
+        or (shnum > 0 and shstrndx >= shnum)
+    ):
+        return ("bad_header", 0, sizes)
+
+    end = ELF_HEADER.size
+    if phnum > 0:
+        end = max(end, phoff + phnum * PROGRAM_HEADER.size)
+    if shnum > 0:
+        end = max(end, shoff + shnum * SECTION_HEADER.size)
+    if end > len(data):
+        return ("truncated", end, sizes)
+
+    for i in range(phnum):
+        (p_type, _, p_offset, _, _, p_filesz, _, _) = \
+            PROGRAM_HEADER.unpack_from(data, phoff + i * PROGRAM_HEADER.size)
+        if p_type != PT_NULL:
+            end = max(end, p_offset + p_filesz)
+    sections = [
+        SECTION_HEADER.unpack_from(data, shoff + i * SECTION_HEADER.size)
+        for i in range(shnum)
+    ]
+    for (_, sh_type, _, _, sh_offset, sh_size, _, _, _, _) in sections:
+        if sh_type not in (SHT_NULL, SHT_NOBITS):
+            end = max(end, sh_offset + sh_size)
+    if end > len(data):
+        return ("truncated", end, sizes)
+
+    (text, rodata, rwdata, bss) = (0, 0, 0, 0)
+    if shnum > 0:
+        names_offset = sections[shstrndx][4]
+        names_end = names_offset + sections[shstrndx][5]
+    for (sh_name, sh_type, sh_flags, _, _, sh_size, _, _, _, _) in sections:
+        if sh_type == SHT_NULL:
+            continue
+        if names_offset + sh_name >= names_end:
+            return ("bad_header", end, sizes)
+        name = bytes(data[
+            names_offset + sh_name:
+            min(names_offset + sh_name + 64, names_end)
+        ]).split(b"\0", 1)[0]
+        if sh_flags & SHF_EXECINSTR:
+            text += sh_size
+        elif sh_type == SHT_NOBITS or name.startswith(b".bss"):
+            bss += sh_size
+        elif name.startswith(b".rodata") or name == b".data.rel.ro":
+            rodata += sh_size
+        elif name.startswith(b".data"):
+            rwdata += sh_size
+    return ("ok", end, (text, rodata, rwdata, bss))
+
+def verify_elf(path, trim=False, store_path=None):
+    """
+    Checks the ELF file at `path` through a read-only memory map, trimming
+    zero padding past its true length if `trim`, and returns its status,
+    file size, ELF length, SHA-256 digest (of the file as left on disk), and
+    section sizes.
+
+    A trimmed ELF is written to a new file, never in place, so bundles and
+    the ELF store sharing it through hard links keep their copy. If it was
+    linked from the store at `store_path`, the trimmed ELF is put in the
+    store and linked instead.
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        return ("not_elf", 0, 0, sha256().hexdigest(), (0, 0, 0, 0))
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            (status, length, sizes) = inspect_elf(data)
+            padding = data[length:] if status == "ok" else b""
+            if len(padding) > 0:
+                # Anything but zeros past the ELF is not padding.
+                status = "padded" if padding.count(0) == len(padding) \
+                    else "trailing_data"
+            with memoryview(data) as view:
+                if status == "padded" and trim:
+                    with view[:length] as elf:
+                        digest = sha256(elf).hexdigest()
+                        trimmed = bytes(elf)
+                    old_digest = sha256(view).hexdigest()
+                else:
+                    digest = sha256(view).hexdigest()
+    if status == "padded" and trim:
+        store = ElfStore(store_path) if store_path is not None else None
+        if (
+            store is not None
+            and store.blob_path(old_digest).exists()
+            and os.path.samefile(store.blob_path(old_digest), path)
+        ):
+            store.put(trimmed, digest)
+            store.link(digest, path)
+        else:
+            write_atomic(path, trimmed)
+        status = "trimmed"
+        file_size = length
+    return (status, file_size, length, digest, sizes)
+
+def _verify_chunk(args):
+    (paths, trim, store_path) = args
+    return [verify_elf(path, trim, store_path) for path in paths]
+
+def _record(bundle_name, elfs, results, fmt):
+    """
+    Writes the results of the ELFs verified so far, the first
+    `len(results)` of `elfs`, to the checkpoint and the `elf_index` table,
+    and returns their counts by status.
+    """
+    rows = []
+    counts = {}
+    manifest = read_manifest(bundle_name)
+    for ((loader, loader_number, path), result) in zip(elfs, results):
+        (status, file_size, length, digest, sizes) = result
+        program_id = path.stem
+        rows.append([
+            program_id, loader_number, status, file_size, length, digest,
+            *sizes,
+        ])
+        counts[status] = counts.get(status, 0) + 1
+        if status in VALID_STATUSES:
+            if (loader, program_id) in manifest:
+                manifest[(loader, program_id)] = digest
+        else:
+            print(f"WARN: {loader}/{path.name}: {status}", file=sys.stderr)
+            # Left out of the checkpoint, so a resumed clone fetches it again.
+            manifest.pop((loader, program_id), None)
+    write_manifest(bundle_name, manifest)
+    write_to_bundle_table(bundle_name, "elf_index", rows, fmt)
+    return counts
+
+def verify(
+    bundle_name,
+    trim=True,
+    processes=None,
+    fmt="csv",
+    progress_bar=False,
+):
+    bundle_path = bundle_full_path(bundle_name)
+    if not bundle_path.exists():
+        print(f"Bundle '{bundle_name}' does not exist.", file=sys.stderr)
+        sys.exit(1)
+    if is_packed(bundle_path):
+        # ELFs are trimmed and rewritten in place, which a pack cannot do.
+        print(
+            f"Bundle '{bundle_name}' is packed. Unpack it with "
+            f"`unpack {bundle_name} --remove-pack` to verify it.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    processes = processes if processes is not None else os.cpu_count() or 1
+    store_path = store_full_path() if store_full_path().exists() else None
+
+    print("Verifying bundle ELFs...")
+    print(f"    Bundle Name     : {bundle_name}")
+    print(f"    Trim Padding    : {'yes' if trim else 'no'}")
+    print(f"    Processes       : {processes}")
+    print(f"    Format          : {fmt}")
+
+    elfs = []
+    for (loader, loader_number) in LOADERS:
+        dir = bundle_path / loader
+        if not dir.exists():
+            continue
+        elfs.extend(
+            (loader, loader_number, path)
+            for path in sorted(dir.glob("*.elf"))
+        )
+    print(f"Found {len(elfs)} ELFs")
+
+    # Each worker maps and checks a chunk of files at a time, so gigabytes
+    # of ELFs are read in parallel without being copied into Python.
+    chunks = (
+        ([str(path) for (_, _, path) in chunk], trim, store_path)
+        for chunk in chunked(elfs, CHUNK_SIZE)
+    )
+    progress = Progress("Verified", len(elfs), "ELFs", bar=progress_bar)
+    results = []
+    try:
+        if len(elfs) >= PARALLEL_VERIFY_THRESHOLD and processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for chunk in executor.map(_verify_chunk, chunks):
+                    results.extend(chunk)
+                    progress.update(len(chunk))
+        else:
+            for chunk in map(_verify_chunk, chunks):
+                results.extend(chunk)
+                progress.update(len(chunk))
+    finally:
+        progress.close()
+        # ELFs already trimmed keep their new digests in the checkpoint even
+        # if a later chunk fails.
+        counts = _record(bundle_name, elfs, results, fmt)
+
+    print("ELFs by status:")
+    for (status, count) in sorted(counts.items()):
+        print(f"    {status:<16}: {count}")
+    broken = len(elfs) - sum(counts.get(s, 0) for s in VALID_STATUSES)
+    if broken > 0:
+        print(
+            f"{broken} ELFs are broken. They were dropped from the "
+            f"checkpoint, so `clone {bundle_name} --resume` downloads them "
+            "again.",
+            file=sys.stderr,
+        )